@@ -1,6 +1,30 @@
 from flask import Flask
+import os
 
 app = Flask(__name__)
 
 app.secret_key = "chess app   ipuhfv -139487gbq"
 
+# cost of password hashing: 2 ** BCRYPT_LOG_ROUNDS rounds
+# passwords hashed with another cost are hashed again at the next login
+app.config["BCRYPT_LOG_ROUNDS"] = int(os.environ.get("BCRYPT_LOG_ROUNDS", 12))
+# number of threads that hash and check passwords
+app.config["PASSWORD_WORKERS"] = int(os.environ.get("PASSWORD_WORKERS", 2))
+
+
+# queries slower than SLOW_QUERY_THRESHOLD seconds are logged,
+# and a fraction QUERY_SAMPLE_RATE (0.0 - 1.0) of the others (see config/query_metrics.py)
+app.config["SLOW_QUERY_THRESHOLD"] = float(os.environ.get("SLOW_QUERY_THRESHOLD", 0.1))
+app.config["QUERY_SAMPLE_RATE"] = float(os.environ.get("QUERY_SAMPLE_RATE", 0.0))
+# the users who can see /admin/stats, comma separated emails
+app.config["ADMIN_EMAILS"] = [email.strip() for email in os.environ.get("ADMIN_EMAILS", "").split(",") if email.strip()]
+
+
+# the computer opponent (see models/bot.py): the user with BOT_EMAIL
+# a reply is searched for at most BOT_TIME_LIMIT seconds and BOT_NODE_LIMIT nodes
+# by the analysis service (helpers/analysis.py), in its own processes;
+# BOT_WORKERS threads wait for the replies and store them
+app.config["BOT_EMAIL"] = os.environ.get("BOT_EMAIL", "bot@chess.local")
+app.config["BOT_TIME_LIMIT"] = float(os.environ.get("BOT_TIME_LIMIT", 1.0))
+app.config["BOT_NODE_LIMIT"] = int(os.environ.get("BOT_NODE_LIMIT", 200000))
+app.config["BOT_WORKERS"] = int(os.environ.get("BOT_WORKERS", 2))
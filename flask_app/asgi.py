@@ -0,0 +1,278 @@
+#******************************************************************************
+#
+# ASGI application: an optional way to serve the app with asyncio
+#     pip install -r requirements-asgi.txt
+#     python server_asgi.py         or: uvicorn server_asgi:application --port 5001
+#
+# the JSON API of the play page is handled here with async functions,
+# using aiomysql (see config/aiomysqlconnection.py):
+#     POST /api/games/move
+#     GET  /api/games/<game_id>/state
+#     GET  /api/games/<game_id>/events
+#     GET  /api/games/<game_id>/legal_moves
+# an open event stream or a request waiting for the database
+# does not occupy a thread
+#
+# all other requests go to the Flask app (the same routes as server.py),
+# which runs in a thread pool (asgiref's WsgiToAsgi)
+#
+# the user is identified by the Flask session cookie
+#
+#******************************************************************************
+
+import asyncio
+import json
+import re
+from http.cookies import SimpleCookie
+from urllib.parse import parse_qs
+
+from itsdangerous import BadSignature
+
+try:
+    from asgiref.wsgi import WsgiToAsgi
+except ImportError:
+    WsgiToAsgi = None
+
+from flask_app import app
+from flask_app.controllers import users_controller, games_controller, admin_controller
+from flask_app.config import aiomysqlconnection
+from flask_app.config.mysqlconnection import ConcurrentUpdate
+from flask_app.models.game import Game, Move
+from flask_app.models import bot
+from flask_app.helpers import chess_rules
+from flask_app.helpers.game_events import game_events, MAX_QUEUED_EVENTS
+
+# seconds between keepalive comments on an event stream
+EVENTS_KEEPALIVE = games_controller.EVENTS_KEEPALIVE
+
+
+#******************************************************************************
+#
+# helpers
+#
+#******************************************************************************
+
+# the Flask session of the request, {} if there is no valid session cookie
+def get_session(scope):
+    cookies = SimpleCookie()
+    for name, value in scope["headers"]:
+        if name == b"cookie":
+            cookies.load(value.decode("latin-1"))
+
+    cookie = cookies.get(app.config["SESSION_COOKIE_NAME"])
+    if cookie is None:
+        return {}
+
+    serializer = app.session_interface.get_signing_serializer(app)
+    try:
+        return serializer.loads(cookie.value, max_age=int(app.permanent_session_lifetime.total_seconds()))
+    except BadSignature:
+        return {}
+
+async def read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+async def send_json(send, status, data):
+    body = json.dumps(data).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+    })
+    await send({"type": "http.response.body", "body": body})
+
+# the game, if the user is one of its players; None otherwise
+async def get_game(game_id, user_id):
+    rows = await aiomysqlconnection.query_db(Game.db, Game.select_games + "WHERE games.id = %(game_id)s;",
+                                             {"game_id": game_id})
+    if not rows:
+        return None
+
+    this_game = Game.construct_from_query_result(rows[0], user_id)
+    if user_id not in [this_game.user_id, this_game.opponent_id]:
+        return None
+
+    return this_game
+
+async def get_moves_since(game_id, since, count=Game.all_moves):
+    rows = await aiomysqlconnection.query_db(Game.db, Game.select_moves_since,
+                                             {"game_id": game_id, "since": since, "count": count})
+    return [Move(row) for row in rows]
+
+
+# a queue for game_events that can be filled from any thread:
+# the events are handed to the event loop that reads them
+class LoopQueue():
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=MAX_QUEUED_EVENTS)
+
+    def put_nowait(self, event):
+        self.loop.call_soon_threadsafe(self.put, event)
+
+    def put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            pass
+
+
+#******************************************************************************
+#
+# routes, the same responses as the routes in games_controller.py
+#
+#******************************************************************************
+
+async def make_move(scope, receive, send, session):
+    data = json.loads(await read_body(receive))
+
+    game_id = int(data['game_id'])
+    from_row = int(data['move_from'][0])
+    from_col = int(data['move_from'][1])
+    to_row = int(data['move_to'][0])
+    to_col = int(data['move_to'][1])
+
+    this_game = await get_game(game_id, session["user_id"])
+    if this_game is None or not this_game.is_current_player_turn:
+        return await send_json(send, 403, {})
+
+    # the rules of chess take milliseconds, they run on the event loop
+    if not chess_rules.is_valid_move(this_game.game_state, from_row, from_col, to_row, to_col):
+        return await send_json(send, 400, {})
+
+    # prepare_move and bot.reply can query the database with pymysql (the moves of a game
+    # that ends, to count its result in position_index; the bot user, once per process):
+    # they run in the loop's thread pool, so that the event loop is not blocked
+    loop = asyncio.get_running_loop()
+    queries, event = await loop.run_in_executor(None, this_game.prepare_move, from_row, from_col, to_row, to_col)
+    try:
+        await aiomysqlconnection.query_db_transaction(Game.db, queries, Game.move_checked)
+    except ConcurrentUpdate:
+        # another move was made in the game since it was read
+        return await send_json(send, 409, {})
+    this_game.move_made(queries, event)
+    await loop.run_in_executor(None, bot.reply, this_game)
+
+    await send_json(send, 201, {})
+
+async def game_state(scope, receive, send, session, game_id):
+    since = parse_qs(scope["query_string"].decode()).get("since", [""])[0]
+    since = int(since) if since.lstrip("-").isdigit() else None
+
+    # the game and the moves after since are independent queries
+    # (one move more than a client can be sent as changes only, see is_incremental)
+    if since is not None and since >= 0:
+        this_game, moves = await asyncio.gather(get_game(game_id, session["user_id"]),
+                                                get_moves_since(game_id, since, games_controller.MAX_INCREMENTAL_PLIES + 1))
+    else:
+        this_game, moves = await get_game(game_id, session["user_id"]), None
+    if this_game is None:
+        return await send_json(send, 403, {})
+
+    if not games_controller.is_incremental(this_game, since):
+        moves = None
+
+    await send_json(send, 200, games_controller.game_state_dict(this_game, since, moves))
+
+async def game_legal_moves(scope, receive, send, session, game_id):
+    this_game = await get_game(game_id, session["user_id"])
+    if this_game is None:
+        return await send_json(send, 403, {})
+
+    moves = {}
+    if int(this_game.status) < 4 and this_game.is_current_player_turn:
+        moves = chess_rules.legal_destinations(this_game.game_state)
+
+    await send_json(send, 200, {"game_id": game_id, "ply": this_game.ply, "moves": moves})
+
+async def game_events_stream(scope, receive, send, session, game_id):
+    this_game = await get_game(game_id, session["user_id"])
+    if this_game is None:
+        return await send_json(send, 403, {})
+
+    # subscribe before the stream starts, so that no move is missed
+    events = LoopQueue(asyncio.get_running_loop())
+    game_events.subscribe(game_id, events)
+
+    # the client closes the stream by disconnecting
+    async def wait_for_disconnect():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+    disconnected = asyncio.ensure_future(wait_for_disconnect())
+
+    try:
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"text/event-stream"), (b"cache-control", b"no-cache"),
+                        (b"x-accel-buffering", b"no")]
+        })
+        first_event = {"game_id": game_id, "ply": this_game.ply, "status": int(this_game.status)}
+        await send({"type": "http.response.body", "more_body": True,
+                    "body": f"event: game\ndata: {json.dumps(first_event)}\n\n".encode()})
+
+        while not disconnected.done():
+            next_event = asyncio.ensure_future(events.queue.get())
+            await asyncio.wait([next_event, disconnected], timeout=EVENTS_KEEPALIVE,
+                               return_when=asyncio.FIRST_COMPLETED)
+            if next_event.done():
+                event = next_event.result()
+                body = f"id: {event['ply']}\nevent: move\ndata: {json.dumps(event)}\n\n"
+            else:
+                next_event.cancel()
+                body = ": keepalive\n\n"
+            if not disconnected.done():
+                await send({"type": "http.response.body", "body": body.encode(), "more_body": True})
+    finally:
+        game_events.unsubscribe(game_id, events)
+        disconnected.cancel()
+
+
+# (method, path, handler)
+# the groups of the path are passed to the handler as int arguments
+routes = [
+    ("POST", re.compile(r"/api/games/move"), make_move),
+    ("GET", re.compile(r"/api/games/(\d+)/state"), game_state),
+    ("GET", re.compile(r"/api/games/(\d+)/legal_moves"), game_legal_moves),
+    ("GET", re.compile(r"/api/games/(\d+)/events"), game_events_stream),
+]
+
+
+#******************************************************************************
+#
+# the ASGI application
+#
+#******************************************************************************
+
+flask_application = WsgiToAsgi(app) if WsgiToAsgi is not None else None
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await aiomysqlconnection.close_pools()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    if scope["type"] == "http":
+        for method, path, handler in routes:
+            match = path.fullmatch(scope["path"])
+            if match and scope["method"] == method:
+                session = get_session(scope)
+                if not session.get("is_logged_in"):
+                    return await send_json(send, 401, {})
+                return await handler(scope, receive, send, session, *[int(group) for group in match.groups()])
+
+    if flask_application is None:
+        raise RuntimeError("the ASGI mode needs asgiref for the Flask routes: pip install -r requirements-asgi.txt")
+
+    await flask_application(scope, receive, send)
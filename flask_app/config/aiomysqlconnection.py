@@ -0,0 +1,109 @@
+#******************************************************************************
+#
+# asyncio version of mysqlconnection.py, used by the async API (flask_app/asgi.py)
+# queries are sent with aiomysql, an optional dependency:
+#     pip install aiomysql       (or pip install -r requirements-asgi.txt)
+# the connections of each database are kept in an aiomysql pool,
+# with the same limits as the connection pool of mysqlconnection.py
+#
+#******************************************************************************
+
+import asyncio
+import time
+
+try:
+    import aiomysql
+except ImportError:
+    aiomysql = None
+
+from flask_app.config.mysqlconnection import (DB_HOST, DB_USER, DB_PASSWORD,
+                                              POOL_MAX_SIZE, POOL_IDLE_TIMEOUT, query_kind,
+                                              ConcurrentUpdate)
+from flask_app.config.query_metrics import query_metrics, calling_function
+
+# one pool per database, created on first use
+# a pool belongs to the event loop it was created in
+pools = {}
+pools_lock = asyncio.Lock()
+
+async def get_pool(db):
+    if aiomysql is None:
+        raise RuntimeError("the async API needs aiomysql: pip install aiomysql")
+
+    async with pools_lock:
+        if db not in pools:
+            pools[db] = await aiomysql.create_pool(host = DB_HOST,
+                                                   user = DB_USER,
+                                                   password = DB_PASSWORD,
+                                                   db = db,
+                                                   charset = 'utf8mb4',
+                                                   cursorclass = aiomysql.DictCursor,
+                                                   autocommit = True,
+                                                   minsize = 1,
+                                                   maxsize = POOL_MAX_SIZE,
+                                                   pool_recycle = POOL_IDLE_TIMEOUT)
+        return pools[db]
+
+async def close_pools():
+    async with pools_lock:
+        for pool in pools.values():
+            pool.close()
+            await pool.wait_closed()
+        pools.clear()
+
+def pool_stats():
+    return {db: {"size": pool.size, "idle": pool.freesize, "max_size": pool.maxsize}
+            for db, pool in pools.items()}
+
+
+# the same results as MySQLConnection.query_db:
+# the id of the new row for INSERT, a list of dictionaries for SELECT, else None
+async def query_db(db, query, data=None):
+    caller = calling_function()
+    kind = query_kind(query)
+    pool = await get_pool(db)
+    async with pool.acquire() as connection:
+        async with connection.cursor() as cursor:
+            start = time.perf_counter()
+            try:
+                await cursor.execute(query, data)
+                if kind == "insert":
+                    rows, result = cursor.rowcount, cursor.lastrowid
+                elif kind == "select":
+                    result = await cursor.fetchall()
+                    rows = len(result)
+                else:
+                    rows, result = cursor.rowcount, None
+            except Exception as error:
+                query_metrics.record(caller, kind, time.perf_counter() - start, 0,
+                                     lambda: cursor.mogrify(query, data), error)
+                raise
+
+            query_metrics.record(caller, kind, time.perf_counter() - start, rows,
+                                 lambda: cursor.mogrify(query, data))
+            return result
+
+# the same as MySQLConnection.query_db_transaction
+async def query_db_transaction(db, queries, checked=()):
+    caller = calling_function()
+    pool = await get_pool(db)
+    async with pool.acquire() as connection:
+        async with connection.cursor() as cursor:
+            start = time.perf_counter()
+            rows = 0
+            try:
+                await connection.begin()
+                for index, (query, data) in enumerate(queries):
+                    await cursor.execute(query, data)
+                    if index in checked and cursor.rowcount == 0:
+                        raise ConcurrentUpdate(f"no row changed by: {query}")
+                    rows += cursor.rowcount
+                await connection.commit()
+            except Exception as error:
+                await connection.rollback()
+                query_metrics.record(caller, "transaction", time.perf_counter() - start, 0,
+                                     lambda: "; ".join(cursor.mogrify(query, data) for query, data in queries), error)
+                raise
+
+            query_metrics.record(caller, "transaction", time.perf_counter() - start, rows,
+                                 lambda: "; ".join(cursor.mogrify(query, data) for query, data in queries))
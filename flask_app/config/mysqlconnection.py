@@ -1,45 +1,409 @@
 # a cursor is the object we use to interact with the database
 import pymysql.cursors
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from flask_app.config.query_metrics import query_metrics, calling_function
+
+#******************************************************************************
+#
+# connection pool
+# opening a connection to MySQL (TCP + authentication) costs more
+# than most of our queries, so connections are kept open and reused
+# - at most POOL_MAX_SIZE connections per database, also under load,
+#   so that we stay below MySQL's max_connections
+# - a request that finds all connections in use waits for one to be returned
+# - connections that have not been used for POOL_IDLE_TIMEOUT seconds are closed
+# - a connection that has been idle for more than POOL_PING_AFTER seconds
+#   is checked with a ping before it is handed out
+# - long reads (query_db_iter) use connections of their own, outside the pool,
+#   at most POOL_MAX_STREAMS at a time
+#
+#******************************************************************************
+
+# change the user and password as needed
+DB_HOST = 'localhost'
+DB_USER = 'root'
+DB_PASSWORD = 'rootroot'
+
+POOL_MAX_SIZE = 10
+POOL_IDLE_TIMEOUT = 300     # seconds
+POOL_PING_AFTER = 1         # seconds
+POOL_CHECKOUT_TIMEOUT = 10  # seconds
+POOL_MAX_STREAMS = 4
+
+
+# raised when no connection becomes available within the checkout timeout
+class PoolExhausted(Exception):
+    pass
+
+# raised by query_db_transaction when a query that must change a row changed none,
+# e.g. an UPDATE ... WHERE ply = ... of a game in which another move was made meanwhile
+class ConcurrentUpdate(Exception):
+    pass
+
+
+class ConnectionPool():
+
+    def __init__(self, connect, max_size=POOL_MAX_SIZE, idle_timeout=POOL_IDLE_TIMEOUT,
+                 ping_after=POOL_PING_AFTER, checkout_timeout=POOL_CHECKOUT_TIMEOUT,
+                 max_streams=POOL_MAX_STREAMS):
+        # connect() opens a new connection
+        self.connect = connect
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.ping_after = ping_after
+        self.checkout_timeout = checkout_timeout
+        self.max_streams = max_streams
+        # number of open stream connections, see open_stream
+        self.streams = 0
+        # idle connections as (connection, time returned), most recently returned last
+        self.idle = deque()
+        # number of open connections, idle or in use
+        self.size = 0
+        self.condition = threading.Condition()
+        # statistics
+        self.checkouts = 0
+        self.created = 0
+        self.closed = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    # take a connection from the pool, open a new one if there is room,
+    # or wait until another thread returns one
+    def checkout(self):
+        start = time.monotonic()
+        while True:
+            connection, idle_since = None, None
+            with self.condition:
+                self.close_idle_connections()
+                while not self.idle and self.size >= self.max_size:
+                    remaining = self.checkout_timeout - (time.monotonic() - start)
+                    if remaining <= 0:
+                        raise PoolExhausted(f"no database connection available after {self.checkout_timeout} s")
+                    self.condition.wait(remaining)
+
+                if self.idle:
+                    # the most recently used connection is the most likely to be alive
+                    connection, idle_since = self.idle.pop()
+                else:
+                    # reserve a place for the new connection
+                    self.size += 1
+
+            if connection is None:
+                try:
+                    connection = self.connect()
+                except Exception:
+                    self.discard(None)
+                    raise
+                with self.condition:
+                    self.created += 1
+            elif time.monotonic() - idle_since > self.ping_after and not self.is_alive(connection):
+                # health check failed: close it and try again
+                self.discard(connection)
+                continue
+
+            waited = time.monotonic() - start
+            with self.condition:
+                self.checkouts += 1
+                if waited > 0.001:
+                    self.waits += 1
+                self.wait_time += waited
+                self.max_wait_time = max(self.max_wait_time, waited)
+
+            return connection
+
+    # return a connection to the pool
+    def checkin(self, connection):
+        with self.condition:
+            self.idle.append((connection, time.monotonic()))
+            self.condition.notify()
+
+    # close a connection that can not be used any more, making room for a new one
+    def discard(self, connection):
+        if connection is not None:
+            try:
+                connection.close()
+            except Exception:
+                pass
+        with self.condition:
+            self.size -= 1
+            self.closed += 1 if connection is not None else 0
+            self.condition.notify()
+
+    # a connection outside the pool, for a read that can take as long as its reader
+    # (see MySQLConnection.query_db_iter), closed with close_stream
+    # waits while max_streams stream connections are open
+    def open_stream(self):
+        start = time.monotonic()
+        with self.condition:
+            while self.streams >= self.max_streams:
+                remaining = self.checkout_timeout - (time.monotonic() - start)
+                if remaining <= 0:
+                    raise PoolExhausted(f"no stream connection available after {self.checkout_timeout} s")
+                self.condition.wait(remaining)
+            self.streams += 1
+
+        try:
+            return self.connect()
+        except Exception:
+            self.close_stream(None)
+            raise
+
+    def close_stream(self, connection):
+        if connection is not None:
+            try:
+                connection.close()
+            except Exception:
+                pass
+        with self.condition:
+            self.streams -= 1
+            self.condition.notify_all()
+
+    # called with the condition held
+    # the oldest idle connections are at the front of the queue
+    def close_idle_connections(self):
+        now = time.monotonic()
+        while self.idle and now - self.idle[0][1] > self.idle_timeout:
+            connection, idle_since = self.idle.popleft()
+            self.size -= 1
+            self.closed += 1
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+    def is_alive(self, connection):
+        try:
+            connection.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
+
+    # with pool.connection() as connection: ...
+    # the connection is returned to the pool afterwards,
+    # or closed if the database reported a connection problem
+    @contextmanager
+    def connection(self):
+        connection = self.checkout()
+        try:
+            yield connection
+        except (pymysql.err.OperationalError, pymysql.err.InterfaceError):
+            self.discard(connection)
+            raise
+        except Exception:
+            self.checkin(connection)
+            raise
+        else:
+            self.checkin(connection)
+
+    @property
+    def stats(self):
+        with self.condition:
+            return {
+                "size": self.size,
+                "idle": len(self.idle),
+                "in_use": self.size - len(self.idle),
+                "max_size": self.max_size,
+                "streams": self.streams,
+                "checkouts": self.checkouts,
+                "created": self.created,
+                "closed": self.closed,
+                "waits": self.waits,
+                "wait_time": self.wait_time,
+                "max_wait_time": self.max_wait_time,
+                "average_wait_time": self.wait_time / self.checkouts if self.checkouts else 0.0
+            }
+
+
+# one pool per database, created on first use
+pools = {}
+pools_lock = threading.Lock()
+
+def get_pool(db):
+    with pools_lock:
+        if db not in pools:
+            pools[db] = ConnectionPool(lambda: pymysql.connect(host = DB_HOST,
+                                                               user = DB_USER,
+                                                               password = DB_PASSWORD,
+                                                               db = db,
+                                                               charset = 'utf8mb4',
+                                                               cursorclass = pymysql.cursors.DictCursor,
+                                                               autocommit = True))
+        return pools[db]
+
+# statistics of all pools, by database
+def pool_stats():
+    with pools_lock:
+        return {db: pool.stats for db, pool in pools.items()}
+
+
 # this class will give us an instance of a connection to our database
+# a connection is taken from the pool for each query, and returned afterwards
 class MySQLConnection:
     def __init__(self, db):
-        # change the user and password as needed
-        connection = pymysql.connect(host = 'localhost',
-                                    user = 'root', 
-                                    password = 'rootroot', 
-                                    db = db,
-                                    charset = 'utf8mb4',
-                                    cursorclass = pymysql.cursors.DictCursor,
-                                    autocommit = True)
-        # establish the connection to the database
-        self.connection = connection
+        self.pool = get_pool(db)
     # the method to query the database
+    # every query is timed, see query_metrics.py
     def query_db(self, query, data=None):
-        with self.connection.cursor() as cursor:
-            try:
-                query = cursor.mogrify(query, data)
-                print("Running Query:", query)
+        caller = calling_function()
+        kind = query_kind(query)
+        with self.pool.connection() as connection:
+            with connection.cursor() as cursor:
+                start = time.perf_counter()
+                try:
+                    cursor.execute(query, data)
+                    if kind == "insert":
+                        # INSERT queries will return the ID NUMBER of the row inserted
+                        connection.commit()
+                        rows, result = cursor.rowcount, cursor.lastrowid
+                    elif kind == "select":
+                        # SELECT queries will return the data from the database as a LIST OF DICTIONARIES
+                        result = cursor.fetchall()
+                        rows = len(result)
+                    else:
+                        # UPDATE and DELETE queries will return nothing
+                        connection.commit()
+                        rows, result = cursor.rowcount, None
+                except Exception as error:
+                    query_metrics.record(caller, kind, time.perf_counter() - start, 0,
+                                         lambda: cursor.mogrify(query, data), error)
+                    raise
 
+                query_metrics.record(caller, kind, time.perf_counter() - start, rows,
+                                     lambda: cursor.mogrify(query, data))
+                return result
+    # the rows of a SELECT one at a time, for results too large for memory
+    # the rows are sent by the server as they are read (unbuffered cursor),
+    # so the connection stays in use until the last row has been read:
+    # it is a connection of its own (see ConnectionPool.open_stream), so that a slow reader,
+    # e.g. a download, does not keep a connection of the pool from the other requests
+    # the time recorded in query_metrics is the time of the execute, not of the reading
+    def query_db_iter(self, query, data=None):
+        caller = calling_function()
+        connection = self.pool.open_stream()
+        cursor = connection.cursor(pymysql.cursors.SSDictCursor)
+        rows = 0
+        elapsed = None
+        start = time.perf_counter()
+        try:
+            try:
                 cursor.execute(query, data)
-                if query.lower().find("insert") >= 0:
-                    # INSERT queries will return the ID NUMBER of the row inserted
-                    self.connection.commit()
-                    return cursor.lastrowid
-                elif query.lower().find("select") >= 0:
-                    # SELECT queries will return the data from the database as a LIST OF DICTIONARIES
-                    result = cursor.fetchall()
-                    return result
-                else:
-                    # UPDATE and DELETE queries will return nothing
-                    self.connection.commit()
-            # except Exception as e:
-            #     # if the query fails the method will return FALSE
-            #     print("***********************************  Something went wrong", e)
-            #     return False
-            finally:
-                # close the connection
-                self.connection.close() 
+            except Exception as error:
+                query_metrics.record(caller, "select", time.perf_counter() - start, 0,
+                                     lambda: cursor.mogrify(query, data), error)
+                raise
+            elapsed = time.perf_counter() - start
+
+            for row in cursor:
+                rows += 1
+                yield row
+        finally:
+            # also when the reader stops early: the unread rows are not read
+            if elapsed is not None:
+                query_metrics.record(caller, "select", elapsed, rows, lambda: cursor.mogrify(query, data))
+            self.pool.close_stream(connection)
+    # run several queries in one transaction:
+    # either all changes are committed, or none of them
+    # queries is a list of (query, data) tuples
+    # checked: the indexes in queries of the queries that must change at least one row,
+    # if one of them changes none, the transaction is rolled back and ConcurrentUpdate is raised
+    def query_db_transaction(self, queries, checked=()):
+        caller = calling_function()
+        with self.pool.connection() as connection:
+            with connection.cursor() as cursor:
+                start = time.perf_counter()
+                rows = 0
+                try:
+                    connection.begin()
+                    for index, (query, data) in enumerate(queries):
+                        cursor.execute(query, data)
+                        if index in checked and cursor.rowcount == 0:
+                            raise ConcurrentUpdate(f"no row changed by: {query}")
+                        rows += cursor.rowcount
+                    connection.commit()
+                except Exception as error:
+                    connection.rollback()
+                    query_metrics.record(caller, "transaction", time.perf_counter() - start, 0,
+                                         lambda: "; ".join(cursor.mogrify(query, data) for query, data in queries), error)
+                    raise
+
+                query_metrics.record(caller, "transaction", time.perf_counter() - start, rows,
+                                     lambda: "; ".join(cursor.mogrify(query, data) for query, data in queries))
+    # run one query for many rows of data, in one transaction
+    # an INSERT ... VALUES (...) is sent as multi-row INSERT statements (cursor.executemany)
+    def query_db_many(self, query, rows):
+        caller = calling_function()
+        with self.pool.connection() as connection:
+            with connection.cursor() as cursor:
+                start = time.perf_counter()
+                try:
+                    connection.begin()
+                    cursor.executemany(query, rows)
+                    connection.commit()
+                except Exception as error:
+                    connection.rollback()
+                    query_metrics.record(caller, "transaction", time.perf_counter() - start, 0,
+                                         lambda: f"{query} ({len(rows)} rows)", error)
+                    raise
+
+                query_metrics.record(caller, "transaction", time.perf_counter() - start, cursor.rowcount,
+                                     lambda: f"{query} ({len(rows)} rows)")
+    # insert many rows and their child rows in one transaction, e.g. games and their moves
+    # rows: the data for query, inserted one at a time to know their ids
+    # children: list of (query, child_rows, parent_key):
+    #     child_rows[i][parent_key] is the index in rows of the parent of the child row,
+    #     replaced by the id of the parent before the child rows are inserted
+    #     (parent_key None: rows that do not refer to rows, e.g. counts)
+    #     the child rows of a query are sent with executemany,
+    #     as multi-row INSERT statements (query must be INSERT ... VALUES (...))
+    # returns the ids of rows
+    def query_db_bulk_insert(self, query, rows, children):
+        caller = calling_function()
+        with self.pool.connection() as connection:
+            with connection.cursor() as cursor:
+                start = time.perf_counter()
+                ids = []
+                count = 0
+                try:
+                    connection.begin()
+                    for data in rows:
+                        cursor.execute(query, data)
+                        ids.append(cursor.lastrowid)
+                    count = len(ids)
+                    for child_query, child_rows, parent_key in children:
+                        if parent_key is not None:
+                            for child in child_rows:
+                                child[parent_key] = ids[child[parent_key]]
+                        if child_rows:
+                            cursor.executemany(child_query, child_rows)
+                            count += cursor.rowcount
+                    connection.commit()
+                except Exception as error:
+                    connection.rollback()
+                    query_metrics.record(caller, "transaction", time.perf_counter() - start, 0,
+                                         lambda: f"{query} ({len(rows)} rows)", error)
+                    raise
+
+                query_metrics.record(caller, "transaction", time.perf_counter() - start, count,
+                                     lambda: f"{query} ({len(rows)} rows)")
+                return ids
+
+# insert, select, update, delete ...
+# like before, a query that contains "insert" is treated as an insert,
+# and else a query that contains "select" as a select
+def query_kind(query):
+    lower = query.lower()
+    if lower.find("insert") >= 0:
+        return "insert"
+    elif lower.find("select") >= 0:
+        return "select"
+    words = lower.split(None, 1)
+    return words[0] if words else ""
+
 # connectToMySQL receives the database we're using and uses it to create an instance of MySQLConnection
 def connectToMySQL(db):
     return MySQLConnection(db)
-
@@ -0,0 +1,127 @@
+#******************************************************************************
+#
+# Tests for the connection pool in mysqlconnection.py
+# the connections are fakes, no database is needed
+#
+# run the tests:
+#     python -m pytest flask_app/config/mysqlconnection_test.py
+#
+#******************************************************************************
+
+import threading
+import time
+
+import pymysql
+import pytest
+
+from flask_app.config.mysqlconnection import ConnectionPool, PoolExhausted
+
+
+class FakeConnection():
+
+    def __init__(self):
+        self.alive = True
+        self.closed = False
+
+    def ping(self, reconnect):
+        if not self.alive:
+            raise pymysql.err.OperationalError(2006, "MySQL server has gone away")
+
+    def close(self):
+        self.closed = True
+
+
+def test_exhausted():
+    pool = ConnectionPool(FakeConnection, max_size=2, checkout_timeout=0.05)
+    first, second = pool.checkout(), pool.checkout()
+
+    with pytest.raises(PoolExhausted):
+        pool.checkout()
+
+    # a connection returned by another thread ends the wait
+    threading.Timer(0.01, pool.checkin, [first]).start()
+    pool.checkout_timeout = 5
+    assert pool.checkout() is first
+    assert pool.stats["waits"] == 1
+
+    pool.checkin(second)
+    assert pool.stats["size"] == 2
+
+def test_idle_connections_are_closed():
+    pool = ConnectionPool(FakeConnection, idle_timeout=0.01)
+    connection = pool.checkout()
+    pool.checkin(connection)
+    time.sleep(0.02)
+
+    assert pool.checkout() is not connection
+    assert connection.closed
+    assert (pool.stats["size"], pool.stats["created"], pool.stats["closed"]) == (1, 2, 1)
+
+def test_dead_connection_is_replaced():
+    pool = ConnectionPool(FakeConnection, ping_after=0)
+    connection = pool.checkout()
+    pool.checkin(connection)
+    connection.alive = False
+
+    assert pool.checkout() is not connection
+    assert connection.closed
+    assert pool.stats["size"] == 1
+
+# a connection error closes the connection, other errors return it to the pool
+def test_discard_on_error():
+    pool = ConnectionPool(FakeConnection)
+
+    with pytest.raises(pymysql.err.OperationalError):
+        with pool.connection() as connection:
+            raise pymysql.err.OperationalError(2013, "Lost connection")
+    assert connection.closed
+    assert (pool.stats["size"], pool.stats["idle"]) == (0, 0)
+
+    with pytest.raises(ValueError):
+        with pool.connection() as connection:
+            raise ValueError()
+    assert not connection.closed
+    assert (pool.stats["size"], pool.stats["idle"]) == (1, 1)
+
+# the pool never opens more than max_size connections, and counts every checkout
+def test_concurrent_checkouts():
+    pool = ConnectionPool(FakeConnection, max_size=3)
+    in_use = []
+    most_in_use = []
+
+    def work():
+        for repeat in range(50):
+            with pool.connection():
+                in_use.append(1)
+                most_in_use.append(len(in_use))
+                time.sleep(0.0001)
+                in_use.pop()
+
+    threads = [threading.Thread(target=work) for count in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    stats = pool.stats
+    assert max(most_in_use) <= 3
+    assert stats["checkouts"] == 400
+    assert stats["created"] == stats["size"] <= 3
+    assert stats["in_use"] == 0
+
+# stream connections are not taken from the pool, and are limited to max_streams
+def test_streams():
+    pool = ConnectionPool(FakeConnection, max_size=1, checkout_timeout=0.05, max_streams=2)
+    first, second = pool.open_stream(), pool.open_stream()
+    assert pool.stats["size"] == 0
+
+    with pytest.raises(PoolExhausted):
+        pool.open_stream()
+    with pool.connection():
+        pass
+
+    pool.close_stream(first)
+    assert first.closed
+    pool.close_stream(pool.open_stream())
+    pool.close_stream(second)
+    assert pool.stats["streams"] == 0
@@ -0,0 +1,100 @@
+#******************************************************************************
+#
+# This module records how long database queries take
+# - per calling model method (e.g. Game.get_by_game_id) and kind of query:
+#   number of queries, errors, rows, total time and a latency histogram
+# - queries slower than app.config["SLOW_QUERY_THRESHOLD"] are logged with their full text
+# - a fraction app.config["QUERY_SAMPLE_RATE"] of all other queries is logged with their full text
+#
+# the text of a query (with the data filled in) is only rendered
+# when it is logged, not for every query
+#
+# the counters are shown by /admin/stats (controllers/admin_controller.py)
+#
+#******************************************************************************
+
+import logging
+import random
+import sys
+import threading
+
+from flask_app import app
+
+# upper bounds of the histogram buckets, in seconds
+# the last bucket counts everything above the last bound
+HISTOGRAM_BOUNDS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0)
+
+logger = logging.getLogger("flask_app.queries")
+
+
+class QueryMetrics():
+
+    # slow_query_threshold: seconds
+    # sample_rate: fraction of the queries that is logged, 0.0 - 1.0
+    def __init__(self, slow_query_threshold, sample_rate):
+        self.slow_query_threshold = slow_query_threshold
+        self.sample_rate = sample_rate
+        self.lock = threading.Lock()
+        # (caller, kind) -> counters
+        self.entries = {}
+
+    # record one query
+    # query_text() renders the query, only called if the query is logged
+    def record(self, caller, kind, elapsed, rows, query_text, error=None):
+        with self.lock:
+            entry = self.entries.get((caller, kind))
+            if entry is None:
+                entry = self.entries[(caller, kind)] = {
+                    "count": 0, "errors": 0, "rows": 0,
+                    "total_time": 0.0, "max_time": 0.0,
+                    "histogram": [0] * (len(HISTOGRAM_BOUNDS) + 1)
+                }
+            entry["count"] += 1
+            entry["rows"] += rows
+            entry["total_time"] += elapsed
+            entry["max_time"] = max(entry["max_time"], elapsed)
+            if error is not None:
+                entry["errors"] += 1
+
+            bucket = 0
+            while bucket < len(HISTOGRAM_BOUNDS) and elapsed > HISTOGRAM_BOUNDS[bucket]:
+                bucket += 1
+            entry["histogram"][bucket] += 1
+
+        if error is not None:
+            logger.error("query failed in %s (%.1f ms): %s: %s", caller, elapsed * 1000, error, query_text())
+        elif elapsed >= self.slow_query_threshold:
+            logger.warning("slow query in %s (%.1f ms, %d rows): %s", caller, elapsed * 1000, rows, query_text())
+        elif self.sample_rate and random.random() < self.sample_rate:
+            logger.info("query in %s (%.1f ms, %d rows): %s", caller, elapsed * 1000, rows, query_text())
+
+    # a copy of all counters, keyed by "caller kind"
+    def stats(self):
+        with self.lock:
+            result = {}
+            for (caller, kind), entry in self.entries.items():
+                result[f"{caller} {kind}"] = dict(entry,
+                    histogram=dict(zip([f"<={bound}" for bound in HISTOGRAM_BOUNDS] + ["more"], entry["histogram"])),
+                    average_time=entry["total_time"] / entry["count"])
+            return result
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+query_metrics = QueryMetrics(app.config["SLOW_QUERY_THRESHOLD"], app.config["QUERY_SAMPLE_RATE"])
+
+
+# the name of the function that called the database layer,
+# e.g. "Game.get_by_game_id"
+def calling_function():
+    # the frame of the database layer function that called calling_function
+    frame = sys._getframe(1)
+    database_layer = frame.f_code.co_filename
+    # skip all frames of the database layer
+    while frame.f_back is not None and frame.f_code.co_filename == database_layer:
+        frame = frame.f_back
+    code = frame.f_code
+
+    return getattr(code, "co_qualname", code.co_name)
@@ -0,0 +1,54 @@
+#******************************************************************************
+#
+# Tests for the query counters and the query log in query_metrics.py
+#
+# run the tests:
+#     python -m pytest flask_app/config/query_metrics_test.py
+#
+#******************************************************************************
+
+import logging
+
+from flask_app.config.query_metrics import QueryMetrics
+
+
+# a query text that must not be rendered
+def not_rendered():
+    raise AssertionError("the query text was rendered")
+
+
+# a time is counted in the first bucket whose upper bound it does not exceed
+def test_histogram():
+    metrics = QueryMetrics(slow_query_threshold=10, sample_rate=0.0)
+    for elapsed in [0.0005, 0.001, 0.0015, 0.3, 2.0]:
+        metrics.record("Game.get_by_game_id", "select", elapsed, 1, not_rendered)
+
+    entry = metrics.stats()["Game.get_by_game_id select"]
+    assert entry["histogram"]["<=0.001"] == 2
+    assert entry["histogram"]["<=0.002"] == 1
+    assert entry["histogram"]["<=0.5"] == 1
+    assert entry["histogram"]["more"] == 1
+    assert (entry["count"], entry["rows"], entry["max_time"]) == (5, 5, 2.0)
+
+    metrics.clear()
+    assert metrics.stats() == {}
+
+def test_slow_queries_are_logged(caplog):
+    metrics = QueryMetrics(slow_query_threshold=0.1, sample_rate=0.0)
+    with caplog.at_level(logging.INFO, logger="flask_app.queries"):
+        metrics.record("Game.export", "select", 0.05, 1, not_rendered)
+        metrics.record("Game.export", "select", 0.2, 3, lambda: "SELECT 1")
+        metrics.record("Game.export", "select", 0.01, 0, lambda: "SELECT 2", ValueError("failed"))
+
+    assert [(record.levelname, record.getMessage()) for record in caplog.records] == [
+        ("WARNING", "slow query in Game.export (200.0 ms, 3 rows): SELECT 1"),
+        ("ERROR", "query failed in Game.export (10.0 ms): failed: SELECT 2")
+    ]
+    assert metrics.stats()["Game.export select"]["errors"] == 1
+
+def test_sampling(caplog):
+    with caplog.at_level(logging.INFO, logger="flask_app.queries"):
+        QueryMetrics(slow_query_threshold=0.1, sample_rate=0.0).record("User.get_all", "select", 0.001, 1, not_rendered)
+        QueryMetrics(slow_query_threshold=0.1, sample_rate=1.0).record("User.get_all", "select", 0.001, 1, lambda: "SELECT 3")
+
+    assert [record.getMessage() for record in caplog.records] == ["query in User.get_all (1.0 ms, 1 rows): SELECT 3"]
@@ -0,0 +1,34 @@
+from flask import request, session, jsonify
+from flask_app import app
+from flask_app.config import mysqlconnection, aiomysqlconnection
+from flask_app.config.query_metrics import query_metrics
+from flask_app.helpers.transposition_cache import position_cache
+from flask_app.helpers.game_events import game_events
+from flask_app.helpers.analysis import analysis_service
+
+
+# the counters of this process, for the users in app.config["ADMIN_EMAILS"]
+#    /admin/stats             as JSON
+#    /admin/stats?clear=1     and start the query counters again
+# queries:     per model method and kind of query, see config/query_metrics.py
+# pools:       the database connections, see config/mysqlconnection.py
+# async_pools: the same for the async API (flask_app/asgi.py)
+@app.route('/admin/stats')
+def admin_stats():
+    if not session.get('is_logged_in'):
+        return (jsonify({}), 401)
+    if not session.get('is_admin'):
+        return (jsonify({}), 403)
+
+    stats = {
+        "queries": query_metrics.stats(),
+        "pools": mysqlconnection.pool_stats(),
+        "async_pools": aiomysqlconnection.pool_stats(),
+        "position_cache": position_cache.stats,
+        "game_events": game_events.stats,
+        "analysis": analysis_service.stats
+    }
+    if request.args.get("clear"):
+        query_metrics.clear()
+
+    return jsonify(stats)
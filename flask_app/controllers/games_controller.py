@@ -1,9 +1,17 @@
 from flask import render_template, request, redirect, session
 from flask import flash
 from flask_app import app
-from flask_app.models import user, game
-from flask_app.helpers.chess_rules import is_valid_move
-from flask import json, jsonify
+from flask_app.models import user, game, bot
+from flask_app.models.position_index import PositionIndex
+from flask_app.config.mysqlconnection import ConcurrentUpdate
+from flask_app.helpers.game_state import GameState
+from flask_app.helpers.notation import to_san
+from flask_app.helpers.analysis import analysis_jobs, AnalysisBusy, DeadlineExceeded, JobCancelled
+from flask_app.helpers.chess_rules import is_valid_move, legal_destinations
+from flask import json, jsonify, Response
+from flask_app.helpers.game_events import game_events
+import queue
+import click
 
 import math
 
@@ -13,31 +21,16 @@ def games_show():
     if not session['is_logged_in']:
         return redirect('/')
 
-    # show all active games (status == 1, 2, or 3)
-    # in which current player is involved
-    my_games = game.Game.get_active_games_by_user_id({"user_id": session["user_id"]})
-
-    games_my_turn = []
-    games_waiting = []
-    for this_game in my_games:
-        if ((this_game.current_is_white and this_game.number_of_moves % 2 == 0) 
-            or (not this_game.current_is_white and this_game.number_of_moves % 2 == 1)):
-            games_my_turn.append(this_game)
-        else:
-            games_waiting.append(this_game)
-    
-    # show all completed games (status == 4, 5, or 6)
-    # in which current player is involved
-    completed_games = game.Game.get_completed_games_by_user_id({"user_id": session["user_id"]})
-
-    # retrieve all pending games in which user is involved
-    pending_games = game.Game.get_by_user_id({"user_id": session["user_id"], "status": 0})
+    # all games in which current player is involved, with one query
+    # active games (status == 1, 2, or 3) are split by whose turn it is
+    # completed games have status == 4, 5, or 6
+    # pending invitations not initiated by user are only counted
+    dashboard = game.Game.get_dashboard_by_user_id({"user_id": session["user_id"]})
 
-    # filter out only those pending games not initiated by user
-    number_pending = 0
-    for pending_game in pending_games:
-        if pending_game.opponent_id ==  session["user_id"]:
-            number_pending += 1
+    games_my_turn = dashboard["my_turn"]
+    games_waiting = dashboard["waiting"]
+    completed_games = dashboard["completed"]
+    number_pending = len(dashboard["invitations"])
 
     return render_template("games.html", games_my_turn=games_my_turn, games_waiting=games_waiting, completed_games=completed_games, number_pending=number_pending)
 
@@ -81,6 +74,11 @@ def games_invite():
     }
     new_game_id = game.Game.create(data)
 
+    # the bot accepts at once, and makes the first move if it plays white
+    if bot.is_bot(int(data["opponent_id"])):
+        game.Game.accept_invitation({"games_id": new_game_id})
+        bot.reply(game.Game.get_by_game_id({"game_id": new_game_id}))
+
     return redirect('/games')
 
 # accept a game invitation
@@ -151,8 +149,6 @@ def make_move():
     if not session['is_logged_in']:
         return redirect('/')
 
-    print(request.form)
-
     # retrieve the game 
     game_id = request.form['game_id']
     move_str = request.form['your_move']
@@ -190,8 +186,13 @@ def make_move():
         
         # if the move is valid according to the rules of chess
         # make the move
+        # (a second submit of the same move is not made again)
         if is_valid_move( this_game.game_state, from_row, from_col, to_row, to_col ):
-            this_game.make_move( from_row, from_col, to_row, to_col )
+            try:
+                this_game.make_move( from_row, from_col, to_row, to_col )
+                bot.reply(this_game)
+            except ConcurrentUpdate:
+                pass
 
     return redirect(f'/games/{game_id}/play')
 
@@ -210,20 +211,354 @@ def make_move_js():
     to_row = int(data['move_to'][0])
     to_col = int(data['move_to'][1])
         
-    print("********************************")
-    print("********************************")
-    print("********************************")
-    print(f"game {game_id}, move: {from_row}{from_col}{to_row}{to_col}")    
-    print("********************************")
-    print("********************************")
-    print("********************************")
-
     this_game = game.Game.get_by_game_id({"game_id": game_id})
 
-    print(f"this_game after query: {this_game.id}")
+    # only the player who has the next move can move
+    if (session["user_id"] not in [this_game.user_id, this_game.opponent_id]
+            or not this_game.is_current_player_turn):
+        return (jsonify({}), 403)
 
     if is_valid_move( this_game.game_state, from_row, from_col, to_row, to_col ):
-        this_game.make_move( from_row, from_col, to_row, to_col )
+        try:
+            this_game.make_move( from_row, from_col, to_row, to_col )
+        except ConcurrentUpdate:
+            # another move was made in the game since it was read
+            return (jsonify({}), 409)
+        # the bot's reply comes as an event, see game_events_stream
+        bot.reply(this_game)
         return (jsonify({}), 201)
     else:
-        return (jsonify({}), 400)
\ No newline at end of file
+        return (jsonify({}), 400)
+
+
+# stream the moves of a game as Server-Sent Events
+# the client keeps this request open (EventSource in play.js)
+# events:
+#    game: the current ply and status, sent when the stream is opened
+#    move: sent by Game.make_move for every move, see game_events.py
+# a comment is sent every EVENTS_KEEPALIVE seconds to keep the connection open
+EVENTS_KEEPALIVE = 15
+
+@app.route('/api/games/<int:game_id>/events')
+def game_events_stream(game_id):
+    if not session.get('is_logged_in'):
+        return (jsonify({}), 401)
+
+    this_game = game.Game.get_by_game_id({"game_id": game_id})
+    if session["user_id"] not in [this_game.user_id, this_game.opponent_id]:
+        return (jsonify({}), 403)
+
+    # subscribe before the stream starts, so that no move is missed
+    events = game_events.subscribe(game_id)
+    first_event = {"game_id": game_id, "ply": this_game.ply, "status": int(this_game.status)}
+
+    def stream():
+        try:
+            yield f"event: game\ndata: {json.dumps(first_event)}\n\n"
+            while True:
+                try:
+                    event = events.get(timeout=EVENTS_KEEPALIVE)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"id: {event['ply']}\nevent: move\ndata: {json.dumps(event)}\n\n"
+        finally:
+            game_events.unsubscribe(game_id, events)
+
+    return Response(stream(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+# the state of a game as JSON, used by play.js to update the board
+# without reloading the page
+#    /api/games/<game_id>/state             the current board
+#    /api/games/<game_id>/state?since=<ply>  only what changed after ply
+# tiles is the games.tiles string, see Game.pieces for the codes
+# if nothing changed since ply, only ply and status are returned
+# if at most MAX_INCREMENTAL_PLIES moves were made since ply, changes replaces tiles:
+# the tiles the moves changed, as [row, column, piece] (as in the events of game_events_stream)
+MAX_INCREMENTAL_PLIES = 16
+
+@app.route('/api/games/<int:game_id>/state')
+def game_state_json(game_id):
+    if not session.get('is_logged_in'):
+        return (jsonify({}), 401)
+
+    this_game = game.Game.get_by_game_id({"game_id": game_id})
+    if session["user_id"] not in [this_game.user_id, this_game.opponent_id]:
+        return (jsonify({}), 403)
+
+    since = request.args.get("since", type=int)
+
+    moves = None
+    if is_incremental(this_game, since):
+        moves = game.Game.get_moves_since({"game_id": game_id, "since": since})
+
+    return jsonify(game_state_dict(this_game, since, moves))
+
+# can the client showing the game after ply since be sent the changes only?
+def is_incremental(this_game, since):
+    return since is not None and 0 <= since < this_game.ply and this_game.ply - since <= MAX_INCREMENTAL_PLIES
+
+# the response of /api/games/<game_id>/state, also used by the async API
+# moves: the moves after ply since if is_incremental, else None
+def game_state_dict(this_game, since, moves):
+    state = {
+        "game_id": this_game.id,
+        "ply": this_game.ply,
+        "status": int(this_game.status)
+    }
+    if since == this_game.ply:
+        return state
+
+    state["next_move_color"] = 'w' if this_game.ply % 2 == 0 else 'b'
+    state["last_move"] = {
+        "piece": this_game.last_piece,
+        "move": [int(digit) for digit in this_game.last_from_to]
+    } if this_game.last_from_to else None
+
+    if moves is not None:
+        state["since"] = since
+        state["changes"] = changed_tiles(this_game.tiles, moves)
+    else:
+        state["tiles"] = this_game.tiles
+
+    return state
+
+# the tiles changed by moves, with their pieces in tiles (the board after the moves)
+def changed_tiles(tiles, moves):
+    squares = set()
+    for move in moves:
+        squares.update([(move.from_row, move.from_column), (move.to_row, move.to_column)])
+        # en passant: the pawn taken is beside the tile the pawn moves to
+        if move.piece in "6C" and move.from_column != move.to_column:
+            squares.add((move.from_row, move.to_column))
+        # castling: the rook moves from the h-file to the f-file, or from the a-file to the d-file
+        if move.piece in "17" and abs(move.to_column - move.from_column) == 2:
+            squares.update([(move.from_row, 0), (move.from_row, 2)] if move.to_column == 1
+                           else [(move.from_row, 7), (move.from_row, 4)])
+
+    return [[row, col, tiles[row * 8 + col]] for row, col in sorted(squares)]
+
+
+# a position of a game, to step through the moves of a game (show.js)
+#    /api/games/<game_id>/position?ply=<ply>   the position after ply moves
+# see Game.position_at
+@app.route('/api/games/<int:game_id>/position')
+def game_position(game_id):
+    if not session.get('is_logged_in'):
+        return (jsonify({}), 401)
+
+    this_game = game.Game.get_by_game_id({"game_id": game_id})
+    if session["user_id"] not in [this_game.user_id, this_game.opponent_id]:
+        return (jsonify({}), 403)
+
+    ply = request.args.get("ply", default=this_game.ply, type=int)
+    ply = max(0, min(ply, this_game.ply))
+    game_state = this_game.position_at(ply)
+
+    return jsonify({
+        "game_id": game_id,
+        "ply": ply,
+        "max_ply": this_game.ply,
+        "tiles": "".join("".join(row) for row in game_state.board),
+        "last_move": {
+            "piece": game_state.last_piece_moved,
+            "move": list(game_state.last_move)
+        } if game_state.last_move else None
+    })
+
+
+# the legal moves in the current position of a game, for play.js:
+# a piece can only be dropped on a tile it can legally move to
+# moves: {from tile: [to tiles]}, empty if it is not the user's turn
+# computed once per position (see chess_rules.legal_destinations)
+@app.route('/api/games/<int:game_id>/legal_moves')
+def game_legal_moves(game_id):
+    if not session.get('is_logged_in'):
+        return (jsonify({}), 401)
+
+    this_game = game.Game.get_by_game_id({"game_id": game_id})
+    if session["user_id"] not in [this_game.user_id, this_game.opponent_id]:
+        return (jsonify({}), 403)
+
+    moves = {}
+    if int(this_game.status) < 4 and this_game.is_current_player_turn:
+        moves = legal_destinations(this_game.game_state)
+
+    return jsonify({"game_id": game_id, "ply": this_game.ply, "moves": moves})
+
+
+# the opening explorer: the moves played from a position in all games,
+# with how often they were played and their results (see PositionIndex)
+#    /api/games/<game_id>/explorer             the current position of a game
+#    /api/games/<game_id>/explorer?ply=<ply>   the position after ply moves
+#    /api/explorer?fen=<fen>                   any position
+@app.route('/api/games/<int:game_id>/explorer')
+def game_explorer(game_id):
+    if not session.get('is_logged_in'):
+        return (jsonify({}), 401)
+
+    this_game = game.Game.get_by_game_id({"game_id": game_id})
+    if session["user_id"] not in [this_game.user_id, this_game.opponent_id]:
+        return (jsonify({}), 403)
+
+    ply = request.args.get("ply", default=this_game.ply, type=int)
+    ply = max(0, min(ply, this_game.ply))
+    game_state = this_game.game_state if ply == this_game.ply else this_game.position_at(ply)
+
+    return jsonify({"game_id": game_id, "ply": ply, "moves": PositionIndex.continuations(game_state)})
+
+@app.route('/api/explorer')
+def explorer():
+    if not session.get('is_logged_in'):
+        return (jsonify({}), 401)
+
+    try:
+        game_state = GameState.from_fen(request.args.get("fen", ""))
+    except ValueError:
+        return (jsonify({}), 400)
+
+    return jsonify({"fen": game_state.to_fen(), "moves": PositionIndex.continuations(game_state)})
+
+
+# analysis of a position by the analysis service (see helpers/analysis.py), in worker processes
+# a request starts a job and returns at once (202) with its job id,
+# the client then asks for the result: no request thread waits for a search
+#    /api/games/<game_id>/analysis?job=<job>&time=<seconds>   start a job on the current position of a game
+#    /api/analysis?fen=<fen>&job=<job>&time=<seconds>         start a job on any position
+#    GET    /api/analysis/<job_id>   the result (200), 202 while the job waits or runs,
+#                                    504 if it did not start before its deadline, 410 if it was cancelled
+#    DELETE /api/analysis/<job_id>   cancel the job
+# job: evaluate, best_move (default) or mate_search (with &max_moves=<moves>)
+# time: the deadline of the job, at most ANALYSIS_MAX_TIME seconds
+# scores are in centipawns for white
+ANALYSIS_MAX_TIME = 10
+
+@app.route('/api/games/<int:game_id>/analysis')
+def game_analysis(game_id):
+    if not session.get('is_logged_in'):
+        return (jsonify({}), 401)
+
+    this_game = game.Game.get_by_game_id({"game_id": game_id})
+    if session["user_id"] not in [this_game.user_id, this_game.opponent_id]:
+        return (jsonify({}), 403)
+
+    return start_analysis(this_game.game_state)
+
+@app.route('/api/analysis')
+def analysis():
+    if not session.get('is_logged_in'):
+        return (jsonify({}), 401)
+
+    try:
+        game_state = GameState.from_fen(request.args.get("fen", ""))
+    except ValueError:
+        return (jsonify({}), 400)
+
+    return start_analysis(game_state)
+
+def start_analysis(game_state):
+    job = request.args.get("job", "best_move")
+    deadline = min(max(request.args.get("time", default=1.0, type=float), 0.1), ANALYSIS_MAX_TIME)
+    options = {}
+    if job == "mate_search":
+        options["max_moves"] = min(max(request.args.get("max_moves", default=3, type=int), 1), 5)
+
+    info = {"job": job, "fen": game_state.to_fen()}
+    try:
+        job_id = analysis_jobs.start(session["user_id"], info, job, game_state.pack(), deadline, **options)
+    except ValueError:
+        return (jsonify({}), 400)
+    except AnalysisBusy:
+        return (jsonify({}), 503)
+
+    return (jsonify({"job_id": job_id, "job": job, "fen": info["fen"]}), 202,
+            {"Location": f"/api/analysis/{job_id}"})
+
+@app.route('/api/analysis/<job_id>', methods=['GET', 'DELETE'])
+def analysis_job(job_id):
+    if not session.get('is_logged_in'):
+        return (jsonify({}), 401)
+
+    if request.method == 'DELETE':
+        return (jsonify({}), 204 if analysis_jobs.cancel(job_id, session["user_id"]) else 404)
+
+    found = analysis_jobs.get(job_id, session["user_id"])
+    if found is None:
+        return (jsonify({}), 404)
+    future, info = found
+
+    response = {"job_id": job_id, "job": info["job"], "fen": info["fen"]}
+    if not future.done():
+        return (jsonify(response), 202)
+    if future.cancelled():
+        return (jsonify(response), 410)
+    try:
+        result = future.result()
+    except DeadlineExceeded:
+        return (jsonify(response), 504)
+    except JobCancelled:
+        return (jsonify(response), 410)
+
+    if result.get("move"):
+        result = dict(result, san=to_san(GameState.from_fen(info["fen"]), result["move"]), move=list(result["move"]))
+    return jsonify(dict(result, **response))
+
+
+# export games as PGN or FEN, see Game.export
+#    /games/<game_id>/export.pgn   one game
+#    /games/export.pgn             all games of the user
+# the text is sent while the games are read from the database
+EXPORT_MIMETYPES = {"pgn": "application/x-chess-pgn", "fen": "text/plain"}
+
+def export_response(data, export_format, filename):
+    return Response(game.Game.export(data, export_format), mimetype=EXPORT_MIMETYPES[export_format],
+                    headers={"Content-Disposition": f"attachment; filename={filename}.{export_format}",
+                             "X-Accel-Buffering": "no"})
+
+@app.route('/games/<int:game_id>/export.<any(pgn, fen):export_format>')
+def game_export(game_id, export_format):
+    if not session.get('is_logged_in'):
+        return redirect('/')
+
+    this_game = game.Game.get_by_game_id({"game_id": game_id})
+    if session["user_id"] not in [this_game.user_id, this_game.opponent_id]:
+        return redirect('/games')
+
+    return export_response({"game_id": game_id}, export_format, f"game_{game_id}")
+
+@app.route('/games/export.<any(pgn, fen):export_format>')
+def games_export(export_format):
+    if not session.get('is_logged_in'):
+        return redirect('/')
+
+    return export_response({"user_id": session["user_id"]}, export_format, "games")
+
+# the full archive, from the command line:
+#     FLASK_APP=server flask export-games --format pgn > games.pgn
+@app.cli.command("export-games")
+@click.option("--format", "export_format", type=click.Choice(["pgn", "fen"]), default="pgn")
+def export_games_command(export_format):
+    for line in game.Game.export({}, export_format):
+        click.echo(line, nl=False)
+
+# import the games of a PGN file, see Game.import_pgn
+#     FLASK_APP=server flask import-games archive.pgn
+# the games that can not be imported are listed with the reason
+@app.cli.command("import-games")
+@click.argument("pgn_file", type=click.File("r", encoding="utf-8", errors="replace"))
+@click.option("--chunk-size", type=int, default=500, help="games per transaction")
+@click.option("--workers", type=int, default=None, help="processes that parse the games")
+def import_games_command(pgn_file, chunk_size, workers):
+    imported, skipped = game.Game.import_pgn(pgn_file, chunk_size, workers)
+    for headers, reason in skipped:
+        click.echo(f"skipped {headers.get('White', '?')} - {headers.get('Black', '?')} {headers.get('Date', '')}: {reason}", err=True)
+    click.echo(f"{imported} games imported, {len(skipped)} skipped")
+
+# fill position_index from the moves of all games, see PositionIndex.build
+#     FLASK_APP=server flask build-position-index
+@app.cli.command("build-position-index")
+@click.option("--chunk-size", type=int, default=1000, help="games per transaction")
+def build_position_index_command(chunk_size):
+    click.echo(f"{PositionIndex.build(chunk_size)} games indexed")
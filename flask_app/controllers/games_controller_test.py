@@ -0,0 +1,82 @@
+#******************************************************************************
+#
+# Tests for the changes sent by /api/games/<game_id>/state?since=<ply>
+# (changed_tiles, is_incremental and game_state_dict in games_controller.py)
+#
+# run the tests:
+#     python -m pytest flask_app/controllers/games_controller_test.py
+#
+#******************************************************************************
+
+import pytest
+
+from flask_app.controllers.games_controller import (changed_tiles, is_incremental, game_state_dict,
+                                                    MAX_INCREMENTAL_PLIES)
+from flask_app.helpers.game_state import GameState
+from flask_app.helpers.pgn_import import parse_game, MOVE_COLUMNS
+from flask_app.models.game import Game, Move
+
+GAMES = [
+    # en passant by white, promotion, castling on both sides
+    "1. e4 d5 2. e5 f5 3. exf6 Nc6 4. fxg7 Bf5 5. gxh8=Q Qd7 6. Nf3 O-O-O 7. Bc4 e6 8. O-O",
+    # en passant by black, promotion by black
+    "1. Nf3 d5 2. Nc3 d4 3. e4 dxe3 4. Bc4 exd2+ 5. Kf1 dxc1=Q 6. Qxc1 Nc6"
+]
+
+
+# the Move objects of a game and its tiles after every ply
+def replayed_game(movetext):
+    parsed = parse_game({}, movetext, 16)
+    moves = [Move(dict(zip(MOVE_COLUMNS, columns), id=None, game_id=1, created_at=None, updated_at=None))
+             for columns in parsed["moves"]]
+
+    game_state = GameState.opening()
+    boards = [game_state.columns()["tiles"]]
+    for move in parsed["moves"]:
+        game_state.push(move[1:5] + ((move[5],) if move[5] else ()))
+        boards.append(game_state.columns()["tiles"])
+    return moves, boards
+
+def game_at(boards, ply):
+    return Game({
+        "id": 1, "user_id": 1, "opponent_id": 2, "white": 1, "status": 1, "tiles": boards[ply], "ply": ply,
+        "castling": 15, "last_piece": None, "last_from_to": None, "created_at": None, "updated_at": None
+    })
+
+
+# the changes after since, applied to the board after since, give the board now
+@pytest.mark.parametrize("movetext", GAMES)
+def test_changed_tiles(movetext):
+    moves, boards = replayed_game(movetext)
+    for since in range(len(moves)):
+        for now in range(since + 1, len(moves) + 1):
+            tiles = list(boards[since])
+            for row, col, piece in changed_tiles(boards[now], moves[since:now]):
+                tiles[row * 8 + col] = piece
+            assert "".join(tiles) == boards[now], (since, now)
+
+def test_is_incremental():
+    this_game = game_at(["0" * 64] * 40, 30)
+    assert not is_incremental(this_game, None)
+    assert not is_incremental(this_game, -1)
+    assert not is_incremental(this_game, 30)
+    assert not is_incremental(this_game, 31)
+    assert is_incremental(this_game, 29)
+    assert is_incremental(this_game, 30 - MAX_INCREMENTAL_PLIES)
+    assert not is_incremental(this_game, 29 - MAX_INCREMENTAL_PLIES)
+
+def test_game_state_dict():
+    moves, boards = replayed_game(GAMES[0])
+    this_game = game_at(boards, 15)
+
+    assert game_state_dict(this_game, 15, None) == {"game_id": 1, "ply": 15, "status": 1}
+
+    state = game_state_dict(this_game, 12, moves[12:])
+    assert "tiles" not in state
+    assert (state["since"], state["next_move_color"]) == (12, "b")
+    assert state["changes"] == changed_tiles(boards[15], moves[12:])
+
+    # too far behind, or a ply the game does not have: the whole board
+    for since in [None, -1, 16]:
+        state = game_state_dict(this_game, since, None)
+        assert state["tiles"] == boards[15] and "changes" not in state
@@ -53,6 +53,7 @@ def user_register():
         session["user_id"] = new_id
         session['first_name'] = data["first_name"]
         session['is_logged_in'] = True
+        session['is_admin'] = data["email"] in app.config["ADMIN_EMAILS"]
         return redirect('/games')
     else:
         return redirect('/')
@@ -71,16 +72,17 @@ def user_login():
         flash("Please provide an email and password", 'invalid_login')
         return redirect('/')
 
-    if not user.User.check_email_and_password(data):
+    this_user = user.User.check_email_and_password(data)
+    if not this_user:
         flash("invalid email/password", 'invalid_login')
         return redirect('/')
     
     # on valid login: store user data in session
     session.clear()
-    this_user = user.User.get_by_email(data)
     session["user_id"] = this_user.id
     session['first_name'] = this_user.first_name
     session['is_logged_in'] = True
+    session['is_admin'] = this_user.email in app.config["ADMIN_EMAILS"]
     return redirect('/games')
         
 
@@ -0,0 +1,256 @@
+#******************************************************************************
+#
+# This module runs chess analysis in worker processes, off the request threads
+#
+# jobs:
+#    evaluate:     the score of the position after the captures have been played out
+#    best_move:    the best move, searched until the deadline (engine.py)
+#    mate_search:  a forced mate in at most max_moves moves
+#
+# a job is given a position packed with GameState.pack and a deadline in seconds,
+# analysis_service.submit returns a concurrent.futures.Future of its result (a dictionary)
+# the deadline includes the time the job waits for a worker:
+# a job that has not started before its deadline fails with DeadlineExceeded
+# analysis_service.cancel stops a job, also while it runs (JobCancelled)
+# analysis_jobs keeps the jobs of the analysis API by job id, so that
+# a request does not wait for its job (see controllers/games_controller.py)
+#
+# the searches run in ANALYSIS_WORKERS processes, so that they do not
+# hold the GIL of the processes that serve the requests
+# await asyncio.wrap_future(future) waits for a job in async code
+#
+#******************************************************************************
+
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+
+from flask_app.helpers import engine
+from flask_app.helpers.game_state import GameState
+
+# processes that run the jobs
+ANALYSIS_WORKERS = int(os.environ.get("ANALYSIS_WORKERS", 2))
+# jobs that can be queued or running at the same time
+MAX_JOBS = 256
+
+
+# the job did not start before its deadline
+class DeadlineExceeded(TimeoutError):
+    pass
+
+# the job was cancelled while it ran
+class JobCancelled(Exception):
+    pass
+
+# MAX_JOBS jobs are queued or running
+class AnalysisBusy(RuntimeError):
+    pass
+
+# seconds a job of analysis_jobs is kept after it is done
+RESULT_TTL = 60
+
+
+#******************************************************************************
+#
+# the jobs, run in the worker processes
+# every job gets its position, the time left before its deadline
+# and a function that returns True once the job has been cancelled
+#
+#******************************************************************************
+
+# the flags of the jobs that have been cancelled, by slot (see AnalysisService)
+# shared with the worker processes when they start
+cancelled_jobs = None
+
+def init_worker(cancelled):
+    global cancelled_jobs
+    cancelled_jobs = cancelled
+
+def run_job(job, packed, deadline, slot, options):
+    time_left = deadline - time.time()
+    if time_left <= 0:
+        raise DeadlineExceeded(f"{job} did not start before its deadline")
+
+    def is_cancelled():
+        return cancelled_jobs[slot] == 1
+
+    result = JOBS[job](GameState.unpack(packed), time_left, is_cancelled, **options)
+    if is_cancelled():
+        raise JobCancelled(job)
+    return result
+
+# scores are in centipawns for white
+def evaluate_job(game_state, time_left, is_cancelled):
+    search = engine.Search(game_state, time_left, None, is_cancelled)
+    try:
+        score = search.quiescence(0, -engine.MATE, engine.MATE)
+    except engine.SearchStopped:
+        score = engine.evaluate(game_state)
+    return {"score": score if game_state.next_move_color == "w" else -score, "nodes": search.nodes}
+
+# time_limit: search at most this many seconds, also if the deadline is later
+def best_move_job(game_state, time_left, is_cancelled, node_limit=None, time_limit=None):
+    if time_limit is not None:
+        time_left = min(time_left, time_limit)
+    result = engine.best_move(game_state, time_left, node_limit, stop=is_cancelled)
+    if game_state.next_move_color == "b":
+        result["score"] = -result["score"]
+    return result
+
+# mate_in: the number of moves to mate, None if no mate was found
+# complete: False if the deadline came before all max_moves were searched
+def mate_search_job(game_state, time_left, is_cancelled, max_moves=3):
+    # the mated player has no legal move one ply after the last move
+    depth = 2 * max_moves
+    result = engine.best_move(game_state, time_left, max_depth=depth, stop=is_cancelled)
+    mate_in = None
+    if result["score"] > engine.MATE - engine.MAX_PLY:
+        mate_in = (engine.MATE - result["score"] + 1) // 2
+    return {
+        "mate_in": mate_in,
+        "move": result["move"] if mate_in else None,
+        "complete": mate_in is not None or result["depth"] == depth,
+        "nodes": result["nodes"]
+    }
+
+JOBS = {
+    "evaluate": evaluate_job,
+    "best_move": best_move_job,
+    "mate_search": mate_search_job
+}
+
+
+#******************************************************************************
+#
+# AnalysisService: the pool of worker processes and the jobs sent to it
+# every job has a slot with its cancel flag, in memory shared with the workers
+#
+#******************************************************************************
+class AnalysisService():
+
+    def __init__(self, workers, max_jobs=MAX_JOBS):
+        self.workers = workers
+        self.cancelled = multiprocessing.RawArray('b', max_jobs)
+        self.free_slots = list(range(max_jobs))
+        self.lock = threading.Lock()
+        # created on first use
+        self.executor = None
+
+    def get_executor(self):
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker,
+                                                initargs=(self.cancelled,))
+        return self.executor
+
+    # start a job on a position
+    # job: "evaluate", "best_move" or "mate_search"
+    # packed: GameState.pack() of the position
+    # deadline: seconds from now
+    # options: for best_move node_limit and time_limit, for mate_search max_moves
+    # returns a Future of the result, raises AnalysisBusy if MAX_JOBS jobs are waiting
+    def submit(self, job, packed, deadline, **options):
+        if job not in JOBS:
+            raise ValueError(f"unknown analysis job: {job}")
+
+        with self.lock:
+            if not self.free_slots:
+                raise AnalysisBusy(f"{len(self.cancelled)} analysis jobs are waiting")
+            slot = self.free_slots.pop()
+            self.cancelled[slot] = 0
+            args = (run_job, job, packed, time.time() + deadline, slot, options)
+            try:
+                future = self.get_executor().submit(*args)
+            except BrokenProcessPool:
+                # a worker died (e.g. out of memory): start new workers
+                self.executor = None
+                future = self.get_executor().submit(*args)
+
+        future.job_slot = slot
+        future.add_done_callback(self.release)
+        return future
+
+    # stop a job: a job that waits is not started, a job that runs stops
+    # at its next look at the clock, and fails with JobCancelled
+    def cancel(self, future):
+        with self.lock:
+            # the slot of a job that is done may be in use by another job
+            if not future.done():
+                self.cancelled[future.job_slot] = 1
+        future.cancel()
+
+    def release(self, future):
+        with self.lock:
+            self.free_slots.append(future.job_slot)
+
+    @property
+    def stats(self):
+        with self.lock:
+            return {"workers": self.workers, "jobs": len(self.cancelled) - len(self.free_slots)}
+
+
+#******************************************************************************
+#
+# AnalysisJobs: jobs of the service by job id, for clients that start a job
+# and ask for its result later, instead of waiting for it
+# a job can only be seen by the user who started it, and is forgotten
+# RESULT_TTL seconds after it is done
+# the jobs live in the memory of this process, like the subscribers of game_events.py
+#
+#******************************************************************************
+class AnalysisJobs():
+
+    def __init__(self, service):
+        self.service = service
+        self.lock = threading.Lock()
+        # job id -> {"future", "user_id", "info", "done_at"}
+        self.jobs = {}
+
+    # start a job for user_id, see AnalysisService.submit
+    # info: kept with the job (e.g. the position), returned by get
+    # returns the job id
+    def start(self, user_id, info, job, packed, deadline, **options):
+        future = self.service.submit(job, packed, deadline, **options)
+        job_id = uuid.uuid4().hex
+        with self.lock:
+            self.forget_expired()
+            self.jobs[job_id] = {"future": future, "user_id": user_id, "info": info, "done_at": None}
+        future.add_done_callback(lambda future: self.done(job_id))
+        return job_id
+
+    def done(self, job_id):
+        with self.lock:
+            if job_id in self.jobs:
+                self.jobs[job_id]["done_at"] = time.monotonic()
+
+    # (future, info) of a job of user_id, None if there is no such job
+    def get(self, job_id, user_id):
+        with self.lock:
+            self.forget_expired()
+            entry = self.jobs.get(job_id)
+        if entry is None or entry["user_id"] != user_id:
+            return None
+        return entry["future"], entry["info"]
+
+    # cancel a job of user_id (see AnalysisService.cancel)
+    # returns False if there is no such job
+    def cancel(self, job_id, user_id):
+        found = self.get(job_id, user_id)
+        if found is None:
+            return False
+        self.service.cancel(found[0])
+        return True
+
+    # called with the lock held
+    def forget_expired(self):
+        now = time.monotonic()
+        for job_id in [job_id for job_id, entry in self.jobs.items()
+                       if entry["done_at"] is not None and now - entry["done_at"] > RESULT_TTL]:
+            del self.jobs[job_id]
+
+
+analysis_service = AnalysisService(ANALYSIS_WORKERS)
+analysis_jobs = AnalysisJobs(analysis_service)
@@ -0,0 +1,80 @@
+#******************************************************************************
+#
+# Tests for the analysis service in analysis.py, with one worker process
+#
+# run the tests:
+#     python -m pytest flask_app/helpers/analysis_test.py
+#
+#******************************************************************************
+
+from concurrent.futures import CancelledError
+import time
+
+import pytest
+
+from flask_app.helpers.analysis import AnalysisService, AnalysisJobs, DeadlineExceeded, JobCancelled, AnalysisBusy
+from flask_app.helpers.game_state import GameState
+
+SCHOLARS_MATE = "r1bqkb1r/pppp1ppp/2n2n2/4p2Q/2B1P3/8/PPPP1PPP/RNB1K1NR w KQkq - 4 4"
+
+
+@pytest.fixture
+def service():
+    service = AnalysisService(workers=1, max_jobs=4)
+    yield service
+    service.executor.shutdown(cancel_futures=True)
+
+
+def test_jobs(service):
+    packed = GameState.from_fen(SCHOLARS_MATE).pack()
+
+    best_move = service.submit("best_move", packed, 5, node_limit=5000)
+    mate_search = service.submit("mate_search", packed, 5, max_moves=1)
+    evaluate = service.submit("evaluate", GameState.from_fen("4k3/8/8/8/8/8/8/3QK3 b - - 0 1").pack(), 5)
+
+    assert best_move.result()["move"] == (4, 0, 6, 2)
+    assert mate_search.result()["mate_in"] == 1
+    # scores are for white
+    assert evaluate.result()["score"] > 800
+
+
+def test_deadline(service):
+    with pytest.raises(DeadlineExceeded):
+        service.submit("evaluate", GameState.opening().pack(), 0).result()
+
+
+# a running search stops when it is cancelled
+def test_cancel(service):
+    future = service.submit("best_move", GameState.opening().pack(), 30)
+    time.sleep(0.5)
+    start = time.monotonic()
+    service.cancel(future)
+    with pytest.raises(JobCancelled):
+        future.result()
+    assert time.monotonic() - start < 5
+
+
+def test_busy(service):
+    futures = [service.submit("best_move", GameState.opening().pack(), 2) for job in range(4)]
+    with pytest.raises(AnalysisBusy):
+        service.submit("evaluate", GameState.opening().pack(), 2)
+    for future in futures:
+        service.cancel(future)
+
+
+# the jobs of analysis_jobs are only seen by the user who started them
+def test_analysis_jobs(service):
+    jobs = AnalysisJobs(service)
+    job_id = jobs.start(1, {"fen": SCHOLARS_MATE}, "mate_search", GameState.from_fen(SCHOLARS_MATE).pack(), 5,
+                        max_moves=1)
+
+    assert jobs.get(job_id, 2) is None
+    future, info = jobs.get(job_id, 1)
+    assert info == {"fen": SCHOLARS_MATE}
+    assert future.result()["mate_in"] == 1
+
+    job_id = jobs.start(1, {}, "best_move", GameState.opening().pack(), 30)
+    assert not jobs.cancel(job_id, 2)
+    assert jobs.cancel(job_id, 1)
+    with pytest.raises((JobCancelled, CancelledError)):
+        jobs.get(job_id, 1)[0].result()
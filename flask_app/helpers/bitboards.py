@@ -0,0 +1,309 @@
+#******************************************************************************
+#
+# This module contains a bitboard representation of a chess position
+# - one 64-bit integer per piece (white king, white queen, ..., black pawn)
+# - one 64-bit integer per color with all squares occupied by that color
+# - adapters to and from the games.tiles char(64) string
+#   and the 8 x 8 GameState.board
+# - attack sets for all pieces, computed with bitwise operations
+# - attack lookup tables per square, built once when the module is imported
+#
+# squares are numbered 0 - 63 in the same order as the characters
+# of games.tiles: square = row * 8 + col
+# bit n of a bitboard is set if square n is occupied
+#
+#******************************************************************************
+
+# all piece codes, same codes as in games.tiles (see chess_rules.pieces)
+WHITE_PIECES = "123456"
+BLACK_PIECES = "789ABC"
+PIECE_CODES = WHITE_PIECES + BLACK_PIECES
+
+# the color of every piece code
+PIECE_COLOR = {code: "w" for code in WHITE_PIECES}
+PIECE_COLOR.update({code: "b" for code in BLACK_PIECES})
+
+# the piece code for every (color, type)
+PIECE_CODE = {
+            ("w", "k"): '1', ("w", "q"): '2', ("w", "b"): '3',
+            ("w", "n"): '4', ("w", "r"): '5', ("w", "p"): '6',
+            ("b", "k"): '7', ("b", "q"): '8', ("b", "b"): '9',
+            ("b", "n"): 'A', ("b", "r"): 'B', ("b", "p"): 'C'
+        }
+
+# masks
+FULL = 0xFFFFFFFFFFFFFFFF
+COL_0 = 0x0101010101010101
+COL_7 = 0x8080808080808080
+NOT_COL_0 = FULL ^ COL_0
+NOT_COL_7 = FULL ^ COL_7
+NOT_COL_01 = FULL ^ (COL_0 | COL_0 << 1)
+NOT_COL_67 = FULL ^ (COL_7 | COL_7 >> 1)
+ROW_0 = 0x00000000000000FF
+ROW_7 = 0xFF00000000000000
+
+# the 8 directions of motion as (shift, mask)
+# a positive shift is a left shift (towards higher squares)
+# the mask removes squares that wrapped around to the other side of the board
+NORTH      = ( 8, FULL)
+SOUTH      = (-8, FULL)
+EAST       = ( 1, NOT_COL_0)
+WEST       = (-1, NOT_COL_7)
+NORTH_EAST = ( 9, NOT_COL_0)
+NORTH_WEST = ( 7, NOT_COL_7)
+SOUTH_EAST = (-7, NOT_COL_0)
+SOUTH_WEST = (-9, NOT_COL_7)
+
+STRAIGHT = (NORTH, SOUTH, EAST, WEST)
+DIAGONAL = (NORTH_EAST, NORTH_WEST, SOUTH_EAST, SOUTH_WEST)
+
+
+def bit(row, col):
+    return 1 << (row * 8 + col)
+
+
+# iterate over the squares of all set bits, lowest square first
+def squares(bb):
+    while bb:
+        lowest = bb & -bb
+        yield lowest.bit_length() - 1
+        bb ^= lowest
+
+
+#******************************************************************************
+#
+# attack sets
+# each function takes a bitboard of attacking pieces
+# and returns a bitboard of all squares attacked by them
+#
+#******************************************************************************
+
+def knight_attacks(knights):
+    col_1 = ((knights << 1) & NOT_COL_0) | ((knights >> 1) & NOT_COL_7)
+    col_2 = ((knights << 2) & NOT_COL_01) | ((knights >> 2) & NOT_COL_67)
+
+    return ((col_1 << 16) | (col_1 >> 16) | (col_2 << 8) | (col_2 >> 8)) & FULL
+
+def king_attacks(kings):
+    row = kings | ((kings << 1) & NOT_COL_0) | ((kings >> 1) & NOT_COL_7)
+
+    return ((row | (row << 8) | (row >> 8)) & FULL) ^ kings
+
+# white pawns attack forward (higher rows), black pawns backward
+def pawn_attacks(pawns, color):
+    if color == "w":
+        return ((pawns << 9) & NOT_COL_0 | (pawns << 7) & NOT_COL_7) & FULL
+    else:
+        return (pawns >> 7) & NOT_COL_0 | (pawns >> 9) & NOT_COL_7
+
+# queen, rook, bishop:
+# slide in each direction until the edge of the board
+# or the first occupied square (which is included in the attack set)
+def sliding_attacks(pieces, occupied, directions):
+    empty = FULL ^ occupied
+    attacks = 0
+    for shift, mask in directions:
+        ray = pieces
+        while ray:
+            ray = ((ray << shift) if shift > 0 else (ray >> -shift)) & mask
+            attacks |= ray
+            ray &= empty
+
+    return attacks & FULL
+
+
+#******************************************************************************
+#
+# lookup tables
+# built once at import with the functions above
+# all tables are indexed by square
+#
+#******************************************************************************
+
+KNIGHT_ATTACKS = [knight_attacks(1 << square) for square in range(64)]
+KING_ATTACKS = [king_attacks(1 << square) for square in range(64)]
+PAWN_ATTACKS = {
+    "w": [pawn_attacks(1 << square, "w") for square in range(64)],
+    "b": [pawn_attacks(1 << square, "b") for square in range(64)]
+}
+
+# RAYS[direction][square]: all tiles in one direction, up to the edge of the board
+RAYS = {direction: [sliding_attacks(1 << square, 0, (direction,)) for square in range(64)]
+        for direction in STRAIGHT + DIAGONAL}
+
+# all tiles a rook / bishop could reach from square on an empty board
+STRAIGHT_RAYS = [RAYS[NORTH][square] | RAYS[SOUTH][square] | RAYS[EAST][square] | RAYS[WEST][square]
+                 for square in range(64)]
+DIAGONAL_RAYS = [RAYS[NORTH_EAST][square] | RAYS[NORTH_WEST][square] | RAYS[SOUTH_EAST][square] | RAYS[SOUTH_WEST][square]
+                 for square in range(64)]
+
+# BETWEEN[from_square][to_square]: the tiles strictly between two squares
+# on the same row, column or diagonal; 0 if the squares are not on one line
+BETWEEN = [[0] * 64 for square in range(64)]
+for direction in STRAIGHT + DIAGONAL:
+    for square in range(64):
+        for target in squares(RAYS[direction][square]):
+            BETWEEN[square][target] = RAYS[direction][square] & ~RAYS[direction][target] & ~(1 << target)
+
+# rays towards higher squares are blocked by their lowest occupied square,
+# rays towards lower squares by their highest occupied square
+STRAIGHT_RAYS_UP = [RAYS[NORTH], RAYS[EAST]]
+STRAIGHT_RAYS_DOWN = [RAYS[SOUTH], RAYS[WEST]]
+DIAGONAL_RAYS_UP = [RAYS[NORTH_EAST], RAYS[NORTH_WEST]]
+DIAGONAL_RAYS_DOWN = [RAYS[SOUTH_EAST], RAYS[SOUTH_WEST]]
+
+# attack set of a rook / bishop on square, given the occupied squares:
+# each ray up to and including its first occupied square
+def rook_attacks(square, occupied):
+    return ray_attacks(square, occupied, STRAIGHT_RAYS_UP, STRAIGHT_RAYS_DOWN)
+
+def bishop_attacks(square, occupied):
+    return ray_attacks(square, occupied, DIAGONAL_RAYS_UP, DIAGONAL_RAYS_DOWN)
+
+def queen_attacks(square, occupied):
+    return rook_attacks(square, occupied) | bishop_attacks(square, occupied)
+
+def ray_attacks(square, occupied, rays_up, rays_down):
+    attacks = 0
+    for rays in rays_up:
+        ray = rays[square]
+        blockers = ray & occupied
+        if blockers:
+            ray ^= rays[(blockers & -blockers).bit_length() - 1]
+        attacks |= ray
+    for rays in rays_down:
+        ray = rays[square]
+        blockers = ray & occupied
+        if blockers:
+            ray ^= rays[blockers.bit_length() - 1]
+        attacks |= ray
+
+    return attacks
+
+
+#******************************************************************************
+#
+# Bitboards:
+# the complete board position as 12 + 2 bitboards
+#
+#******************************************************************************
+
+class Bitboards():
+
+    def __init__(self, pieces=None):
+        # one bitboard per piece code
+        self.pieces = pieces if pieces else dict.fromkeys(PIECE_CODES, 0)
+        # one bitboard per color
+        self.colors = {
+            "w": self.pieces['1'] | self.pieces['2'] | self.pieces['3'] | self.pieces['4'] | self.pieces['5'] | self.pieces['6'],
+            "b": self.pieces['7'] | self.pieces['8'] | self.pieces['9'] | self.pieces['A'] | self.pieces['B'] | self.pieces['C']
+        }
+
+    # adapter from games.tiles, a string of 64 characters
+    @classmethod
+    def from_tiles(cls, tiles):
+        pieces = dict.fromkeys(PIECE_CODES, 0)
+        for square, tile in enumerate(tiles):
+            if tile != '0':
+                pieces[tile] |= 1 << square
+
+        return cls(pieces)
+
+    # adapter from GameState.board, an 8 x 8 list of lists
+    @classmethod
+    def from_board(cls, board):
+        return cls.from_tiles("".join("".join(row) for row in board))
+
+    # adapter back to games.tiles
+    def to_tiles(self):
+        tiles = ['0'] * 64
+        for code, bb in self.pieces.items():
+            for square in squares(bb):
+                tiles[square] = code
+
+        return "".join(tiles)
+
+    # adapter back to GameState.board
+    def to_board(self):
+        tiles = self.to_tiles()
+
+        return [list(tiles[i:i+8]) for i in range(0, 64, 8)]
+
+    def copy(self):
+        return Bitboards(dict(self.pieces))
+
+    @property
+    def occupied(self):
+        return self.colors["w"] | self.colors["b"]
+
+    # the piece code on a square, '0' if the square is empty
+    def piece_at(self, square):
+        square_bit = 1 << square
+        if not (self.colors["w"] | self.colors["b"]) & square_bit:
+            return '0'
+        for code, bb in self.pieces.items():
+            if bb & square_bit:
+                return code
+
+    def king_square(self, color):
+        return self.pieces['1' if color == "w" else '7'].bit_length() - 1
+
+    # move piece from ... to ..., removing the captured piece (if any)
+    # the caller is responsible for the rules of chess
+    def move(self, piece, from_square, to_square, captured='0'):
+        from_bit = 1 << from_square
+        to_bit = 1 << to_square
+
+        if captured != '0':
+            self.pieces[captured] ^= to_bit
+            self.colors[PIECE_COLOR[captured]] ^= to_bit
+
+        self.pieces[piece] ^= from_bit | to_bit
+        self.colors[PIECE_COLOR[piece]] ^= from_bit | to_bit
+
+    # put piece on an empty square
+    def put(self, piece, square):
+        self.pieces[piece] ^= 1 << square
+        self.colors[PIECE_COLOR[piece]] ^= 1 << square
+
+    # remove piece from the square it occupies
+    def remove(self, piece, square):
+        self.pieces[piece] ^= 1 << square
+        self.colors[PIECE_COLOR[piece]] ^= 1 << square
+
+    # is square attacked by any piece of color by_color
+    def is_attacked(self, square, by_color):
+        pieces = self.pieces
+
+        if by_color == "w":
+            king, queen, bishop, knight, rook, pawn = WHITE_PIECES
+        else:
+            king, queen, bishop, knight, rook, pawn = BLACK_PIECES
+
+        # pieces that attack square are found on the squares
+        # that square would attack if it held the same type of piece
+        if KNIGHT_ATTACKS[square] & pieces[knight]:
+            return True
+        if KING_ATTACKS[square] & pieces[king]:
+            return True
+        if PAWN_ATTACKS["b" if by_color == "w" else "w"][square] & pieces[pawn]:
+            return True
+
+        # queen, rook and bishop on the same line as square
+        # attack square if there is nothing between them
+        sliders = ((STRAIGHT_RAYS[square] & (pieces[rook] | pieces[queen]))
+                   | (DIAGONAL_RAYS[square] & (pieces[bishop] | pieces[queen])))
+        if sliders:
+            occupied = self.colors["w"] | self.colors["b"]
+            between = BETWEEN[square]
+            while sliders:
+                attacker = sliders & -sliders
+                if not between[attacker.bit_length() - 1] & occupied:
+                    return True
+                sliders ^= attacker
+
+        return False
+
+    # is the king with color check
+    def is_check(self, color):
+        return self.is_attacked(self.king_square(color), "b" if color == "w" else "w")
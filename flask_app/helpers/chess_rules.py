@@ -5,8 +5,21 @@
 # - validation of moves by various pieces
 # - verification of check and check-mate
 #
+#
+# The position is represented with bitboards (see bitboards.py),
+# so that check and move validation are bitwise operations
+#
+# The results of is_check, is_check_mate, is_stale_mate and generate_legal_moves
+# are cached by the Zobrist hash of the position (see transposition_cache.py)
+#
 #******************************************************************************
 
+from flask_app.helpers.bitboards import (bit, squares, rook_attacks, bishop_attacks,
+                                         KNIGHT_ATTACKS, KING_ATTACKS, PAWN_ATTACKS,
+                                         STRAIGHT_RAYS, DIAGONAL_RAYS, BETWEEN,
+                                         WHITE_PIECES, BLACK_PIECES, FULL, ROW_0, ROW_7)
+from flask_app.helpers.transposition_cache import position_cache
+
 # a global variable that is CONSTANT
 pieces = {
             '0': (None, None, " "),
@@ -36,58 +49,51 @@ pieces = {
 
 def is_valid_move(game_state, *from_to):
     (from_row, from_col, to_row, to_col) = from_to
-    vector = (to_row - from_row, to_col - from_col)
-    
-    if not general_rules(game_state.board, from_to):
+    bitboards = game_state.bitboards
+
+    if not general_rules(bitboards, from_to):
         return False
     
     # color: the color of the piece on the "from" tile
-    # color_to: the color of a piece on the tile we want to move to
-    # if there is no piece there, color_to is None
+    # only the player who has the next move can move
     color, type, ucode = pieces[game_state.board[from_row][from_col]]
-    color_to, type_to, ucode_to = pieces[game_state.board[to_row][to_col]]
-
-    # test if the proposed move results in "check"
-    # 1. copy the board
-    new_board = [[tile for tile in row] for row in game_state.board]
-    # 2. make the move on new_board
-    moving_piece = new_board[from_row][from_col]
-    new_board[to_row][to_col] = moving_piece
-    new_board[from_row][from_col] = '0'
-    # 3. test whether player with color is check on new_board
-    if is_check(new_board, color):
+    if color != game_state.next_move_color:
         return False
 
-    # if the move does not result in a check situation,
-    # see if it is valid.
-
+    # see if the move is valid for the piece
     # castling is represented as a move of the king
     if type == "k":
         if from_to in [(0, 3, 0, 1), (0, 3, 0, 5), (7, 3, 7, 1), (7, 3, 7, 5)] and castling_rules(game_state, from_to):
-            return True
-        elif king_rules(game_state.board, from_to):
-            return True
+            is_valid = True
         else:
-            return False
+            is_valid = king_rules(bitboards, from_to)
 
     elif type == "n":
-        if knight_rules(game_state.board, from_to):
-            return True
-        else:
-            return False
+        is_valid = knight_rules(bitboards, from_to)
 
     elif type == "p":
-        return pawn_rules(game_state, from_to)
+        is_valid = pawn_rules(game_state, from_to)
 
     elif type in ["q", "r", "b"]:
-        if queen_rook_bishop_rules(game_state.board, from_to, type):
-            return True
-        else:
-            return False
+        is_valid = queen_rook_bishop_rules(bitboards, from_to, type)
+
+    if not is_valid:
+        return False
+
+    # if the move is valid for the piece,
+    # test if the proposed move results in "check"
+    # 1. make the move on game_state
+    # 2. test whether player with color is check
+    # 3. take the move back
+    game_state.push(from_to)
+    is_check_after_move = game_state.bitboards.is_check(color)
+    game_state.pop()
+
+    return not is_check_after_move
 
 
 # general_rules is called by all rules for moving a piece
-def general_rules(board, move):
+def general_rules(bitboards, move):
     from_row, from_col, to_row, to_col = move
 
     # is the move in range
@@ -100,114 +106,75 @@ def general_rules(board, move):
     if to_col not in range(8):
         return False 
     
-    # the "from" position is not empty
-    if board[from_row][from_col] == '0':
-        return False
+    from_bit = bit(from_row, from_col)
+    to_bit = bit(to_row, to_col)
 
+    # the "from" position is not empty
     # you cannot capture your own piece
-    color, type, ucode = pieces[board[from_row][from_col]]
-    color_to, type_to, ucode_to = pieces[board[to_row][to_col]]
-
-    if color == color_to:
+    if bitboards.colors["w"] & from_bit:
+        return not bitboards.colors["w"] & to_bit
+    elif bitboards.colors["b"] & from_bit:
+        return not bitboards.colors["b"] & to_bit
+    else:
         return False
 
-    return True
-
 #  
 #  The rules for moving various pieces (excl pawn)
 #  All these functions call general_rules
 #  
 
-def king_rules(board, move):
+# the safety of the king after the move is tested by is_valid_move
+def king_rules(bitboards, move):
         from_row, from_col, to_row, to_col = move
-        vector = (to_row - from_row, to_col - from_col)
 
-        if not general_rules(board, move):
+        if not general_rules(bitboards, move):
             return False
 
-        if vector in [(-1,-1), (-1,0), (-1,1), (0,-1), (0,1), (1, -1), (1, 0), (1, 1)]:
-            # make a copy of board and move king on new_board
-            color = pieces[board[from_row][from_col]][0]
-
-            new_board = [[tile for tile in row] for row in board]
-            new_board[to_row][to_col] = '1' if color == 'w' else '7'
-            new_board[from_row][from_col] = '0'
-
-            # make sure king is not check-mate after proposed move
-            if is_check(new_board, color):
-                return False
-            else:
-                return True
+        if KING_ATTACKS[from_row * 8 + from_col] & bit(to_row, to_col):
+            return True
         else:
             return False
     
-def knight_rules(board, move):
+def knight_rules(bitboards, move):
     from_row, from_col, to_row, to_col = move
-    vector = (to_row - from_row, to_col - from_col)
 
-    if not general_rules(board, move):
+    if not general_rules(bitboards, move):
         return False
 
-    if vector in [(1,2), (1,-2), (-1, 2), (-1, -2), (2, 1), (2, -1), (-2, 1), (-2,-1)]:
+    if KNIGHT_ATTACKS[from_row * 8 + from_col] & bit(to_row, to_col):
         return True
     else:
         return False
 
 # rules for queen, rook, bishop
 # the pieces with simple straight or diagonal motion
-def queen_rook_bishop_rules(board, move, type):
+def queen_rook_bishop_rules(bitboards, move, type):
     from_row, from_col, to_row, to_col = move
-    vector = (to_row - from_row, to_col - from_col)
 
-    if not general_rules(board, move):
+    if not general_rules(bitboards, move):
         return False
 
     # queen, bishop, rook follow the rules of diagonal or straight motion
     # the move is allowed if 
     # 1. it is in the right direction for the piece
     # 2. there are no obstacles between "from" and "to"
+    from_square = from_row * 8 + from_col
+    to_square = to_row * 8 + to_col
 
     # 1. check that the piece moves in the right direction
-    is_straight = True if vector[0] == 0 or vector[1] == 0 else False
-    is_diagonal = True if vector[0] == vector[1] or vector[0] == - vector[1] else False
+    if type == "q":
+        lines = STRAIGHT_RAYS[from_square] | DIAGONAL_RAYS[from_square]
+    elif type == "r":
+        lines = STRAIGHT_RAYS[from_square]
+    else:
+        lines = DIAGONAL_RAYS[from_square]
 
-    if type == "q" and not (is_straight or is_diagonal):
-        return False
-    if type == "r" and not is_straight:
-        return False
-    if type == "b" and not is_diagonal:
+    if not lines & (1 << to_square):
         return False
 
     # 2. check for obstacles
-
-    # how many steps are we moving?
-    # if only 1 step, we are done.
-    how_many = max(abs(vector[0]), abs(vector[1]))
-    if how_many < 2:
-        return True
-
-    # in which direction are we moving?
-    unit = [0,0]
-
-    if vector[0] > 0:
-        unit[0] = +1
-    elif vector[0] < 0:
-        unit[0] = -1
-    else:
-        unit[0] = 0
-
-    if vector[1] > 0:
-        unit[1] = +1
-    elif vector[1] < 0:
-        unit[1] = -1
-    else:
-        unit[1] = 0
-
-    # now check all intermediate positions
-    # if any piece is in the way, the move is invalid
-    for i in range(1, how_many):
-        if not board[from_row + unit[0] * i][from_col + unit[1] * i] == "0":
-            return False 
+    if BETWEEN[from_square][to_square] & bitboards.occupied:
+        return False
 
     # if the direction is correct, and no obstacles are found, the move is valid
     return True
@@ -218,9 +185,11 @@ def queen_rook_bishop_rules(board, move, type):
 def pawn_rules(game_state, from_to):
     from_row, from_col, to_row, to_col = from_to
     vector = (to_row - from_row, to_col - from_col)
+    bitboards = game_state.bitboards
     
-    color, type, ucode = pieces[game_state.board[from_row][from_col]]
-    color_to, type_to, ucode_to = pieces[game_state.board[to_row][to_col]]
+    color = "w" if bitboards.colors["w"] & bit(from_row, from_col) else "b"
+    opponent = "b" if color == "w" else "w"
+    empty = ~bitboards.occupied
 
     # vertical direction of motion and starting row depend on color
     forward = 1 if color == "w" else -1
@@ -230,14 +199,14 @@ def pawn_rules(game_state, from_to):
 
     # move 1 forward to an empty spot
     if vector == (forward, 0):
-        if game_state.board[from_row + forward][from_col] == "0":
+        if empty & bit(from_row + forward, from_col):
             return True
         else:
             return False
     
     # move 2 forward; only allowed from starting position
     elif vector == (2 * forward,0) and from_row == start_row:
-        if game_state.board[from_row + forward][from_col] == "0" and game_state.board[from_row + 2 * forward][from_col] == "0":
+        if empty & bit(from_row + forward, from_col) and empty & bit(from_row + 2 * forward, from_col):
             return True
         else: 
             return False
@@ -245,18 +214,18 @@ def pawn_rules(game_state, from_to):
     # capture of a piece
     elif vector in [(forward, 1), (forward, -1)]:
         # an ordinary capture
-        if color_to and color != color_to:
+        if bitboards.colors[opponent] & bit(to_row, to_col):
             return True
         # en passant capture of pawn
         else:
-            if ((not color_to) and color == "w" 
+            if (color == "w" 
                     and from_row == 4  
                     and game_state.last_piece_moved == 'C'
                     and game_state.last_move[0] == 6
                     and game_state.last_move[1] == to_col
                     and game_state.last_move[2] == 4):
                 return True
-            elif ((not color_to) and color == "b" 
+            elif (color == "b" 
                     and from_row == 3  
                     and game_state.last_piece_moved == '6'
                     and game_state.last_move[0] == 1
@@ -266,133 +235,235 @@ def pawn_rules(game_state, from_to):
             else:
                 return False
 
+    return False
+
 
 # validation of castling 
 # represented as a move of the king, but also involves a rook
 # for validation of castling we need to check past moves
 # the king and rook involved in castling may not have moved before
+# and the king may not castle out of check or pass a tile that is under attack
+# (the tile the king moves to is tested by is_valid_move)
 def castling_rules(game_state, from_to):
 
     if (from_to == (0, 3, 0, 1) and game_state.board[0][0:4] == ['5','0','0','1']
             and not game_state.white_king_moved and not game_state.white_rook_0_moved):
-        return True 
+        passed = [(0, 3), (0, 2)]
     elif (from_to == (7, 3, 7, 1) and game_state.board[7][0:4] == ['B','0','0','7']
             and not game_state.black_king_moved and not game_state.black_rook_0_moved):
-        return True 
-    elif (from_to == (0, 3, 0, 5) and game_state.board[0][4:8] == ['1','0','0','0','5']
+        passed = [(7, 3), (7, 2)]
+    elif (from_to == (0, 3, 0, 5) and game_state.board[0][3:8] == ['1','0','0','0','5']
             and not game_state.white_king_moved and not game_state.white_rook_7_moved):
-        return True 
-    elif (from_to == (7, 3, 7, 5) and game_state.board[7][4:8] == ['7','0','0','0','B']
-            and not game_state.black_king_moved and game_state.black_rook_7_moved):
-        return True 
+        passed = [(0, 3), (0, 4)]
+    elif (from_to == (7, 3, 7, 5) and game_state.board[7][3:8] == ['7','0','0','0','B']
+            and not game_state.black_king_moved and not game_state.black_rook_7_moved):
+        passed = [(7, 3), (7, 4)]
     else:
         return False
 
+    opponent = "b" if from_to[0] == 0 else "w"
+    for row, col in passed:
+        if game_state.bitboards.is_attacked(row * 8 + col, opponent):
+            return False
 
+    return True
 
+
+#******************************************************************************
 #
-#  Functions for check and check-mate
-#  These functions rely on the rules for moving pieces
+# generate_legal_moves:
+# all valid moves for one player
+# instead of testing every combination of "from" and "to" tiles,
+# only the candidate moves of each piece are generated (pseudo-legal moves),
+# and then the moves that leave the player's own king check are removed
+#
+# a move is a tuple (from_row, from_col, to_row, to_col)
+# a pawn move to the last row is a tuple with a 5th element:
+# the piece the pawn is promoted to
+#******************************************************************************
+
+# castling:
+# the move of the king, the game_state attributes for king and rook that may not have moved,
+# the column of the rook, the tiles between king and rook that must be empty,
+# and the tiles the king passes that may not be under attack
+castling_moves = {
+    "w": [((0, 3, 0, 1), "white_king_moved", "white_rook_0_moved", 0, [1, 2], [3, 2, 1]),
+          ((0, 3, 0, 5), "white_king_moved", "white_rook_7_moved", 7, [4, 5, 6], [3, 4, 5])],
+    "b": [((7, 3, 7, 1), "black_king_moved", "black_rook_0_moved", 0, [1, 2], [3, 2, 1]),
+          ((7, 3, 7, 5), "black_king_moved", "black_rook_7_moved", 7, [4, 5, 6], [3, 4, 5])]
+}
+
+# all legal moves of color, by default the player who has the next move
+def generate_legal_moves(game_state, color=None):
+    if not color:
+        color = game_state.next_move_color
+
+    # the cached list is a tuple, so that callers cannot change it
+    moves = position_cache.lookup(("moves", game_state.hash, color),
+                                  lambda: tuple(legal_moves(game_state, color)))
+    return list(moves)
+
+# the legal moves of the player who has the next move as a map
+# from tile to the tiles the piece on it can move to, e.g. {"13": ["23", "33"], ...}
+# tiles are written as row and column, like the tile ids in play.html
+# a promotion is one destination, whatever the new piece
+def legal_destinations(game_state):
+    color = game_state.next_move_color
+
+    def compute():
+        destinations = {}
+        for move in generate_legal_moves(game_state, color):
+            from_tile = f"{move[0]}{move[1]}"
+            to_tile = f"{move[2]}{move[3]}"
+            tiles = destinations.setdefault(from_tile, [])
+            if to_tile not in tiles:
+                tiles.append(to_tile)
+        return destinations
+
+    return position_cache.lookup(("destinations", game_state.hash, color), compute)
+
+# legal moves are generated one at a time,
+# so that a search for any legal move can stop at the first one
+# each candidate move is tried out on game_state and taken back
+def legal_moves(game_state, color):
+    for move in pseudo_legal_moves(game_state, color):
+        game_state.push(move)
+        is_check_after_move = game_state.bitboards.is_check(color)
+        game_state.pop()
+        if not is_check_after_move:
+            yield move
+
+# the candidate moves of all pieces with color, ignoring the safety of the king
+def pseudo_legal_moves(game_state, color):
+    bitboards = game_state.bitboards
+    opponent = "b" if color == "w" else "w"
+    king, queen, bishop, knight, rook, pawn = WHITE_PIECES if color == "w" else BLACK_PIECES
+    occupied = bitboards.occupied
+    # tiles that are empty or occupied by the opponent
+    targets = FULL ^ bitboards.colors[color]
+    moves = []
+
+    for square in squares(bitboards.pieces[king]):
+        add_moves(moves, square, KING_ATTACKS[square] & targets)
+
+    for square in squares(bitboards.pieces[knight]):
+        add_moves(moves, square, KNIGHT_ATTACKS[square] & targets)
+
+    for square in squares(bitboards.pieces[rook] | bitboards.pieces[queen]):
+        add_moves(moves, square, rook_attacks(square, occupied) & targets)
+
+    for square in squares(bitboards.pieces[bishop] | bitboards.pieces[queen]):
+        add_moves(moves, square, bishop_attacks(square, occupied) & targets)
+
+    add_pawn_moves(moves, game_state, color)
+
+    # castling: king and rook have not moved, the tiles between them are empty,
+    # and the king is not check on any of the tiles it passes
+    for move, king_moved, rook_moved, rook_col, empty_cols, safe_cols in castling_moves[color]:
+        row = move[0]
+        if (not getattr(game_state, king_moved) and not getattr(game_state, rook_moved)
+                and bitboards.pieces[king] & bit(row, 3) 
+                and bitboards.pieces[rook] & bit(row, rook_col)
+                and not any(occupied & bit(row, col) for col in empty_cols)
+                and not any(bitboards.is_attacked(row * 8 + col, opponent) for col in safe_cols)):
+            moves.append(move)
+
+    return moves
+
+# add the moves from square to each of the target squares
+def add_moves(moves, from_square, targets):
+    from_row, from_col = divmod(from_square, 8)
+    for to_square in squares(targets):
+        moves.append((from_row, from_col, to_square >> 3, to_square & 7))
+
+# pawns move forward to an empty tile (2 tiles from the starting row), 
+# capture diagonally, capture en passant and are promoted on the last row
+def add_pawn_moves(moves, game_state, color):
+    bitboards = game_state.bitboards
+    opponent = "b" if color == "w" else "w"
+    empty = FULL ^ bitboards.occupied
+    forward = 1 if color == "w" else -1
+    start_row = 1 if color == "w" else 6
+    last_row = ROW_7 if color == "w" else ROW_0
+    promotions = "2354" if color == "w" else "89BA"
+    pawn = '6' if color == "w" else 'C'
+
+    # the tile behind a pawn of the opponent that has just moved 2 forward
+    en_passant = 0
+    if game_state.last_piece_moved == ('C' if color == "w" else '6'):
+        last_from_row, last_col, last_to_row = game_state.last_move[:3]
+        if last_from_row - last_to_row == 2 * forward:
+            en_passant = bit(last_to_row + forward, last_col)
+
+    for square in squares(bitboards.pieces[pawn]):
+        from_row, from_col = divmod(square, 8)
+        one_forward = bit(from_row + forward, from_col) & empty
+        targets = one_forward
+        if one_forward and from_row == start_row:
+            targets |= bit(from_row + 2 * forward, from_col) & empty
+        targets |= PAWN_ATTACKS[color][square] & (bitboards.colors[opponent] | en_passant)
+
+        for to_square in squares(targets):
+            move = (from_row, from_col, to_square >> 3, to_square & 7)
+            if (1 << to_square) & last_row:
+                for piece in promotions:
+                    moves.append(move + (piece,))
+            else:
+                moves.append(move)
+
+#
+#  Functions for check, check-mate and stale-mate
+#  These functions rely on the attack lookup tables in bitboards.py
 #
 
 # is king with color check
 # i.e. is the king under attack by opponent
-def is_check(board, color):
-
-    # find the king
-    for i in range(8):
-        for j in range(8):
-            if ((color == "w" and board[i][j] == '1') 
-                or (color == "b" and board[i][j] == '7')):
-                king = (i, j)
-
-    # print(f"king {king[0]}, {king[1]}")
-    # return True from the loop as soon as 
-    # an opponent's piece is found that attacks the king
-    opponent = "b" if color == "w" else "w"
-    # print(f"opponent {opponent}")
-
-    # check all 64 tiles (other than the king in question)
-    for i in range(8):
-        for j in range(8):
-            # print(f"tile: i {i} j {j}")
-            if (i, j) == king:
-                continue
-            tile = board[i][j]
-            # print(f"piece {board[i][j]}")
-            # if the tile contains a piece with the opponent's color
-            if pieces[tile][0] == opponent: 
-                # check whether it can move to king
-                move = (i, j, king[0], king[1])
-                type = pieces[tile][1]
-                # print(f"type {type}")
-                # don't use king_rules to avoid circularity
-                # king_rules needs to call is_check
-                # note that a king can not be "checked" by another king
-                # but we need to test this for the purpose of check_mate
-                if type == "k" and i - king[0] in [-1,0,1] and j - king[1] in [-1,0,1]:
-                    return True
-                elif type == "n" and knight_rules(board, move):
-                    return True
-                #  The simple rules for capture of the king by pawns are hardcoded here
-                elif type == "p":
-                    forward = 1 if opponent == "w" else -1
-                    if king[0] == i + forward and (king[1] == j + 1 or king[1] == j - 1):
-                        return True
-                elif type in ["q", "r", "b"] and queen_rook_bishop_rules(board, move, type):
-                    return True
-
-    # if no attackers were found, return False
-    return False
+def is_check(game_state, color):
+    return position_cache.lookup(("check", game_state.hash, color),
+                                 lambda: game_state.bitboards.is_check(color))
 
-# is king with color check mate 
-# relies on is_check
+# is king with color check mate:
+# check, and no legal move available
 
 # there is one situation where check_mate depends on previous move:
 # if en passant capture can get us out of check
 # this is why we have to import the game_state, and not just the board
 def is_check_mate(game_state, color):
+    return position_cache.lookup(("mate", game_state.hash, color),
+                                 lambda: is_check(game_state, color) and not has_legal_move(game_state, color))
 
-    board = game_state.board
-    print(f"board {board}")
+# is player with color stale mate:
+# not check, but no legal move available
+def is_stale_mate(game_state, color):
+    return position_cache.lookup(("stale", game_state.hash, color),
+                                 lambda: not is_check(game_state, color) and not has_legal_move(game_state, color))
 
-    # if not check, then not check mate
-    if not is_check(board, color):
-        print("not check on first test")
-        return False
+# stop at the first legal move that is found
+def has_legal_move(game_state, color):
+    return next(legal_moves(game_state, color), None) is not None
 
-    # find the king
-    for i in range(8):
-        for j in range(8):
-            if ((color == "w" and board[i][j] == '1') # white king 
-                or (color == "b" and board[i][j] == '7')): # black king
-                king = (i, j)
-
-    print(f"king {king[0]} {king[1]}")
-    # test whether any valid move is available 
-    # to escape the check
-    for from_row in range(8):
-        for from_col in range(8):
-            # find all pieces of king's color
-            if pieces[board[from_row][from_col]][0] == color:
-                print(pieces[board[from_row][from_col]][2])
-                for to_row in range(8):
-                    for to_col in range(8):
-                        # now test whether this piece can move from ... to ...
-                        if is_valid_move(game_state, from_row, from_col, to_row, to_col):
-                            print(f"is valid move from {from_row} {from_col} to {to_row} {to_col}")
-                            # if the move is valid, test if it fixes the check 
-                            new_board = [[tile for tile in row] for row in board]
-                            new_board[to_row][to_col] = board[from_row][from_col]
-                            new_board[from_row][from_col] = '0'
-                            # if the move results in a new_board where king is not check
-                            # return False (not check mate)
-                            if not is_check(new_board, color):
-                                print("is not check")
-                                return False
-
-    # if no move to safety is found, return True (check-mate)
-    return True
 
+#******************************************************************************
+#
+# perft: the number of positions reached after depth moves (leaf nodes)
+# comparing perft with the known numbers for standard positions
+# tests the rules of chess, and timing it measures their speed
+# (see chess_rules_test.py)
+# the cache is not used, so every position is generated
+#
+#******************************************************************************
+def perft(game_state, depth):
+    if depth == 0:
+        return 1
+
+    color = game_state.next_move_color
+    if depth == 1:
+        return sum(1 for move in legal_moves(game_state, color))
 
+    nodes = 0
+    for move in legal_moves(game_state, color):
+        game_state.push(move)
+        nodes += perft(game_state, depth - 1)
+        game_state.pop()
 
+    return nodes
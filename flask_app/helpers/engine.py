@@ -0,0 +1,324 @@
+#******************************************************************************
+#
+# This module contains the search of the computer opponent (see models/bot.py)
+#
+# - evaluation: material plus piece-square tables, from the side to move
+# - iterative deepening: depth 1, 2, 3, ... until the time or the nodes run out;
+#   the best move of the last completed depth is played
+# - alpha-beta (negamax) with a transposition table keyed by GameState.hash,
+#   mate scores are stored as plies to mate from the position of the entry
+# - move ordering: the best move found before, captures (most valuable victim,
+#   least valuable attacker first), killer moves, the other moves
+# - quiescence search: at depth 0 captures are searched until the position is quiet,
+#   so that a capture is not evaluated before the recapture
+#
+# moves are generated with chess_rules.pseudo_legal_moves and tried out with
+# push / pop, the results are not stored in the position cache
+#
+# a pawn is always promoted to a queen, like Game.prepare_move does
+#
+#******************************************************************************
+
+import time
+
+from flask_app.helpers.chess_rules import pseudo_legal_moves
+from flask_app.helpers.bitboards import squares, WHITE_PIECES
+
+# the value of the pieces in centipawns, by piece code
+PIECE_VALUES = dict(zip(WHITE_PIECES, [0, 900, 330, 320, 500, 100]))
+PIECE_VALUES.update(dict(zip("789ABC", [0, 900, 330, 320, 500, 100])))
+
+# a score above MATE - MAX_PLY is a mate
+MATE = 100000
+MAX_PLY = 128
+
+# piece-square tables, as seen by white, rank 8 first (a-file to h-file)
+PAWN_TABLE = [
+     0,  0,  0,  0,  0,  0,  0,  0,
+    50, 50, 50, 50, 50, 50, 50, 50,
+    10, 10, 20, 30, 30, 20, 10, 10,
+     5,  5, 10, 25, 25, 10,  5,  5,
+     0,  0,  0, 20, 20,  0,  0,  0,
+     5, -5,-10,  0,  0,-10, -5,  5,
+     5, 10, 10,-20,-20, 10, 10,  5,
+     0,  0,  0,  0,  0,  0,  0,  0]
+KNIGHT_TABLE = [
+   -50,-40,-30,-30,-30,-30,-40,-50,
+   -40,-20,  0,  0,  0,  0,-20,-40,
+   -30,  0, 10, 15, 15, 10,  0,-30,
+   -30,  5, 15, 20, 20, 15,  5,-30,
+   -30,  0, 15, 20, 20, 15,  0,-30,
+   -30,  5, 10, 15, 15, 10,  5,-30,
+   -40,-20,  0,  5,  5,  0,-20,-40,
+   -50,-40,-30,-30,-30,-30,-40,-50]
+BISHOP_TABLE = [
+   -20,-10,-10,-10,-10,-10,-10,-20,
+   -10,  0,  0,  0,  0,  0,  0,-10,
+   -10,  0,  5, 10, 10,  5,  0,-10,
+   -10,  5,  5, 10, 10,  5,  5,-10,
+   -10,  0, 10, 10, 10, 10,  0,-10,
+   -10, 10, 10, 10, 10, 10, 10,-10,
+   -10,  5,  0,  0,  0,  0,  5,-10,
+   -20,-10,-10,-10,-10,-10,-10,-20]
+ROOK_TABLE = [
+     0,  0,  0,  0,  0,  0,  0,  0,
+     5, 10, 10, 10, 10, 10, 10,  5,
+    -5,  0,  0,  0,  0,  0,  0, -5,
+    -5,  0,  0,  0,  0,  0,  0, -5,
+    -5,  0,  0,  0,  0,  0,  0, -5,
+    -5,  0,  0,  0,  0,  0,  0, -5,
+    -5,  0,  0,  0,  0,  0,  0, -5,
+     0,  0,  0,  5,  5,  0,  0,  0]
+QUEEN_TABLE = [
+   -20,-10,-10, -5, -5,-10,-10,-20,
+   -10,  0,  0,  0,  0,  0,  0,-10,
+   -10,  0,  5,  5,  5,  5,  0,-10,
+    -5,  0,  5,  5,  5,  5,  0, -5,
+    -5,  0,  5,  5,  5,  5,  0, -5,
+   -10,  0,  5,  5,  5,  5,  0,-10,
+   -10,  0,  0,  0,  0,  0,  0,-10,
+   -20,-10,-10, -5, -5,-10,-10,-20]
+KING_TABLE = [
+   -30,-40,-40,-50,-50,-40,-40,-30,
+   -30,-40,-40,-50,-50,-40,-40,-30,
+   -30,-40,-40,-50,-50,-40,-40,-30,
+   -30,-40,-40,-50,-50,-40,-40,-30,
+   -20,-30,-30,-40,-40,-30,-30,-20,
+   -10,-20,-20,-20,-20,-20,-20,-10,
+    20, 20,  0,  0,  0,  0, 20, 20,
+    20, 30, 10,  0,  0, 10, 30, 20]
+
+# SQUARE_VALUES[piece][square]: the value of the piece plus its table entry,
+# positive for white and negative for black, by square (row * 8 + col)
+SQUARE_VALUES = {}
+for white, black, table in zip(WHITE_PIECES, "789ABC", [KING_TABLE, QUEEN_TABLE, BISHOP_TABLE,
+                                                       KNIGHT_TABLE, ROOK_TABLE, PAWN_TABLE]):
+    # row 0 of the board is rank 1, the last row of the table; col 0 is the h-file
+    # black's tables are mirrored: its row 7 uses the last row of the table
+    SQUARE_VALUES[white] = [PIECE_VALUES[white] + table[(7 - square // 8) * 8 + 7 - square % 8] for square in range(64)]
+    SQUARE_VALUES[black] = [-PIECE_VALUES[black] - table[(square // 8) * 8 + 7 - square % 8] for square in range(64)]
+
+# the flags of the entries of the transposition table
+EXACT, LOWER, UPPER = 0, 1, 2
+
+# the nodes searched between two looks at the clock
+CHECK_EVERY = 1024
+
+
+# mate scores count the plies from the position searched (MATE - ply of the mate);
+# in the transposition table they count the plies from the position of the entry,
+# which can be reached again at another ply
+def score_to_table(score, ply):
+    if score > MATE - MAX_PLY:
+        return score + ply
+    if score < -MATE + MAX_PLY:
+        return score - ply
+    return score
+
+def score_from_table(score, ply):
+    if score > MATE - MAX_PLY:
+        return score - ply
+    if score < -MATE + MAX_PLY:
+        return score + ply
+    return score
+
+
+# the score of the position for the player who has the next move
+def evaluate(game_state):
+    score = 0
+    for piece, bb in game_state.bitboards.pieces.items():
+        values = SQUARE_VALUES[piece]
+        for square in squares(bb):
+            score += values[square]
+
+    return score if game_state.next_move_color == "w" else -score
+
+
+# raised to stop the search when the time or the nodes run out
+class SearchStopped(Exception):
+    pass
+
+#
+# Search: one search for the best move in one position
+# the transposition table and the killer moves are kept from one depth to the next
+#
+class Search():
+
+    # stop: a function that returns True when the search must stop, or None
+    def __init__(self, game_state, time_limit, node_limit, stop=None):
+        self.game_state = game_state
+        self.deadline = time.monotonic() + time_limit
+        self.node_limit = node_limit
+        self.stop = stop
+        self.nodes = 0
+        # hash -> (depth, score, flag, best move)
+        self.table = {}
+        # two quiet moves per ply that caused a cutoff
+        self.killers = [[None, None] for ply in range(MAX_PLY)]
+        # the best move in the position searched, of the last completed depth
+        self.root_move = None
+
+    # count a node, and look at the clock (and stop) every CHECK_EVERY nodes
+    def count_node(self):
+        if self.node_limit and self.nodes >= self.node_limit:
+            raise SearchStopped()
+        self.nodes += 1
+        if self.nodes % CHECK_EVERY == 0:
+            if time.monotonic() > self.deadline or (self.stop is not None and self.stop()):
+                raise SearchStopped()
+
+    # the moves of the player who has the next move, best candidates first
+    # captures are ordered by most valuable victim, then least valuable attacker
+    def ordered_moves(self, best_move, ply, captures_only=False):
+        board = self.game_state.board
+        killers = self.killers[ply] if ply < MAX_PLY else []
+        scored = []
+        for move in pseudo_legal_moves(self.game_state, self.game_state.next_move_color):
+            # only promotions to a queen
+            if len(move) == 5 and move[4] not in "28":
+                continue
+            from_row, from_col, to_row, to_col = move[:4]
+            piece = board[from_row][from_col]
+            victim = board[to_row][to_col]
+            # en passant capture
+            if victim == '0' and piece in "6C" and from_col != to_col:
+                victim = '6'
+            if move == best_move:
+                order = 1000000
+            elif victim != '0':
+                order = 100000 + PIECE_VALUES[victim] * 10 - PIECE_VALUES[piece] // 10
+            elif len(move) == 5:
+                order = 90000
+            elif captures_only:
+                continue
+            elif move in killers:
+                order = 80000
+            else:
+                order = 0
+            scored.append((order, move))
+
+        scored.sort(key=lambda entry: entry[0], reverse=True)
+        return [move for order, move in scored]
+
+    # the score of the position for the player who has the next move,
+    # searching depth plies deep, between alpha and beta
+    def alpha_beta(self, depth, ply, alpha, beta):
+        if depth <= 0:
+            return self.quiescence(ply, alpha, beta)
+        self.count_node()
+
+        game_state = self.game_state
+        color = game_state.next_move_color
+        alpha_start = alpha
+
+        entry = self.table.get(game_state.hash)
+        best_move = None
+        if entry is not None:
+            entry_depth, entry_score, flag, best_move = entry
+            entry_score = score_from_table(entry_score, ply)
+            if entry_depth >= depth and ply > 0:
+                if flag == EXACT:
+                    return entry_score
+                if flag == LOWER and entry_score >= beta:
+                    return entry_score
+                if flag == UPPER and entry_score <= alpha:
+                    return entry_score
+
+        best_score = -MATE
+        legal = 0
+        for move in self.ordered_moves(best_move, ply):
+            game_state.push(move)
+            if game_state.bitboards.is_check(color):
+                game_state.pop()
+                continue
+            legal += 1
+            try:
+                score = -self.alpha_beta(depth - 1, ply + 1, -beta, -alpha)
+            finally:
+                game_state.pop()
+
+            if score > best_score:
+                best_score, best_move = score, move
+            if score > alpha:
+                alpha = score
+            if alpha >= beta:
+                # a quiet move that refutes: try it early in sibling positions
+                if ply < MAX_PLY and game_state.board[move[2]][move[3]] == '0' and move not in self.killers[ply]:
+                    self.killers[ply] = [move, self.killers[ply][0]]
+                break
+
+        # no legal move: check mate (the sooner the worse) or stale mate
+        if legal == 0:
+            return -MATE + ply if game_state.bitboards.is_check(color) else 0
+
+        flag = EXACT if alpha_start < best_score < beta else (LOWER if best_score >= beta else UPPER)
+        self.table[game_state.hash] = (depth, score_to_table(best_score, ply), flag, best_move)
+        if ply == 0:
+            self.root_move = best_move
+        return best_score
+
+    # only captures (and promotions), until the position is quiet
+    # the player to move can also stand pat: keep the evaluation without capturing
+    def quiescence(self, ply, alpha, beta):
+        self.count_node()
+
+        game_state = self.game_state
+        stand_pat = evaluate(game_state)
+        if stand_pat >= beta or ply >= MAX_PLY:
+            return stand_pat
+        alpha = max(alpha, stand_pat)
+
+        color = game_state.next_move_color
+        for move in self.ordered_moves(None, ply, captures_only=True):
+            game_state.push(move)
+            if game_state.bitboards.is_check(color):
+                game_state.pop()
+                continue
+            try:
+                score = -self.quiescence(ply + 1, -beta, -alpha)
+            finally:
+                game_state.pop()
+
+            if score >= beta:
+                return score
+            alpha = max(alpha, score)
+
+        return alpha
+
+    # iterative deepening
+    # returns a dictionary: move (None if there is no legal move), score, depth, nodes
+    def best_move(self, max_depth):
+        color = self.game_state.next_move_color
+        result = {"move": None, "score": 0, "depth": 0, "nodes": 0}
+
+        # a legal move, in case not even depth 1 completes
+        for move in self.ordered_moves(None, 0):
+            self.game_state.push(move)
+            is_legal = not self.game_state.bitboards.is_check(color)
+            self.game_state.pop()
+            if is_legal:
+                result["move"] = move
+                break
+
+        if result["move"] is not None:
+            for depth in range(1, max_depth + 1):
+                try:
+                    score = self.alpha_beta(depth, 0, -MATE - 1, MATE + 1)
+                except SearchStopped:
+                    break
+                result.update(move=self.root_move, score=score, depth=depth)
+                # a forced mate has been found
+                if abs(score) > MATE - MAX_PLY:
+                    break
+
+        result["nodes"] = self.nodes
+        return result
+
+
+# the best move for the player who has the next move in game_state
+# searches at most time_limit seconds and node_limit nodes (None: no limit)
+# returns a dictionary: move (None if there is no legal move), score (centipawns
+# for the player to move), depth (of the last completed search), nodes
+# stop: a function that returns True when the search must stop (e.g. cancelled)
+def best_move(game_state, time_limit=1.0, node_limit=None, max_depth=MAX_PLY - 1, stop=None):
+    return Search(game_state, time_limit, node_limit, stop).best_move(max_depth)
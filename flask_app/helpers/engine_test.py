@@ -0,0 +1,60 @@
+#******************************************************************************
+#
+# Tests for the search of the computer opponent in engine.py
+#
+# run the tests:
+#     python -m pytest flask_app/helpers/engine_test.py
+#
+#******************************************************************************
+
+import pytest
+
+from flask_app.helpers import engine
+from flask_app.helpers.game_state import GameState
+from flask_app.helpers.notation import to_san
+
+
+@pytest.mark.parametrize("fen, san", [
+    # mate in one
+    ("r1bqkb1r/pppp1ppp/2n2n2/4p2Q/2B1P3/8/PPPP1PPP/RNB1K1NR w KQkq - 4 4", "Qxf7#"),
+    ("6k1/5ppp/8/8/8/8/5PPP/3R2K1 w - - 0 1", "Rd8#"),
+    # a free queen
+    ("4k3/8/8/8/8/8/4q3/4K3 w - - 0 1", "Kxe2"),
+    # promotion
+    ("8/P6k/8/8/8/8/8/K7 w - - 0 1", "a8=Q"),
+])
+def test_best_move(fen, san):
+    game_state = GameState.from_fen(fen)
+    result = engine.best_move(game_state, time_limit=5, node_limit=20000)
+    assert to_san(game_state, result["move"]) == san
+    # the search leaves the game state as it was
+    assert game_state.to_fen() == GameState.from_fen(fen).to_fen()
+
+
+def test_no_legal_move():
+    result = engine.best_move(GameState.from_fen("7k/5Q2/6K1/8/8/8/8/8 b - - 0 1"))
+    assert result["move"] is None
+
+
+# the node limit stops the search, there is always a move
+def test_node_limit():
+    result = engine.best_move(GameState.opening(), time_limit=5, node_limit=2000)
+    assert result["move"] is not None
+    assert result["nodes"] <= 2000
+
+
+# a mate found in one search and reached again in another at a later ply (a transposition):
+# the score counts the plies to mate from where the position is reached
+def test_mate_score_through_transposition():
+    # 1. Kg6 Kg8 (forced) 2. Ra8#
+    root = GameState.from_fen("7k/8/5K2/8/8/8/8/R7 w - - 0 1")
+    assert engine.best_move(root, time_limit=5, max_depth=4)["score"] == engine.MATE - 3
+
+    # the position after 1. Kg6 Kg8 is searched first: mate in one
+    search = engine.Search(GameState.from_fen("6k1/8/6K1/8/8/8/8/R7 w - - 0 1"), 5, None)
+    assert search.best_move(2)["score"] == engine.MATE - 1
+
+    # and is found in the table at ply 2 of the search of the first position
+    transposed = engine.Search(GameState.from_fen("7k/8/5K2/8/8/8/8/R7 w - - 0 1"), 5, None)
+    transposed.table = search.table
+    assert transposed.best_move(4)["score"] == engine.MATE - 3
@@ -0,0 +1,69 @@
+#******************************************************************************
+#
+# This module passes events of a game (moves) to the clients
+# that are watching the game, see /api/games/<game_id>/events
+#
+# every open event stream subscribes with a queue,
+# Game.make_move publishes an event to the queues of that game
+#
+# the subscribers live in the memory of this process:
+# all requests for one game must be served by the same process
+#
+#******************************************************************************
+
+import queue
+import threading
+
+# events that have not been sent yet, per subscriber
+# a subscriber that falls further behind misses events
+# (the client reloads the game when it notices a gap in the ply numbers)
+MAX_QUEUED_EVENTS = 100
+
+
+class GameEvents():
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # game_id -> set of queues
+        self.subscribers = {}
+
+    # start receiving the events of a game
+    # returns the queue the events are put into
+    # events: any object with a put_nowait method, by default a new queue.Queue
+    # (the async API passes a queue that hands the events to its event loop)
+    def subscribe(self, game_id, events=None):
+        if events is None:
+            events = queue.Queue(maxsize=MAX_QUEUED_EVENTS)
+        with self.lock:
+            self.subscribers.setdefault(game_id, set()).add(events)
+        return events
+
+    def unsubscribe(self, game_id, events):
+        with self.lock:
+            subscribers = self.subscribers.get(game_id)
+            if subscribers is not None:
+                subscribers.discard(events)
+                if not subscribers:
+                    del self.subscribers[game_id]
+
+    # send event to all subscribers of the game, without waiting
+    def publish(self, game_id, event):
+        with self.lock:
+            subscribers = list(self.subscribers.get(game_id, ()))
+        for events in subscribers:
+            try:
+                events.put_nowait(event)
+            except queue.Full:
+                pass
+
+    # the number of open event streams
+    @property
+    def stats(self):
+        with self.lock:
+            return {
+                "games": len(self.subscribers),
+                "subscribers": sum(len(subscribers) for subscribers in self.subscribers.values())
+            }
+
+
+game_events = GameEvents()
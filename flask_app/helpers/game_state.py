@@ -0,0 +1,383 @@
+#******************************************************************************
+#
+# This module contains the GameState object
+# the complete state of a game, sufficient to validate any given move
+#
+# moves are made and taken back in place with push / pop,
+# so that the rules of chess can try out moves without copying the board
+#
+# every game state has a Zobrist hash (see zobrist.py), updated by push / pop,
+# that identifies the position
+#
+# a game state can be written as FEN (to_fen / from_fen), and packed
+# into 33 bytes (pack / unpack) to store it or to send it to another process
+#
+#******************************************************************************
+
+from flask_app.helpers.bitboards import Bitboards, PAWN_ATTACKS
+from flask_app.helpers.zobrist import (hash_game_state, PIECE_KEYS, BLACK_TO_MOVE_KEY,
+                                       CASTLING_KEYS, EN_PASSANT_KEYS)
+
+# the tiles at the start of a game, the same as Game.opening_position
+OPENING_TILES = "54312345" + "66666666" + "0" * 32 + "CCCCCCCC" + "BA9789AB"
+
+# FEN letters of the piece codes of games.tiles, and the other way around
+FEN_LETTERS = {
+    '1': "K", '2': "Q", '3': "B", '4': "N", '5': "R", '6': "P",
+    '7': "k", '8': "q", '9': "b", 'A': "n", 'B': "r", 'C': "p"
+}
+FEN_PIECES = {letter: piece for piece, letter in FEN_LETTERS.items()}
+
+# the files of the columns: col 0 is the h-file, col 7 the a-file
+FILES = "hgfedcba"
+
+# pack: a pawn that can be captured en passant is packed as
+# one of the codes that are not used by games.tiles
+EN_PASSANT_PAWNS = {'6': 'D', 'C': 'E'}
+
+#
+# GameState is an object that has no correspondence in the database
+# It represents the complete state of a game,
+# sufficient to determine whether any given move is allowed.
+# It could be the current state of the game,
+# or the possible future state of the game after some extra moves have been tried out,
+# e.g. when testing for check mate
+#
+class GameState():
+
+    def __init__(self, board, next_move_color, last_piece_moved, last_move,
+                white_king_moved, white_rook_0_moved, white_rook_7_moved,
+                black_king_moved, black_rook_0_moved, black_rook_7_moved):
+        # board position as 8 x 8 array of single characters (0-9, A-C)
+        self.board = board
+        # the same board position as bitboards, used by the rules of chess
+        self.bitboards = Bitboards.from_board(board)
+        # who will do the next move
+        self.next_move_color = next_move_color
+        # game memory necessary to decide the validity of the next move
+        self.last_piece_moved   = last_piece_moved
+        self.last_move          = last_move # 4-tuple
+        self.white_king_moved   = white_king_moved
+        self.white_rook_0_moved = white_rook_0_moved
+        self.white_rook_7_moved = white_rook_7_moved
+        self.black_king_moved   = black_king_moved
+        self.black_rook_0_moved = black_rook_0_moved
+        self.black_rook_7_moved = black_rook_7_moved
+        # undo information for every move made with push
+        self.history = []
+        # Zobrist hash of the position
+        self.hash = hash_game_state(self)
+
+    # the game state at the start of a game
+    @classmethod
+    def opening(cls):
+        board = [list(OPENING_TILES[i:i+8]) for i in range(0, 64, 8)]
+        return cls(board, 'w', None, None, False, False, False, False, False, False)
+
+    # the game state stored in the columns of games (and game_snapshots):
+    # tiles, ply, castling (castling_rights), last_piece and last_from_to
+    @classmethod
+    def from_columns(cls, tiles, ply, castling, last_piece, last_from_to):
+        return cls(
+                    [list(tiles[i:i+8]) for i in range(0, 64, 8)],
+                    'w' if (ply % 2 == 0) else 'b',
+                    last_piece,
+                    tuple(int(digit) for digit in last_from_to) if last_from_to else None,
+                    not castling & 3,
+                    not castling & 1,
+                    not castling & 2,
+                    not castling & 12,
+                    not castling & 4,
+                    not castling & 8
+                    )
+
+    # the columns of games for this game state, except ply, see from_columns
+    def columns(self):
+        return {
+            "tiles": "".join("".join(row) for row in self.board),
+            "castling": self.castling_rights,
+            "last_piece": self.last_piece_moved,
+            "last_from_to": "".join(str(digit) for digit in self.last_move) if self.last_move else None
+        }
+
+    # the game state of a FEN string, e.g.
+    #     rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq e3 0 1
+    # the move counters at the end are optional, and not part of the game state
+    # rows are numbered from white's side (rank 1 = row 0),
+    # columns from the h-file (h = col 0, a = col 7)
+    # raises ValueError if fen is not a position
+    @classmethod
+    def from_fen(cls, fen):
+        fields = fen.split()
+        if len(fields) not in [4, 6]:
+            raise ValueError(f"FEN has {len(fields)} fields: {fen}")
+        placement, color, castling, en_passant = fields[:4]
+
+        board = [['0'] * 8 for row in range(8)]
+        fen_rows = placement.split("/")
+        if len(fen_rows) != 8 or color not in ["w", "b"]:
+            raise ValueError(f"not a FEN position: {fen}")
+        for rank, fen_row in enumerate(fen_rows):
+            file = 0
+            for character in fen_row:
+                if character in "12345678":
+                    file += int(character)
+                elif character in FEN_PIECES and file < 8:
+                    board[7 - rank][7 - file] = FEN_PIECES[character]
+                    file += 1
+                else:
+                    raise ValueError(f"not a FEN position: {fen}")
+            if file != 8:
+                raise ValueError(f"not a FEN position: {fen}")
+
+        # the last move is only needed for en passant capture:
+        # the pawn that passed the en passant tile
+        last_piece_moved, last_move = None, None
+        if en_passant != "-":
+            if len(en_passant) != 2 or en_passant[0] not in FILES or en_passant[1] not in "36":
+                raise ValueError(f"not a FEN en passant tile: {fen}")
+            col = FILES.index(en_passant[0])
+            if en_passant[1] == "6":
+                last_piece_moved, last_move = 'C', (6, col, 4, col)
+            else:
+                last_piece_moved, last_move = '6', (1, col, 3, col)
+
+        return cls(
+                    board, color, last_piece_moved, last_move,
+                    "K" not in castling and "Q" not in castling, "K" not in castling, "Q" not in castling,
+                    "k" not in castling and "q" not in castling, "k" not in castling, "q" not in castling
+                    )
+
+    # this game state as FEN
+    # halfmove_clock: plies since the last capture or pawn move
+    # fullmove_number: starts at 1, incremented after every move of black
+    # the en passant tile is only written if the pawn can be captured
+    def to_fen(self, halfmove_clock=0, fullmove_number=1):
+        rows = []
+        for row in range(7, -1, -1):
+            fen_row = ""
+            empty = 0
+            for col in range(7, -1, -1):
+                piece = self.board[row][col]
+                if piece == '0':
+                    empty += 1
+                    continue
+                if empty:
+                    fen_row += str(empty)
+                    empty = 0
+                fen_row += FEN_LETTERS[piece]
+            if empty:
+                fen_row += str(empty)
+            rows.append(fen_row)
+
+        rights = self.castling_rights
+        castling = "".join(letter for bit, letter in [(1, "K"), (2, "Q"), (4, "k"), (8, "q")] if rights & bit)
+
+        en_passant = "-"
+        en_passant_col = self.en_passant_col
+        if en_passant_col is not None:
+            from_row, from_col, to_row, to_col = self.last_move
+            en_passant = f"{FILES[en_passant_col]}{(from_row + to_row) // 2 + 1}"
+
+        return f"{'/'.join(rows)} {self.next_move_color} {castling or '-'} {en_passant} {halfmove_clock} {fullmove_number}"
+
+    # this game state in 33 bytes:
+    #     bytes 0 - 31: the tiles, 2 per byte (the codes of games.tiles are hex digits),
+    #                   a pawn that can be captured en passant as D (white) or E (black)
+    #     byte 32:      bit 0: black has the next move, bits 1 - 4: castling_rights
+    # the last move is only kept if it allows an en passant capture
+    def pack(self):
+        tiles = "".join("".join(row) for row in self.board)
+        en_passant_col = self.en_passant_col
+        if en_passant_col is not None:
+            square = self.last_move[2] * 8 + en_passant_col
+            tiles = tiles[:square] + EN_PASSANT_PAWNS[self.last_piece_moved] + tiles[square + 1:]
+
+        flags = (self.next_move_color == "b") | self.castling_rights << 1
+        return bytes.fromhex(tiles) + bytes([flags])
+
+    # the game state of 33 bytes made by pack
+    @classmethod
+    def unpack(cls, data):
+        tiles = data[:32].hex().upper()
+        flags = data[32]
+
+        last_piece, last_from_to = None, None
+        for pawn, code in EN_PASSANT_PAWNS.items():
+            square = tiles.find(code)
+            if square >= 0:
+                tiles = tiles.replace(code, pawn)
+                row, col = divmod(square, 8)
+                last_piece, last_from_to = pawn, f"{1 if pawn == '6' else 6}{col}{row}{col}"
+
+        # the side to move as the parity of a ply
+        return cls.from_columns(tiles, flags & 1, flags >> 1, last_piece, last_from_to)
+
+    # castling rights as a 4 bit mask:
+    # 1: white king and rook 0 have not moved
+    # 2: white king and rook 7 have not moved
+    # 4: black king and rook 0 have not moved
+    # 8: black king and rook 7 have not moved
+    @property
+    def castling_rights(self):
+        rights = 0
+        if not self.white_king_moved:
+            if not self.white_rook_0_moved:
+                rights |= 1
+            if not self.white_rook_7_moved:
+                rights |= 2
+        if not self.black_king_moved:
+            if not self.black_rook_0_moved:
+                rights |= 4
+            if not self.black_rook_7_moved:
+                rights |= 8
+        return rights
+
+    # the column of a pawn that has just moved 2 forward
+    # and can be captured en passant by a pawn of the next player; 
+    # None otherwise
+    @property
+    def en_passant_col(self):
+        if self.last_piece_moved not in ["6", "C"]:
+            return None
+
+        from_row, from_col, to_row, to_col = self.last_move
+        if abs(to_row - from_row) != 2:
+            return None
+
+        # the tile the pawn passed is attacked by a pawn of the next player
+        passed = ((from_row + to_row) // 2) * 8 + to_col
+        if self.last_piece_moved == "6":
+            attackers = PAWN_ATTACKS["w"][passed] & self.bitboards.pieces["C"]
+        else:
+            attackers = PAWN_ATTACKS["b"][passed] & self.bitboards.pieces["6"]
+
+        return to_col if attackers else None
+
+#******************************************************************************
+#
+# push: make a move on this game state
+# the move has already been verified as a valid move
+# the move is a tuple (from_row, from_col, to_row, to_col)
+# or (from_row, from_col, to_row, to_col, promote_to) for the promotion of a pawn
+# 1. record captured piece - extra logic for en passant
+# 2. update board and bitboards with the move - extra logic for castling
+# 3. update the game memory
+# returns the captured piece, or None
+#
+#******************************************************************************
+    def push(self, move):
+        from_row, from_col, to_row, to_col = move[:4]
+        board = self.board
+        bitboards = self.bitboards
+        moving_piece = board[from_row][from_col]
+        captured = board[to_row][to_col]
+        final_piece = moving_piece if len(move) == 4 else move[4]
+        from_square = from_row * 8 + from_col
+        to_square = to_row * 8 + to_col
+
+        # the keys of the old castling rights and en passant column
+        # are XORed out of the hash, the new ones in
+        hash = self.hash ^ CASTLING_KEYS[self.castling_rights] ^ BLACK_TO_MOVE_KEY
+        en_passant_col = self.en_passant_col
+        if en_passant_col is not None:
+            hash ^= EN_PASSANT_KEYS[en_passant_col]
+
+        hash ^= PIECE_KEYS[moving_piece][from_square] ^ PIECE_KEYS[final_piece][to_square]
+        if captured != '0':
+            hash ^= PIECE_KEYS[captured][to_square]
+
+        # save enough information to take the move back
+        self.history.append((
+            move, moving_piece, captured, self.hash,
+            self.next_move_color, self.last_piece_moved, self.last_move,
+            self.white_king_moved, self.white_rook_0_moved, self.white_rook_7_moved,
+            self.black_king_moved, self.black_rook_0_moved, self.black_rook_7_moved
+        ))
+
+        bitboards.move(moving_piece, from_square, to_square, captured)
+        board[to_row][to_col] = final_piece
+        board[from_row][from_col] = '0'
+
+        # en passant capture:
+        # a pawn moves diagonally to an empty tile
+        # remove the captured pawn
+        if moving_piece in "6C" and from_col != to_col and captured == '0':
+            captured = board[from_row][to_col]
+            board[from_row][to_col] = '0'
+            bitboards.remove(captured, from_row * 8 + to_col)
+            hash ^= PIECE_KEYS[captured][from_row * 8 + to_col]
+
+        # castling:
+        # the king's move has been taken care off
+        # now also move the rook
+        elif moving_piece in "17" and to_col - from_col in [2, -2]:
+            rook_from, rook_to = (0, 2) if to_col == 1 else (7, 4)
+            board[from_row][rook_to] = board[from_row][rook_from]
+            board[from_row][rook_from] = '0'
+            bitboards.move(board[from_row][rook_to], from_row * 8 + rook_from, from_row * 8 + rook_to)
+            rook_keys = PIECE_KEYS[board[from_row][rook_to]]
+            hash ^= rook_keys[from_row * 8 + rook_from] ^ rook_keys[from_row * 8 + rook_to]
+
+        # promotion: replace the pawn with the new piece
+        if len(move) == 5:
+            bitboards.remove(moving_piece, to_square)
+            bitboards.put(final_piece, to_square)
+
+        # game memory
+        self.next_move_color = "b" if self.next_move_color == "w" else "w"
+        self.last_piece_moved = moving_piece
+        self.last_move = (from_row, from_col, to_row, to_col)
+        # a king or rook that moves or a rook that is captured can no longer castle
+        self.white_king_moved   = self.white_king_moved or (from_row, from_col) == (0, 3)
+        self.white_rook_0_moved = self.white_rook_0_moved or (0, 0) in [(from_row, from_col), (to_row, to_col)]
+        self.white_rook_7_moved = self.white_rook_7_moved or (0, 7) in [(from_row, from_col), (to_row, to_col)]
+        self.black_king_moved   = self.black_king_moved or (from_row, from_col) == (7, 3)
+        self.black_rook_0_moved = self.black_rook_0_moved or (7, 0) in [(from_row, from_col), (to_row, to_col)]
+        self.black_rook_7_moved = self.black_rook_7_moved or (7, 7) in [(from_row, from_col), (to_row, to_col)]
+
+        hash ^= CASTLING_KEYS[self.castling_rights]
+        en_passant_col = self.en_passant_col
+        if en_passant_col is not None:
+            hash ^= EN_PASSANT_KEYS[en_passant_col]
+        self.hash = hash
+
+        return captured if captured != '0' else None
+
+#******************************************************************************
+#
+# pop: take back the last move made with push
+#
+#******************************************************************************
+    def pop(self):
+        (move, moving_piece, captured, self.hash,
+            self.next_move_color, self.last_piece_moved, self.last_move,
+            self.white_king_moved, self.white_rook_0_moved, self.white_rook_7_moved,
+            self.black_king_moved, self.black_rook_0_moved, self.black_rook_7_moved) = self.history.pop()
+
+        from_row, from_col, to_row, to_col = move[:4]
+        board = self.board
+        bitboards = self.bitboards
+
+        if len(move) == 5:
+            bitboards.remove(move[4], to_row * 8 + to_col)
+            bitboards.put(moving_piece, to_row * 8 + to_col)
+
+        bitboards.move(moving_piece, to_row * 8 + to_col, from_row * 8 + from_col)
+        board[from_row][from_col] = moving_piece
+        board[to_row][to_col] = captured
+        if captured != '0':
+            bitboards.put(captured, to_row * 8 + to_col)
+
+        # en passant capture: put the captured pawn back
+        if moving_piece in "6C" and from_col != to_col and captured == '0':
+            pawn = 'C' if moving_piece == '6' else '6'
+            board[from_row][to_col] = pawn
+            bitboards.put(pawn, from_row * 8 + to_col)
+
+        # castling: move the rook back
+        elif moving_piece in "17" and to_col - from_col in [2, -2]:
+            rook_from, rook_to = (0, 2) if to_col == 1 else (7, 4)
+            board[from_row][rook_from] = board[from_row][rook_to]
+            board[from_row][rook_to] = '0'
+            bitboards.move(board[from_row][rook_from], from_row * 8 + rook_to, from_row * 8 + rook_from)
@@ -0,0 +1,52 @@
+#******************************************************************************
+#
+# Tests for FEN and the packed game state in game_state.py
+#
+# run the tests:
+#     python -m pytest flask_app/helpers/game_state_test.py
+#
+#******************************************************************************
+
+import pytest
+
+from flask_app.helpers import chess_rules
+from flask_app.helpers.chess_rules_test import positions
+from flask_app.helpers.game_state import GameState
+
+
+# the test positions are written back as the same FEN
+def test_fen():
+    assert GameState.opening().to_fen() == "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+    assert GameState.from_fen("rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1").hash == GameState.opening().hash
+    for name, fen, counts, max_depth in positions:
+        assert GameState.from_fen(fen).to_fen(3, 12) == fen + " 3 12", name
+
+
+@pytest.mark.parametrize("fen", [
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP w KQkq -",
+    "rnbqkbnr/pppppppp/9/8/8/8/PPPPPPPP/RNBQKBNR w KQkq -",
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNX w KQkq -",
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR x KQkq -",
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq e5",
+])
+def test_fen_errors(fen):
+    with pytest.raises(ValueError):
+        GameState.from_fen(fen)
+
+
+# pack and unpack give the same position, with the same hash,
+# for the test positions and the positions after one move
+def test_pack_unpack():
+    for name, fen, counts, max_depth in positions:
+        game_state = GameState.from_fen(fen)
+        for move in [None] + list(chess_rules.generate_legal_moves(game_state)):
+            if move:
+                game_state.push(move)
+            packed = game_state.pack()
+            unpacked = GameState.unpack(packed)
+            assert len(packed) == 33
+            assert unpacked.to_fen() == game_state.to_fen(), name
+            assert unpacked.hash == game_state.hash, name
+            assert unpacked.pack() == packed, name
+            if move:
+                game_state.pop()
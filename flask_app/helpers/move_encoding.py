@@ -0,0 +1,84 @@
+#******************************************************************************
+#
+# This module packs a move into a 16-bit integer
+#     bits  0 -  5: from square (row * 8 + col, as in games.tiles)
+#     bits  6 - 11: to square
+#     bits 12 - 13: the new piece of a promotion: 0 queen, 1 rook, 2 bishop, 3 knight
+#     bits 14 - 15: flag: MOVE_QUIET, MOVE_CAPTURE, MOVE_CASTLING or MOVE_PROMOTION
+#
+# the moves of a whole game fit in an array('H'), 2 bytes per move,
+# and replay turns such an array back into a GameState
+#
+#******************************************************************************
+
+from array import array
+
+from flask_app.helpers.game_state import GameState
+
+MOVE_QUIET = 0
+MOVE_CAPTURE = 1
+MOVE_CASTLING = 2
+MOVE_PROMOTION = 3
+
+# the new piece of a promotion, by color:
+# white pawns are promoted on row 7, black pawns on row 0
+PROMOTION_PIECES = {"w": "2534", "b": "8B9A"}
+
+
+def encode_move(from_row, from_col, to_row, to_col, promote_to=None, flag=MOVE_QUIET):
+    code = (from_row * 8 + from_col) | (to_row * 8 + to_col) << 6
+    if promote_to:
+        code |= PROMOTION_PIECES["w" if to_row == 7 else "b"].index(promote_to) << 12
+        flag = MOVE_PROMOTION
+
+    return code | flag << 14
+
+# the code of a row of the moves table
+# (piece, from_row, from_column, to_row, to_column, promote_to, captured)
+def encode_move_row(row):
+    if row["captured"]:
+        flag = MOVE_CAPTURE
+    elif row["piece"] in "17" and abs(row["to_column"] - row["from_column"]) == 2:
+        flag = MOVE_CASTLING
+    else:
+        flag = MOVE_QUIET
+
+    return encode_move(row["from_row"], row["from_column"], row["to_row"], row["to_column"],
+                       row["promote_to"], flag)
+
+# the move as used by GameState.push:
+# (from_row, from_col, to_row, to_col), plus the new piece for a promotion
+def decode_move(code):
+    from_square = code & 63
+    to_square = (code >> 6) & 63
+    move = (from_square >> 3, from_square & 7, to_square >> 3, to_square & 7)
+    if code >> 14 == MOVE_PROMOTION:
+        return move + (PROMOTION_PIECES["w" if move[2] == 7 else "b"][(code >> 12) & 3],)
+
+    return move
+
+def move_flag(code):
+    return code >> 14
+
+def encode_history(rows):
+    return array('H', (encode_move_row(row) for row in rows))
+
+
+# the game state after the first ply moves of history (all moves by default)
+# the moves are made with push on game_state, by default the opening position;
+# game_state can also be the position after the first start moves
+# the moves are not checked, they come from the database
+def replay(history, ply=None, game_state=None, start=0):
+    if game_state is None:
+        game_state = GameState.opening()
+    if ply is None:
+        ply = len(history)
+
+    push = game_state.push
+    for index in range(start, ply):
+        push(decode_move(history[index]))
+
+    # replayed moves are not taken back
+    game_state.history.clear()
+
+    return game_state
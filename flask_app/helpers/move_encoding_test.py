@@ -0,0 +1,58 @@
+#******************************************************************************
+#
+# Tests for the 16-bit move codes and replay in move_encoding.py
+#
+# run the tests:
+#     python -m pytest flask_app/helpers/move_encoding_test.py
+#
+#******************************************************************************
+
+from array import array
+
+from flask_app.helpers import chess_rules
+from flask_app.helpers.chess_rules_test import positions
+from flask_app.helpers.game_state import GameState
+from flask_app.helpers.move_encoding import (encode_move, decode_move, move_flag, replay,
+                                             MOVE_PROMOTION)
+
+
+# every legal move of the test positions, and of the positions after one move,
+# is decoded to the same move
+def test_encode_decode():
+    for name, fen, counts, max_depth in positions:
+        game_state = GameState.from_fen(fen)
+        for move in chess_rules.generate_legal_moves(game_state):
+            assert decode_move(encode_move(*move)) == move, name
+            game_state.push(move)
+            for reply in chess_rules.generate_legal_moves(game_state):
+                assert decode_move(encode_move(*reply)) == reply, name
+            game_state.pop()
+
+
+def test_promotion():
+    code = encode_move(6, 3, 7, 2, '4')
+    assert move_flag(code) == MOVE_PROMOTION
+    assert decode_move(code) == (6, 3, 7, 2, '4')
+    assert decode_move(encode_move(1, 0, 0, 0, 'B')) == (1, 0, 0, 0, 'B')
+
+
+# replay gives the same position as making the moves one by one
+def test_replay():
+    game_state = GameState.opening()
+    history = array('H')
+    # always make the 7th legal move (or the last one), 80 plies or until the game ends
+    for ply in range(80):
+        moves = chess_rules.generate_legal_moves(game_state)
+        if not moves:
+            break
+        move = moves[min(6, len(moves) - 1)]
+        history.append(encode_move(*move))
+        game_state.push(move)
+
+        replayed = replay(history)
+        assert replayed.board == game_state.board
+        assert replayed.hash == game_state.hash
+
+    # replay from the middle of the game
+    middle = replay(history, 20)
+    assert replay(history, game_state=middle, start=20).hash == game_state.hash
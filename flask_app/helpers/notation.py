@@ -0,0 +1,211 @@
+#******************************************************************************
+#
+# This module writes games and moves in the standard chess notations
+# - SAN: standard algebraic notation of a move (e4, Nxf3, O-O, e8=Q#)
+# - PGN: a whole game, with headers and the moves in SAN
+# SAN and PGN are also read, to import games (see pgn_import.py)
+# FEN, for positions, is written and read by GameState (to_fen / from_fen)
+#
+# rows are numbered from white's side (row 0 = rank 1),
+# columns from the h-file (col 0 = h, col 7 = a)
+#
+#******************************************************************************
+
+import re
+
+from flask_app.helpers import chess_rules
+from flask_app.helpers.game_state import FEN_LETTERS, FILES
+
+# the name of a tile, e.g. (1, 3) -> "e2"
+def tile_name(row, col):
+    return f"{FILES[col]}{row + 1}"
+
+
+#******************************************************************************
+#
+# SAN
+# the move must be legal in game_state, and has not been made yet
+#
+#******************************************************************************
+def to_san(game_state, move):
+    from_row, from_col, to_row, to_col = move[:4]
+    board = game_state.board
+    piece = board[from_row][from_col]
+    color = game_state.next_move_color
+    letter = FEN_LETTERS[piece].upper()
+
+    if letter == "K" and to_col - from_col in [2, -2]:
+        san = "O-O" if to_col == 1 else "O-O-O"
+
+    elif letter == "P":
+        san = ""
+        # a pawn that changes column captures, also en passant
+        if from_col != to_col:
+            san = FILES[from_col] + "x"
+        san += tile_name(to_row, to_col)
+        if len(move) == 5:
+            san += "=" + FEN_LETTERS[move[4]].upper()
+
+    else:
+        san = letter
+        # another piece of the same kind that can move to the same tile:
+        # add the file, the rank or both of the tile the piece comes from
+        others = [other for other in chess_rules.legal_moves(game_state, color)
+                  if other[2:4] == (to_row, to_col) and other[:2] != (from_row, from_col)
+                  and board[other[0]][other[1]] == piece]
+        if others:
+            if all(other[1] != from_col for other in others):
+                san += FILES[from_col]
+            elif all(other[0] != from_row for other in others):
+                san += str(from_row + 1)
+            else:
+                san += tile_name(from_row, from_col)
+        if board[to_row][to_col] != '0':
+            san += "x"
+        san += tile_name(to_row, to_col)
+
+    # check and check mate
+    opponent = "b" if color == "w" else "w"
+    game_state.push(move)
+    if game_state.bitboards.is_check(opponent):
+        san += "+" if next(chess_rules.legal_moves(game_state, opponent), None) else "#"
+    game_state.pop()
+
+    return san
+
+
+#******************************************************************************
+#
+# PGN
+# headers: list of (name, value), in the order they are written
+# sans: the moves in SAN
+# result: "1-0", "0-1", "1/2-1/2" or "*" (game not finished or result unknown)
+# yields the lines of the game, moves are wrapped at 80 characters
+#
+#******************************************************************************
+def pgn_lines(headers, sans, result):
+    for name, value in headers:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"')
+        yield f'[{name} "{value}"]'
+    yield ""
+
+    line = ""
+    for index, san in enumerate(sans):
+        token = f"{index // 2 + 1}. {san}" if index % 2 == 0 else san
+        if line and len(line) + 1 + len(token) > 80:
+            yield line
+            line = token
+        else:
+            line = f"{line} {token}" if line else token
+
+    if line and len(line) + 1 + len(result) > 80:
+        yield line
+        line = result
+    else:
+        line = f"{line} {result}" if line else result
+    yield line
+    yield ""
+
+
+#******************************************************************************
+#
+# reading SAN and PGN
+#
+#******************************************************************************
+
+# the piece codes of the SAN letters, by color
+PIECE_CODES = {
+    "w": {"K": '1', "Q": '2', "B": '3', "N": '4', "R": '5', "P": '6'},
+    "b": {"K": '7', "Q": '8', "B": '9', "N": 'A', "R": 'B', "P": 'C'}
+}
+
+# the move of game_state written as san, e.g. "Nbd7", "exd8=Q+", "O-O"
+# raises ValueError if san is not exactly one legal move
+def from_san(game_state, san):
+    color = game_state.next_move_color
+    codes = PIECE_CODES[color]
+    text = san.rstrip("+#!?").replace("0", "O")
+    if not text:
+        raise ValueError(f"not a move: {san}")
+
+    promote_to = None
+    if text in ["O-O", "O-O-O"]:
+        row = 0 if color == "w" else 7
+        piece, to_row, to_col, origin = codes["K"], row, 1 if text == "O-O" else 5, "e"
+    else:
+        # promotion: e8=Q, also written e8Q
+        if "=" in text:
+            text, letter = text.split("=")
+            promote_to = codes.get(letter)
+        elif text[-1:] in "QRBN" and text[:1] in FILES:
+            text, promote_to = text[:-1], codes[text[-1]]
+
+        letter = text[0] if text[:1] in "KQRBN" else "P"
+        text = (text[1:] if letter != "P" else text).replace("x", "")
+        if len(text) < 2 or text[-2] not in FILES or text[-1] not in "12345678":
+            raise ValueError(f"not a move: {san}")
+        piece = codes[letter]
+        to_row, to_col = int(text[-1]) - 1, FILES.index(text[-2])
+        # the file and/or rank of the tile the piece comes from
+        origin = text[:-2]
+
+    board = game_state.board
+    moves = []
+    for move in chess_rules.legal_moves(game_state, color):
+        from_row, from_col = move[:2]
+        if (move[2:4] == (to_row, to_col) and board[from_row][from_col] == piece
+                and all(FILES[from_col] == char if char in FILES else str(from_row + 1) == char for char in origin)
+                and (move[4] if len(move) == 5 else None) == promote_to):
+            moves.append(move)
+
+    if len(moves) != 1:
+        raise ValueError(f"{'ambiguous' if moves else 'illegal'} move: {san}")
+    return moves[0]
+
+
+# the games of a PGN file
+# lines: the lines of the file, read one at a time
+# yields (headers, movetext) per game: headers is a dictionary,
+# movetext the moves as written after the headers, with their line breaks
+# (a ; comment ends at the end of its line)
+def pgn_games(lines):
+    headers = {}
+    movetext = []
+    for line in lines:
+        line = line.strip()
+        if line.startswith("[") and line.endswith("]"):
+            # the headers of the next game
+            if movetext:
+                yield headers, "\n".join(movetext)
+                headers, movetext = {}, []
+            name, _, value = line[1:-1].partition(" ")
+            headers[name] = value.strip().strip('"').replace('\\"', '"').replace("\\\\", "\\")
+        elif line and not line.startswith("%"):
+            movetext.append(line)
+
+    if headers or movetext:
+        yield headers, "\n".join(movetext)
+
+# the moves in SAN and the result of a movetext
+# comments ({...} and ; to the end of the line), variations ((...)),
+# move numbers and annotations ($1) are skipped
+def pgn_moves(movetext):
+    sans = []
+    result = "*"
+    depth = 0
+    for token in re.findall(r"\{[^}]*\}|;[^\n]*|\(|\)|[^\s(){};]+", movetext):
+        if token == "(":
+            depth += 1
+        elif token == ")":
+            depth -= 1
+        elif depth or token[0] in "{;$":
+            continue
+        elif token in ["1-0", "0-1", "1/2-1/2", "*"]:
+            result = token
+        else:
+            # 12.e4, 12. e4 and 12... e5
+            san = token.lstrip("0123456789").lstrip(".") if token[0].isdigit() and "." in token else token
+            if san:
+                sans.append(san)
+
+    return sans, result
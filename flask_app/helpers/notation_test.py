@@ -0,0 +1,54 @@
+#******************************************************************************
+#
+# Tests for SAN and PGN in notation.py
+#
+# run the tests:
+#     python -m pytest flask_app/helpers/notation_test.py
+#
+#******************************************************************************
+
+from flask_app.helpers import chess_rules
+from flask_app.helpers.chess_rules_test import positions
+from flask_app.helpers.game_state import GameState
+from flask_app.helpers.notation import to_san, from_san, pgn_lines, pgn_games, pgn_moves
+
+
+# every SAN of these games belongs to exactly one legal move:
+# captures, castling, two knights that can reach the same tile, check and check mate
+def test_to_san():
+    games = [
+        "e4 e5 Nf3 Nc6 Bc4 Nf6 O-O Bc5 d3 Ng4 Nxe5 Ncxe5 h3 Nxf2 Rxf2 Bxf2+ Kxf2 Qf6+",
+        "e4 e5 Bc4 Nc6 Qh5 Nf6 Qxf7#"
+    ]
+    for sans in games:
+        game_state = GameState.opening()
+        for san in sans.split():
+            color = game_state.next_move_color
+            moves = [move for move in chess_rules.legal_moves(game_state, color) if to_san(game_state, move) == san]
+            assert len(moves) == 1, san
+            game_state.push(moves[0])
+
+
+def test_pgn_lines():
+    lines = list(pgn_lines([("White", 'A "B"'), ("Result", "1-0")], ["e4", "e5", "Qh5"], "1-0"))
+    assert lines == ['[White "A \\"B\\""]', '[Result "1-0"]', "", "1. e4 e5 2. Qh5 1-0", ""]
+
+
+# the SAN of every legal move of the test positions is read back as the same move
+def test_from_san():
+    for name, fen, counts, max_depth in positions:
+        game_state = GameState.from_fen(fen)
+        for move in chess_rules.legal_moves(game_state, game_state.next_move_color):
+            assert from_san(game_state, to_san(game_state, move)) == move, name
+
+
+def test_pgn_games():
+    lines = ['[Event "A"]', '[White "Ann"]', '', '1. e4 {a comment} e5 (1... c5 2. Nf3) 2. Nf3 $1', 'Nc6 1-0', '',
+             '[Event "B"]', '', '1.d4 d5 2.c4 *',
+             '[Event "C"]', '', '1. e4 ; king pawn', 'e5 2. Nf3 1-0']
+    games = list(pgn_games(lines))
+    assert [headers for headers, movetext in games] == [{"Event": "A", "White": "Ann"}, {"Event": "B"}, {"Event": "C"}]
+    assert pgn_moves(games[0][1]) == (["e4", "e5", "Nf3", "Nc6"], "1-0")
+    assert pgn_moves(games[1][1]) == (["d4", "d5", "c4"], "*")
+    # a ; comment ends with its line
+    assert pgn_moves(games[2][1]) == (["e4", "e5", "Nf3"], "1-0")
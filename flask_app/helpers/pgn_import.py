@@ -0,0 +1,75 @@
+#******************************************************************************
+#
+# This module turns the games of a PGN file into the rows of
+# games, moves and game_snapshots, see Game.import_pgn
+#
+# every move is checked with chess_rules (see notation.from_san),
+# a game with a move that is not legal is rejected as a whole
+#
+# parse_games runs in the worker processes of a ProcessPoolExecutor:
+# its arguments and results are plain lists, tuples and dictionaries
+#
+#******************************************************************************
+
+from flask_app.helpers import chess_rules, move_encoding, notation
+from flask_app.helpers.game_state import GameState
+
+# the columns of moves, in the order of the tuples of parse_game
+MOVE_COLUMNS = ("piece", "from_row", "from_column", "to_row", "to_column", "promote_to", "captured")
+
+
+# games: list of (headers, movetext), see notation.pgn_games
+# returns a list with one dictionary per game:
+#    headers: the headers of the game
+#    error:   why the game can not be imported, or None; if None also:
+#    game:    the columns of games (status, tiles, ply, castling, last_piece, last_from_to)
+#    moves:   the columns of moves, as tuples
+#             (piece, from_row, from_column, to_row, to_column, promote_to, captured)
+#    snapshots: the columns of game_snapshots, every snapshot_interval plies
+#    positions: (position_hash, move) of every move, for position_index
+#               (the hash before the move, the move as a 16-bit code, see move_encoding.py)
+def parse_games(games, snapshot_interval):
+    return [parse_game(headers, movetext, snapshot_interval) for headers, movetext in games]
+
+def parse_game(headers, movetext, snapshot_interval):
+    sans, result = notation.pgn_moves(movetext)
+    result = headers.get("Result", result)
+
+    game_state = GameState.opening()
+    moves = []
+    snapshots = []
+    positions = []
+    for san in sans:
+        try:
+            move = notation.from_san(game_state, san)
+        except ValueError as error:
+            return {"headers": headers, "error": f"ply {len(moves) + 1}: {error}"}
+
+        piece = game_state.board[move[0]][move[1]]
+        position_hash = game_state.hash
+        captured = game_state.push(move)
+        # the moves are not taken back
+        game_state.history.clear()
+        moves.append((piece,) + move[:4] + (move[4] if len(move) == 5 else None, captured))
+        positions.append((position_hash, move_encoding.encode_move_row(dict(zip(MOVE_COLUMNS, moves[-1])))))
+
+        if len(moves) % snapshot_interval == 0:
+            snapshots.append(dict(game_state.columns(), ply=len(moves)))
+
+    # the status codes of games.status
+    opponent = game_state.next_move_color
+    if chess_rules.is_check_mate(game_state, opponent):
+        status = 6
+    elif result == "1/2-1/2" or chess_rules.is_stale_mate(game_state, opponent):
+        status = 4
+    elif result in ["1-0", "0-1"]:
+        status = 5 # resigned
+    elif chess_rules.is_check(game_state, opponent):
+        status = 2
+    else:
+        status = 1
+
+    game = dict(game_state.columns(), status=status, ply=len(moves))
+
+    return {"headers": headers, "error": None, "game": game, "moves": moves, "snapshots": snapshots,
+            "positions": positions}
@@ -0,0 +1,44 @@
+#******************************************************************************
+#
+# Tests for the games read from PGN in pgn_import.py
+#
+# run the tests:
+#     python -m pytest flask_app/helpers/pgn_import_test.py
+#
+#******************************************************************************
+
+import pytest
+
+from flask_app.helpers.pgn_import import parse_game
+
+STALE_MATE = "1. e3 a5 2. Qh5 Ra6 3. Qxa5 h5 4. h4 Rah6 5. Qxc7 f6 6. Qxd7+ Kf7 7. Qxb7 Qd3 8. Qxb8 Qh7 9. Qxc8 Kg6 10. Qe6"
+
+
+# games.status: 6 check mate, 4 draw or stale mate, 5 a result without mate (resigned),
+# 2 check and 1 active for games that are not finished
+@pytest.mark.parametrize("movetext, result, status", [
+    ("1. e4 e5 2. Bc4 Nc6 3. Qh5 Nf6 4. Qxf7# 1-0", "1-0", 6),
+    ("1. e4 e5 2. Nf3 1/2-1/2", "1/2-1/2", 4),
+    (STALE_MATE + " *", "*", 4),
+    ("1. e4 e5 2. Nf3 0-1", "0-1", 5),
+    ("1. e4 f5 2. Qh5+ *", "*", 2),
+    ("1. e4 e5 *", "*", 1)
+])
+def test_status(movetext, result, status):
+    parsed = parse_game({"Result": result}, movetext, 16)
+    assert parsed["error"] is None
+    assert parsed["game"]["status"] == status
+    assert parsed["game"]["ply"] == len(parsed["moves"]) == len(parsed["positions"])
+
+
+def test_moves_and_snapshots():
+    parsed = parse_game({}, STALE_MATE, 8)
+    assert parsed["moves"][0] == ('6', 1, 3, 2, 3, None, None)
+    assert parsed["moves"][4] == ('2', 4, 0, 4, 7, None, 'C')
+    assert [snapshot["ply"] for snapshot in parsed["snapshots"]] == [8, 16]
+
+
+def test_illegal_move():
+    parsed = parse_game({"White": "Ann"}, "1. e4 e5 2. Ke3 *", 16)
+    assert parsed["error"] == "ply 3: illegal move: Ke3"
+    assert parsed["headers"] == {"White": "Ann"}
@@ -0,0 +1,79 @@
+#******************************************************************************
+#
+# This module contains a bounded cache of results of the rules of chess,
+# keyed by the Zobrist hash of the position (GameState.hash)
+#
+# many games reach the same positions (openings, forced sequences),
+# so results such as check, check mate and the list of legal moves
+# are computed once and then looked up
+#
+#******************************************************************************
+
+from collections import OrderedDict
+import threading
+
+
+#
+# TranspositionCache is a least-recently-used cache with a maximum size
+# it counts hits and misses, so that its effectiveness can be monitored
+# it is shared by all requests, and therefore protected by a lock
+#
+class TranspositionCache():
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    # look up key
+    # returns (True, value) if key was found, (False, None) otherwise
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return True, self.entries[key]
+            self.misses += 1
+            return False, None
+
+    # store value under key, removing the least recently used entry if full
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    # the cached value of key
+    # computed with compute() and stored if key was not found
+    def lookup(self, key, compute):
+        found, value = self.get(key)
+        if not found:
+            value = compute()
+            self.put(key, value)
+
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    @property
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0
+            }
+
+
+# the cache used by the rules of chess
+position_cache = TranspositionCache(max_size=100000)
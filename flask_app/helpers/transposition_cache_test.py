@@ -0,0 +1,43 @@
+#******************************************************************************
+#
+# Tests for the least-recently-used cache in transposition_cache.py
+#
+# run the tests:
+#     python -m pytest flask_app/helpers/transposition_cache_test.py
+#
+#******************************************************************************
+
+from flask_app.helpers.transposition_cache import TranspositionCache
+
+
+# a full cache removes the entry that was used least recently,
+# get makes an entry the most recently used
+def test_eviction():
+    cache = TranspositionCache(max_size=3)
+    for key in [1, 2, 3]:
+        cache.put(key, str(key))
+
+    assert cache.get(1) == (True, "1")
+    cache.put(4, "4")
+
+    assert cache.get(2) == (False, None)
+    assert [cache.get(key) for key in [1, 3, 4]] == [(True, "1"), (True, "3"), (True, "4")]
+    assert cache.stats["size"] == 3
+
+def test_lookup_and_stats():
+    cache = TranspositionCache(max_size=2)
+    computed = []
+
+    def compute():
+        computed.append(1)
+        return len(computed)
+
+    assert cache.lookup("a", compute) == 1
+    assert cache.lookup("a", compute) == 1
+    assert len(computed) == 1
+
+    stats = cache.stats
+    assert (stats["hits"], stats["misses"], stats["hit_rate"]) == (1, 1, 0.5)
+
+    cache.clear()
+    assert cache.stats == {"size": 0, "max_size": 2, "hits": 0, "misses": 0, "hit_rate": 0.0}
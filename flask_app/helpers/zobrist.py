@@ -0,0 +1,49 @@
+#******************************************************************************
+#
+# This module contains Zobrist hashing of game states
+# a position is identified by a 64-bit integer:
+# the XOR of one random key per piece on a square,
+# plus keys for the side to move, the castling rights and the en passant column
+#
+# making a move changes only a few keys,
+# so GameState.push updates the hash incrementally
+#
+#******************************************************************************
+
+import random
+
+from flask_app.helpers.bitboards import PIECE_CODES, squares
+
+# the keys are generated with a fixed seed:
+# the same position has the same hash in every process,
+# so hashes can be stored and compared across requests
+random_keys = random.Random(20220801)
+
+# PIECE_KEYS[piece][square]
+PIECE_KEYS = {piece: [random_keys.getrandbits(64) for square in range(64)] for piece in PIECE_CODES}
+# XORed in when black has the next move
+BLACK_TO_MOVE_KEY = random_keys.getrandbits(64)
+# CASTLING_KEYS[castling_rights], castling_rights is a 4 bit mask (see GameState)
+CASTLING_KEYS = [random_keys.getrandbits(64) for rights in range(16)]
+# EN_PASSANT_KEYS[col]
+EN_PASSANT_KEYS = [random_keys.getrandbits(64) for col in range(8)]
+
+
+# the hash of a complete game state, computed from scratch
+def hash_game_state(game_state):
+    hash = 0
+    for piece, bb in game_state.bitboards.pieces.items():
+        keys = PIECE_KEYS[piece]
+        for square in squares(bb):
+            hash ^= keys[square]
+
+    if game_state.next_move_color == "b":
+        hash ^= BLACK_TO_MOVE_KEY
+
+    hash ^= CASTLING_KEYS[game_state.castling_rights]
+
+    en_passant_col = game_state.en_passant_col
+    if en_passant_col is not None:
+        hash ^= EN_PASSANT_KEYS[en_passant_col]
+
+    return hash
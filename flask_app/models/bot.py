@@ -0,0 +1,79 @@
+from flask_app import app
+from flask_app.models import user, game
+from flask_app.config.mysqlconnection import ConcurrentUpdate
+from flask_app.helpers.analysis import analysis_service
+
+from concurrent.futures import ThreadPoolExecutor
+import logging
+
+logger = logging.getLogger("flask_app.bot")
+
+#
+# the computer opponent
+# the bot is the user with email app.config["BOT_EMAIL"] (see migrations/04_bot_user.sql),
+# it is invited like any other user and accepts every invitation at once
+#
+# after every move of its opponent, reply searches the bot's move
+# and makes it with Game.make_move, in the background:
+# reply_threads wait for the search and store the move,
+# the search is a best_move job of the analysis service (helpers/analysis.py),
+# which runs in its own processes, so that it does not hold the GIL
+# of the process that serves the requests
+#
+reply_threads = ThreadPoolExecutor(max_workers=app.config["BOT_WORKERS"], thread_name_prefix="bot")
+
+# seconds a reply may wait for a worker of the analysis service
+REPLY_DEADLINE = 60
+
+# the id of the bot user, None if there is no bot user
+# looked up once per process
+bot_user = {}
+
+def bot_user_id():
+    if "id" not in bot_user:
+        found = user.User.get_by_email({"email": app.config["BOT_EMAIL"]})
+        bot_user["id"] = found.id if found else None
+    return bot_user["id"]
+
+def is_bot(user_id):
+    return user_id is not None and user_id == bot_user_id()
+
+
+# the bot's reply in this_game, if the bot plays in it and has the next move
+# returns the future of the reply, or None
+def reply(this_game):
+    bot_id = bot_user_id()
+    if bot_id is None or bot_id not in [this_game.user_id, this_game.opponent_id]:
+        return None
+    if not 0 < int(this_game.status) < 4:
+        return None
+
+    # games.white: the user who sent the invitation plays white
+    bot_is_white = (this_game.user_id == bot_id) == bool(this_game.is_white)
+    if bot_is_white != (this_game.ply % 2 == 0):
+        return None
+
+    return reply_threads.submit(play_reply, this_game.id, this_game.ply)
+
+# search and make the bot's move in the game, after ply moves
+def play_reply(game_id, ply):
+    try:
+        this_game = game.Game.get_by_game_id({"game_id": game_id, "user_id": bot_user_id()})
+        # the game has changed since the reply was requested
+        if this_game.ply != ply or not 0 < int(this_game.status) < 4:
+            return None
+
+        result = analysis_service.submit("best_move", this_game.game_state.pack(), REPLY_DEADLINE,
+                                         time_limit=app.config["BOT_TIME_LIMIT"],
+                                         node_limit=app.config["BOT_NODE_LIMIT"]).result()
+        if result["move"] is None:
+            return None
+
+        this_game.make_move(*result["move"][:4])
+        return result
+    except ConcurrentUpdate:
+        # another reply was made meanwhile
+        return None
+    except Exception:
+        logger.exception("bot reply in game %s failed", game_id)
+        raise
@@ -4,9 +4,19 @@ from flask_app.config.mysqlconnection import connectToMySQL
 from flask_app import app
 from flask import flash, session
 from flask_app.models import user
+from flask_app.models.position_index import PositionIndex
 from flask_app.helpers import chess_rules
+from flask_app.helpers.game_state import GameState
+from flask_app.helpers.game_events import game_events
+from flask_app.helpers import move_encoding
+from flask_app.helpers import notation
+from flask_app.helpers import pgn_import
 
 import math
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, groupby, islice
 
 #
 # A Move object represents a single one-player move
@@ -14,6 +24,9 @@ import math
 class Move():
     db= "chess_schema"
 
+    __slots__ = ("id", "game_id", "piece", "from_row", "from_column", "to_row", "to_column",
+                 "promote_to", "captured", "created_at", "updated_at")
+
     def __init__(self, data):
         self.id = data['id']
         self.game_id = data['game_id']
@@ -27,33 +40,6 @@ class Move():
         self.created_at = data['created_at']
         self.updated_at = data['updated_at']
 
-#
-# GameState is an object that has no correspondencei in the database
-# It represents the complete state of a game, 
-# sufficient to determine whether any given move is allowed.
-# It could be the current state of the game,
-# or the possible future state of the game after some extra moves have been tried out,
-# e.g. when testing for check mate
-# 
-class GameState():
-
-    def __init__(self, board, next_move_color, last_piece_moved, last_move, 
-                white_king_moved, white_rook_0_moved, white_rook_7_moved, 
-                black_king_moved, black_rook_0_moved, black_rook_7_moved):
-        # board position as 8 x 8 array of single characters (0-9, A-C)
-        self.board = board
-        # who will do the next move
-        self.next_move_color = next_move_color
-        # game memory necessary to decide the validity of the next move
-        self.last_piece_moved   = last_piece_moved
-        self.last_move          = last_move # 4-tuple
-        self.white_king_moved   = white_king_moved
-        self.white_rook_0_moved = white_rook_0_moved
-        self.white_rook_7_moved = white_rook_7_moved
-        self.black_king_moved   = black_king_moved
-        self.black_rook_0_moved = black_rook_0_moved
-        self.black_rook_7_moved = black_rook_7_moved
-
 #
 # A Game object represents a single game
 # it contains 2 user objects representing the players
@@ -61,6 +47,44 @@ class GameState():
 class Game():
     db= "chess_schema"
 
+    # fixed attributes, no __dict__ per object
+    __slots__ = ("id", "user_id", "opponent_id", "is_white", "status", "tiles",
+                 "ply", "castling", "last_piece", "last_from_to", "created_at", "updated_at",
+                 "current_player", "current_opponent", "current_is_white", "moves", "cache")
+
+    # the columns of games plus the names of both players, without password hashes
+    # inviter: the user who sent the invitation (games.user_id)
+    # invitee: the user who accepted it (games.opponent_id)
+    select_games  = "SELECT games.id, games.user_id, games.opponent_id, games.white, games.status, games.tiles, "
+    select_games += "games.ply, games.castling, games.last_piece, games.last_from_to, "
+    select_games += "games.created_at, games.updated_at, "
+    select_games += "inviter.id AS inviter_id, inviter.first_name AS inviter_first_name, inviter.last_name AS inviter_last_name, "
+    select_games += "invitee.id AS invitee_id, invitee.first_name AS invitee_first_name, invitee.last_name AS invitee_last_name "
+    select_games += "FROM games "
+    select_games += "JOIN users inviter ON games.user_id = inviter.id "
+    select_games += "JOIN users invitee ON games.opponent_id = invitee.id "
+
+    # the moves of a game after the first %(since)s moves, see get_moves_since
+    select_moves_since  = "SELECT id, game_id, piece, from_row, from_column, to_row, to_column, "
+    select_moves_since += "promote_to, captured, created_at, updated_at FROM moves "
+    select_moves_since += "WHERE game_id = %(game_id)s "
+    select_moves_since += "ORDER BY id "
+    select_moves_since += "LIMIT %(count)s OFFSET %(since)s;"
+    # the largest LIMIT MySQL accepts: no limit
+    all_moves = 18446744073709551615
+
+    # one row of moves, see prepare_move and import_pgn
+    insert_move  = "INSERT INTO moves "
+    insert_move += "(game_id, piece, from_row, from_column, to_row, to_column, promote_to, captured) "
+    insert_move += "VALUES "
+    insert_move += "(%(game_id)s, %(piece)s, %(from_row)s, %(from_column)s, %(to_row)s, %(to_column)s, %(promote_to)s, %(captured)s )"
+
+    # a snapshot of the game state every snapshot_interval plies, see position_at
+    snapshot_interval = 16
+    insert_snapshot  = "INSERT IGNORE INTO game_snapshots "
+    insert_snapshot += "(game_id, ply, tiles, castling, last_piece, last_from_to) "
+    insert_snapshot += "VALUES (%(game_id)s, %(ply)s, %(tiles)s, %(castling)s, %(last_piece)s, %(last_from_to)s);"
+
     opening_position  = "54312345"
     opening_position += "66666666"
     opening_position += "00000000"
@@ -101,13 +125,22 @@ class Game():
         # 1 = active game
         # 2 = check
         # 3 = draw proposed
-        # 4 = draw accepted
+        # 4 = draw accepted (or stale mate)
         # 5 = resign
         # 6 = check mate
         self.status = data['status']
         # tiles is a string of length 64
         # each character represent one tile of the board
         self.tiles = data['tiles'] 
+        # the state of the game next to the tiles
+        # ply: number of moves made, each player's move counts as 1
+        self.ply = data['ply']
+        # castling rights as a 4 bit mask (see GameState.castling_rights)
+        self.castling = data['castling']
+        # the piece and the tiles of the last move, needed for en passant capture
+        # last_from_to is a string of 4 digits: from_row, from_column, to_row, to_column
+        self.last_piece = data['last_piece']
+        self.last_from_to = data['last_from_to']
         self.created_at = data['created_at']
         self.updated_at = data['updated_at']
 
@@ -119,6 +152,19 @@ class Game():
         # self.is_your_turn = None # is it current_player's turn
         self.moves = []  # list of Move objects
 
+        # values derived from the columns above, computed at most once
+        # (a Game object lives for one request), see cached()
+        self.cache = {}
+
+    # the value of a derived property, computed with compute() on first use
+    def cached(self, name, compute):
+        if name not in self.cache:
+            self.cache[name] = compute()
+        return self.cache[name]
+
+    # forget all derived values, after the game has been changed
+    def invalidate(self):
+        self.cache.clear()
 
 
 #******************************************************************************
@@ -136,11 +182,14 @@ class Game():
         # the value of tiles_array[i][j] 
         # is the piece found on row i, column j on the chess board
 
-        return [list(self.tiles)[i:i+8] for i in range(0, 64, 8)]
+        return self.cached("tiles_array", lambda: [list(self.tiles)[i:i+8] for i in range(0, 64, 8)])
 
     # like tiles_array, but with (color, type) tuples instead of single characters
     @property
     def tiles_array_of_tuples(self):
+        return self.cached("tiles_array_of_tuples", self.compute_tiles_array_of_tuples)
+
+    def compute_tiles_array_of_tuples(self):
 
         new_tiles_array = []
         for row in self.tiles_array:
@@ -154,25 +203,19 @@ class Game():
     # number_of_moves: counts each player's move as 1
     @property
     def number_of_moves(self):
-
-        query = ''' SELECT COUNT(*) AS 'count' FROM moves
-                    WHERE game_id = %(game_id)s;
-                '''
-        data = {
-            "game_id": self.id
-        }
-        result = connectToMySQL(Game.db).query_db(query, data)
-        row = result[0]
-
-        return row['count']
+        return self.ply
 
     # move_number counts as 1: one move by white plus one move by black.
     @property
     def move_number(self):
         return math.floor((self.number_of_moves + 1) / 2)
 
+    # evaluated for every tile when the board is rendered
     @property
     def is_current_player_turn(self):
+        return self.cached("is_current_player_turn", self.compute_is_current_player_turn)
+
+    def compute_is_current_player_turn(self):
         
         if self.current_is_white and self.number_of_moves % 2 == 0:
             return True
@@ -184,8 +227,12 @@ class Game():
     # the last move that was made in this game
     @property
     def last_move(self):
+        return self.cached("last_move", self.compute_last_move)
+
+    def compute_last_move(self):
 
-        query  = "SELECT * FROM moves "
+        query  = "SELECT id, game_id, piece, from_row, from_column, to_row, to_column, "
+        query += "promote_to, captured, created_at, updated_at FROM moves "
         query += "WHERE game_id = %(game_id)s "
         query += "ORDER BY created_at DESC "
         query += "LIMIT 1;" 
@@ -201,23 +248,82 @@ class Game():
     # the state of the current game
     # all the information necessary to validate proposed moves
     # represented as a GameState object
+    # built from the columns of the games table, without extra queries
+    # the same GameState object is returned for the rest of the request:
+    # chess_rules only changes it temporarily (push followed by pop)
     @property
     def game_state(self):
+        return self.cached("game_state", self.compute_game_state)
+
+    def compute_game_state(self):
+        return GameState.from_columns(self.tiles, self.ply, self.castling, self.last_piece, self.last_from_to)
+
+    # the game state after the first ply moves of this game
+    # starts from the nearest snapshot (see game_snapshots) at or before ply
+    # and replays the moves after it, fewer than snapshot_interval
+    def position_at(self, ply):
+        if ply == self.ply:
+            return self.compute_game_state()
+
+        query  = "SELECT ply, tiles, castling, last_piece, last_from_to FROM game_snapshots "
+        query += "WHERE game_id = %(game_id)s AND ply <= %(ply)s "
+        query += "ORDER BY ply DESC LIMIT 1;"
+
+        result = connectToMySQL(Game.db).query_db(query, {"game_id": self.id, "ply": ply})
+        if result:
+            snapshot = result[0]
+            start = snapshot["ply"]
+            game_state = GameState.from_columns(snapshot["tiles"], snapshot["ply"], snapshot["castling"],
+                                                snapshot["last_piece"], snapshot["last_from_to"])
+        else:
+            start = 0
+            game_state = GameState.opening()
+
+        # snapshots are missing (a game from before game_snapshots existed):
+        # replay the whole game once and store its snapshots
+        if ply - start >= Game.snapshot_interval:
+            history = self.load_history()
+            self.save_snapshots(history)
+            return move_encoding.replay(history, ply)
+
+        moves = Game.get_moves_since({"game_id": self.id, "since": start, "count": ply - start})
+        history = move_encoding.encode_history(
+            {"piece": move.piece, "from_row": move.from_row, "from_column": move.from_column,
+             "to_row": move.to_row, "to_column": move.to_column,
+             "promote_to": move.promote_to, "captured": move.captured} for move in moves)
+
+        return move_encoding.replay(history, game_state=game_state)
+
+    # store the snapshots of all positions of history
+    # at multiples of snapshot_interval
+    def save_snapshots(self, history):
+        queries = []
+        game_state = GameState.opening()
+        for ply in range(Game.snapshot_interval, len(history) + 1, Game.snapshot_interval):
+            move_encoding.replay(history, ply, game_state, ply - Game.snapshot_interval)
+            queries.append((Game.insert_snapshot, Game.snapshot_data(self.id, ply, game_state)))
+
+        if queries:
+            connectToMySQL(Game.db).query_db_transaction(queries)
+
+    # the data for insert_snapshot
+    @staticmethod
+    def snapshot_data(game_id, ply, game_state):
+        return dict(game_state.columns(), game_id=game_id, ply=ply)
+
+
+    # all moves of this game, with one query,
+    # as an array('H') of 16-bit codes (see move_encoding.py)
+    # move_encoding.replay(history, ply) gives the game state after ply moves
+    def load_history(self):
+
+        query  = "SELECT piece, from_row, from_column, to_row, to_column, promote_to, captured FROM moves "
+        query += "WHERE game_id = %(game_id)s "
+        query += "ORDER BY id;"
 
-        next_move_color = 'w' if (self.number_of_moves % 2 == 0) else 'b'
+        result = connectToMySQL(Game.db).query_db(query, {"game_id": self.id})
 
-        return GameState(
-                    self.tiles_array,
-                    next_move_color, 
-                    self.last_move.piece if self.last_move else None,
-                    (self.last_move.from_row, self.last_move.from_column, self.last_move.to_row, self.last_move.to_column) if self.last_move else None,
-                    self.piece_has_moved(0,3),
-                    self.piece_has_moved(0,0),
-                    self.piece_has_moved(0,7),
-                    self.piece_has_moved(7,3),
-                    self.piece_has_moved(7,0),
-                    self.piece_has_moved(7,7)
-                    )
+        return move_encoding.encode_history(result)
 
 
 #******************************************************************************
@@ -243,28 +349,23 @@ class Game():
         return new_id 
 
     # get game information by game_id
+    # data["user_id"]: the user the game is seen by, by default the user who is logged in
     @classmethod
     def get_by_game_id(cls, data):
-        query  = '''SELECT * from games 
-                    JOIN users ON user_id = users.id
-                    JOIN (SELECT * FROM users) d ON opponent_id = d.id 
-                    WHERE games.id = %(game_id)s
+        query  = cls.select_games + '''WHERE games.id = %(game_id)s
                 '''
         
         result = connectToMySQL(cls.db).query_db(query, data)
         row = result[0]
 
-        return cls.construct_from_query_result(row)
+        return cls.construct_from_query_result(row, data.get("user_id"))
 
     # get game information by user_id 
     # for active games
     @classmethod
     def get_active_games_by_user_id(cls, data):
 
-        query  = '''SELECT * from games 
-                    JOIN users ON user_id = users.id
-                    JOIN (SELECT * FROM users) d ON opponent_id = d.id 
-                    WHERE (user_id = %(user_id)s OR opponent_id = %(user_id)s)
+        query  = cls.select_games + '''WHERE (games.user_id = %(user_id)s OR games.opponent_id = %(user_id)s)
                     AND (status = 1 OR status = 2 OR status = 3)
                     ORDER BY games.updated_at;
                 '''
@@ -283,10 +384,7 @@ class Game():
     @classmethod
     def get_completed_games_by_user_id(cls, data):
 
-        query  = '''SELECT * from games 
-                    JOIN users ON user_id = users.id
-                    JOIN (SELECT * FROM users) d ON opponent_id = d.id 
-                    WHERE (user_id = %(user_id)s OR opponent_id = %(user_id)s)
+        query  = cls.select_games + '''WHERE (games.user_id = %(user_id)s OR games.opponent_id = %(user_id)s)
                     AND (status = 4 OR status = 5 OR status = 6)
                     ORDER BY games.updated_at;
                 '''
@@ -305,10 +403,7 @@ class Game():
     @classmethod
     def get_by_user_id(cls, data):
 
-        query  = '''SELECT * from games 
-                    JOIN users ON user_id = users.id
-                    JOIN (SELECT * FROM users) d ON opponent_id = d.id 
-                    WHERE (user_id = %(user_id)s OR opponent_id = %(user_id)s)
+        query  = cls.select_games + '''WHERE (games.user_id = %(user_id)s OR games.opponent_id = %(user_id)s)
                     AND status = %(status)s
                     ORDER BY games.updated_at;
                 '''
@@ -322,46 +417,247 @@ class Game():
 
         return my_games
 
+    # all games of a user for the dashboard (/games), with one query
+    # returns a dictionary of lists of Game objects:
+    #    my_turn:     active games (status 1, 2, 3) where it is the user's turn
+    #    waiting:     active games where it is the opponent's turn
+    #    completed:   status 4, 5, 6
+    #    invitations: pending games (status 0) to which the user was invited
+    #    invited:     pending games the user invited an opponent to
+    # whose turn it is follows from games.ply, no queries per game are needed
+    @classmethod
+    def get_dashboard_by_user_id(cls, data):
+
+        query  = cls.select_games + '''WHERE (games.user_id = %(user_id)s OR games.opponent_id = %(user_id)s)
+                    ORDER BY games.updated_at;
+                '''
+        result = connectToMySQL(cls.db).query_db(query, data)
+
+        dashboard = {"my_turn": [], "waiting": [], "completed": [], "invitations": [], "invited": []}
+        for row in result:
+
+            this_game = cls.construct_from_query_result(row)
+            status = int(this_game.status)
+            if status == 0:
+                if this_game.opponent_id == data["user_id"]:
+                    dashboard["invitations"].append(this_game)
+                else:
+                    dashboard["invited"].append(this_game)
+            elif status > 3:
+                dashboard["completed"].append(this_game)
+            elif this_game.is_current_player_turn:
+                dashboard["my_turn"].append(this_game)
+            else:
+                dashboard["waiting"].append(this_game)
+
+        return dashboard
+
+    # the moves of a game after the first data["since"] moves (plies)
+    # in the order they were made, as Move objects
+    # at most data["count"] moves, all moves if there is no count
+    @classmethod
+    def get_moves_since(cls, data):
+        data.setdefault("count", cls.all_moves)
+
+        result = connectToMySQL(cls.db).query_db(cls.select_moves_since, data)
+
+        return [Move(row) for row in result]
+
+    # export games as PGN or FEN text, for the analytics team
+    #    data["game_id"]: one game
+    #    data["user_id"]: all games of a user
+    #    neither:         all games (the full archive)
+    # export_format: "pgn" (the whole game) or "fen" (one line per game, the current position)
+    # yields the text line by line, while the rows are read from the database:
+    # the games and their moves come with one query on an unbuffered cursor
+    # (see MySQLConnection.query_db_iter), only one game is in memory at a time
+    @classmethod
+    def export(cls, data, export_format="pgn"):
+
+        query  = "SELECT games.id, games.white, games.status, games.created_at, "
+        query += "inviter.first_name AS inviter_first_name, inviter.last_name AS inviter_last_name, "
+        query += "invitee.first_name AS invitee_first_name, invitee.last_name AS invitee_last_name, "
+        query += "moves.piece, moves.from_row, moves.from_column, moves.to_row, moves.to_column, "
+        query += "moves.promote_to, moves.captured "
+        query += "FROM games "
+        query += "JOIN users inviter ON games.user_id = inviter.id "
+        query += "JOIN users invitee ON games.opponent_id = invitee.id "
+        query += "LEFT JOIN moves ON moves.game_id = games.id "
+        # pending invitations have no moves yet
+        query += "WHERE games.status > 0 "
+        if "game_id" in data:
+            query += "AND games.id = %(game_id)s "
+        if "user_id" in data:
+            query += "AND (games.user_id = %(user_id)s OR games.opponent_id = %(user_id)s) "
+        query += "ORDER BY games.id, moves.id;"
+
+        rows = connectToMySQL(cls.db).query_db_iter(query, data)
+
+        # the rows of one game follow each other
+        for game_id, game_rows in groupby(rows, key=lambda row: row["id"]):
+            first_row = next(game_rows)
+
+            # replay the moves, in SAN for PGN
+            # halfmove_clock: plies since the last capture or pawn move (for FEN)
+            game_state = GameState.opening()
+            sans = []
+            ply = 0
+            halfmove_clock = 0
+            for row in chain([first_row], game_rows):
+                # a game without moves: one row with NULL moves columns (LEFT JOIN)
+                if row["piece"] is None:
+                    break
+                move = (row["from_row"], row["from_column"], row["to_row"], row["to_column"])
+                if row["promote_to"]:
+                    move += (row["promote_to"],)
+                if export_format == "pgn":
+                    sans.append(notation.to_san(game_state, move))
+                game_state.push(move)
+                # the moves are not taken back
+                game_state.history.clear()
+                ply += 1
+                halfmove_clock = 0 if row["captured"] or row["piece"] in "6C" else halfmove_clock + 1
+
+            if export_format == "fen":
+                yield game_state.to_fen(halfmove_clock, ply // 2 + 1) + "\n"
+                continue
+
+            # the inviter plays white if games.white is set
+            inviter = f"{first_row['inviter_first_name']} {first_row['inviter_last_name']}"
+            invitee = f"{first_row['invitee_first_name']} {first_row['invitee_last_name']}"
+            white, black = (inviter, invitee) if first_row["white"] else (invitee, inviter)
+
+            # the player who made the last move wins by check mate
+            # the side that resigned is not recorded: the result of a resigned game is unknown
+            status = int(first_row["status"])
+            if status == 6:
+                result = "1-0" if ply % 2 == 1 else "0-1"
+            elif status == 4:
+                result = "1/2-1/2"
+            else:
+                result = "*"
+
+            headers = [
+                ("Event", f"Game {game_id}"),
+                ("Site", "?"),
+                ("Date", first_row["created_at"].strftime("%Y.%m.%d") if first_row["created_at"] else "????.??.??"),
+                ("Round", "-"),
+                ("White", white),
+                ("Black", black),
+                ("Result", result)
+            ]
+            for line in notation.pgn_lines(headers, sans, result):
+                yield line + "\n"
+
+    # import the games of a PGN file, e.g. the archive of a club
+    # lines: the lines of the file
+    # the players are found by name in users, "First Last" or "Last, First";
+    # the player with white becomes games.user_id
+    # the games are parsed and checked by worker processes (see pgn_import.py),
+    # chunk_size games at a time, and stored with one transaction per chunk
+    # returns the number of games imported and a list of (headers, reason) of the games skipped
+    @classmethod
+    def import_pgn(cls, lines, chunk_size=500, workers=None):
+        players = {}
+        for player in user.User.get_all() or []:
+            players[f"{player.first_name} {player.last_name}"] = player.id
+            players[f"{player.last_name}, {player.first_name}"] = player.id
+
+        workers = workers or os.cpu_count()
+        games = notation.pgn_games(lines)
+        imported = 0
+        skipped = []
+
+        # at most 2 chunks per worker are waiting, so that the file is not read at once
+        pending = deque()
+        with ProcessPoolExecutor(workers) as executor:
+            while True:
+                chunk = list(islice(games, chunk_size))
+                if chunk:
+                    pending.append(executor.submit(pgn_import.parse_games, chunk, cls.snapshot_interval))
+                if pending and (not chunk or len(pending) >= 2 * workers):
+                    count, chunk_skipped = cls.store_imported_games(pending.popleft().result(), players)
+                    imported += count
+                    skipped += chunk_skipped
+                if not chunk and not pending:
+                    break
+
+        return imported, skipped
+
+    # store the games parsed by pgn_import.parse_games
+    # returns the number of games stored and the games skipped
+    @classmethod
+    def store_imported_games(cls, parsed_games, players):
+        query  = "INSERT INTO games "
+        query += "(user_id, opponent_id, white, status, tiles, ply, castling, last_piece, last_from_to) "
+        query += "VALUES (%(user_id)s, %(opponent_id)s, 1, %(status)s, %(tiles)s, %(ply)s, "
+        query += "%(castling)s, %(last_piece)s, %(last_from_to)s);"
+
+        games = []
+        moves = []
+        snapshots = []
+        skipped = []
+        # the counts of the games for position_index, see PositionIndex.count_game
+        counts = {}
+        for parsed in parsed_games:
+            headers = parsed["headers"]
+            if parsed["error"]:
+                skipped.append((headers, parsed["error"]))
+                continue
+            white = players.get(headers.get("White"))
+            black = players.get(headers.get("Black"))
+            if white is None or black is None:
+                skipped.append((headers, "unknown player"))
+                continue
+
+            # the index of the game in games, replaced by its id (see query_db_bulk_insert)
+            index = len(games)
+            games.append(dict(parsed["game"], user_id=white, opponent_id=black))
+            for piece, from_row, from_col, to_row, to_col, promote_to, captured in parsed["moves"]:
+                moves.append({"game_id": index, "piece": piece,
+                              "from_row": from_row, "from_column": from_col,
+                              "to_row": to_row, "to_column": to_col,
+                              "promote_to": promote_to, "captured": captured})
+            for snapshot in parsed["snapshots"]:
+                snapshots.append(dict(snapshot, game_id=index))
+            PositionIndex.count_game(counts, parsed["positions"],
+                                     PositionIndex.outcome(parsed["game"]["status"], parsed["game"]["ply"]))
+
+        # the games are counted in position_index in the same transaction
+        if games:
+            connectToMySQL(cls.db).query_db_bulk_insert(query, games, [
+                (cls.insert_move, moves, "game_id"),
+                (cls.insert_snapshot, snapshots, "game_id"),
+                (PositionIndex.upsert_row, PositionIndex.count_rows(counts), None)
+            ])
+
+        return len(games), skipped
+
     # construct_from_query_result constructs a Game object 
-    # based of the result of SELECT FROM games JOIN to user (2x)
+    # based of the result of select_games (games JOIN users 2x)
     # called by 
     #    get_by_game_id
     #    get_by_user_id
+    #    get_active_games_by_user_id, get_completed_games_by_user_id
+    #    get_dashboard_by_user_id
     #
+    # user_id: the user who is logged in, by default session["user_id"]
     @classmethod
-    def construct_from_query_result(cls, row):
+    def construct_from_query_result(cls, row, user_id=None):
         
         this_game = cls(row)
-        
-        user_data = {
-            "id": row["users.id"],
-            "first_name": row["first_name"],
-            "last_name": row["last_name"],
-            "email": row["email"],
-            "hashed_pwd": row["hashed_pwd"],
-            "created_at": row["users.created_at"],
-            "updated_at": row["users.updated_at"]
-        }
-        
-        opponent_data = {
-            "id": row["d.id"],
-            "first_name": row["d.first_name"],
-            "last_name": row["d.last_name"],
-            "email": row["d.email"],
-            "hashed_pwd": row["d.hashed_pwd"],
-            "created_at": row["d.created_at"],
-            "updated_at": row["d.updated_at"]
-        }
+        if user_id is None:
+            user_id = session["user_id"]
 
         # in the games table, user_id refers to the user who sent the invitation
         # this may or may not be equal to the session["user_id"]
-        if user_data["id"] == session["user_id"]:
-            this_game.current_player = user.User(user_data)
-            this_game.current_opponent = user.User(opponent_data)
+        if row["inviter_id"] == user_id:
+            this_game.current_player = user.User.from_row(row, "inviter_")
+            this_game.current_opponent = user.User.from_row(row, "invitee_")
             this_game.current_is_white = this_game.is_white
         else:
-            this_game.current_player = user.User(opponent_data)
-            this_game.current_opponent = user.User(user_data)
+            this_game.current_player = user.User.from_row(row, "invitee_")
+            this_game.current_opponent = user.User.from_row(row, "inviter_")
             this_game.current_is_white = not this_game.is_white
 
         return this_game
@@ -382,88 +678,74 @@ class Game():
 #******************************************************************************
 #
 # object method: make_move
-# 1. record captured piece - extra logic for en passant
-# 2. update board with the move - extra logic for castling
-# 3. determine if opposing king is check or check mate
+# 1. make the move on the game state, see GameState.push
+#    - extra logic for en passant, castling and promotion
+# 2. record captured piece
+# 3. determine if opposing king is check, check mate or stale mate
 # 4. SQL
-#    - update games 
+#    - update games, if no other move was made since the game was read
 #    - insert into moves 
+#    - count the move in position_index
+# 5. publish the move to the clients watching the game (game_events)
+#
+# steps 1 - 3 are done by prepare_move, step 5 by move_made,
+# so that the async API (flask_app/asgi.py) can run the SQL with its own driver
+# the game is only changed by move_made: if the SQL fails, it is the game as it was read
 #
 #******************************************************************************
     def make_move(self, *from_to):
+        queries, event = self.prepare_move(*from_to)
+
+        connectToMySQL(Game.db).query_db_transaction(queries, Game.move_checked)
+
+        self.move_made(queries, event)
+
+        return
+
+    # the queries of prepare_move that must change a row: the UPDATE of games,
+    # which only changes the game if no other move was made since it was read
+    # (two submits of the same turn: the second one raises ConcurrentUpdate)
+    move_checked = (0,)
+
+    # returns the (query, data) tuples that store the move in the database
+    # and the event for the clients watching the game
+    def prepare_move(self, *from_to):
         (from_row, from_col, to_row, to_col) = from_to
 
-        # make a copy of the board
-        board = [[tile for tile in row] for row in self.tiles_array]
-        moving_piece = board[from_row][from_col]
-
-        # save the piece that is captured
-        # for en passant capture:
-        # - the move has already been verified as a valid en passant
-        # - remove the captured pawn
-
-        if board[to_row][to_col] == '0':
-            if moving_piece == '6' and from_row == 4 and to_col != from_col and board[to_row][to_col] == '0':
-                captured = 'C'
-                board[from_row][to_col] = '0'
-            elif moving_piece == 'C' and from_row == 3 and to_col != from_col and board[to_row][to_col] == '0':
-                captured = '6'
-                board[from_row][to_col] = '0'
-            else: 
-                captured = None
+        # the game state before the move
+        new_game_state = self.game_state
+        moving_piece = new_game_state.board[from_row][from_col]
+        position_hash = new_game_state.hash
+
+        # a pawn that reaches the last row is promoted to a queen
+        promote_to = None
+        if moving_piece == '6' and to_row == 7:
+            promote_to = '2'
+        elif moving_piece == 'C' and to_row == 0:
+            promote_to = '8'
+
+        # make the move on the game state
+        # push takes care of en passant capture and of the rook when castling
+        # and returns the piece that is captured
+        if promote_to:
+            captured = new_game_state.push(from_to + (promote_to,))
         else:
-            captured = board[to_row][to_col]
-
-        # make the move on the board as a 2d array 
-        board[to_row][to_col] = moving_piece
-        board[from_row][from_col] = '0'
-
-        # castling: 
-        # the king's move has been taken care off
-        # now also move the rook
-        if from_to == (0,3,0,1):
-            board[0][0] = '0'
-            board[0][2] = '5'
-        elif from_to == (0,3,0,5):
-            board[0][7] = '0'
-            board[0][4] = '5'
-        elif from_to == (7,3,7,1):
-            board[7][0] = '0'
-            board[7][2] = 'B'
-        elif from_to == (7,3,7,5):
-            board[7][7] = '0'
-            board[7][4] = 'B'
-
-
-        print("*******************")
+            captured = new_game_state.push(from_to)
+
         # after the move has been made
         # test if the opponent's king is check mate or check
         # new_game_state = game state after completion of the current move
-        color, type, ucode = Game.pieces[moving_piece]
-        opponent = "b" if color == "w" else "w" 
-
-        new_game_state = GameState(
-                    board,
-                    opponent, 
-                    moving_piece,
-                    from_to,
-                    self.game_state.white_king_moved or (from_row, from_col) == (0,3),   
-                    self.game_state.white_rook_0_moved or (from_row, from_col) == (0,0),   
-                    self.game_state.white_rook_7_moved or (from_row, from_col) == (0,7),   
-                    self.game_state.black_king_moved or (from_row, from_col) == (7,3),   
-                    self.game_state.black_rook_0_moved or (from_row, from_col) == (7,0), 
-                    self.game_state.black_rook_7_moved or (from_row, from_col) == (7,7)
-                    )
+        opponent = new_game_state.next_move_color
+        board = new_game_state.board
 
         if chess_rules.is_check_mate(new_game_state, opponent): 
-            self.status = '6' # check mate
-            print("mate")
-        elif chess_rules.is_check(board, opponent):
-            print("check")
-            self.status = '2' # check
+            status = '6' # check mate
+        elif chess_rules.is_check(new_game_state, opponent):
+            status = '2' # check
+        elif chess_rules.is_stale_mate(new_game_state, opponent):
+            status = '4' # draw by stale mate
         else:
-            print("not check")
-            self.status = '1' # active game
+            status = '1' # active game
         
         # convert the board back to a string to be saved as "tiles"
         tiles_new = ""
@@ -471,24 +753,27 @@ class Game():
             for tile in row:
                 tiles_new += tile
 
-        # make the changes in the database
+        # the changes in the database
+        # in one transaction, so that the game and its moves always agree
         # update games
         # insert into moves
 
-        game_query  = "UPDATE games SET tiles = %(tiles)s, status = %(status)s "
-        game_query += "WHERE id = %(id)s;"
+        game_query  = "UPDATE games SET tiles = %(tiles)s, status = %(status)s, "
+        game_query += "ply = %(ply)s, castling = %(castling)s, "
+        game_query += "last_piece = %(last_piece)s, last_from_to = %(last_from_to)s "
+        game_query += "WHERE id = %(id)s AND ply = %(old_ply)s;"
 
         game_data = {
             "id": self.id,
+            "old_ply": self.ply,
             "tiles": tiles_new,
-            "status": self.status
+            "status": status,
+            "ply": self.ply + 1,
+            "castling": new_game_state.castling_rights,
+            "last_piece": moving_piece,
+            "last_from_to": f"{from_row}{from_col}{to_row}{to_col}"
         }
 
-        move_query  = "INSERT INTO moves "
-        move_query += "(game_id, piece, from_row, from_column, to_row, to_column, captured) "
-        move_query += "VALUES "
-        move_query += "(%(game_id)s, %(piece)s, %(from_row)s, %(from_column)s, %(to_row)s, %(to_column)s, %(captured)s )"
-
         move_data = {
             "game_id": self.id,
             "piece": moving_piece,
@@ -496,35 +781,53 @@ class Game():
             "from_column": from_col,
             "to_row": to_row,
             "to_column": to_col,
+            "promote_to": promote_to,
             "captured": captured
         }
 
-        connectToMySQL(Game.db).query_db(game_query, game_data)
-        connectToMySQL(Game.db).query_db(move_query, move_data)
-
-        return
-
-        
-    # helper function needed to determine game_state
-    def piece_has_moved(self, row, col):
-
-        query  = "SELECT id FROM moves "
-        query += "WHERE game_id = %(game_id)s and from_column = %(col)s and from_row = %(row)s;"
-        data = {
+        # for the clients watching this game
+        # changes: the tiles that changed, as [row, column, piece]
+        changes = [[square // 8, square % 8, tiles_new[square]]
+                   for square in range(64) if tiles_new[square] != self.tiles[square]]
+        event = {
             "game_id": self.id,
-            "row": row,
-            "col": col
+            "ply": game_data["ply"],
+            "piece": moving_piece,
+            "move": [from_row, from_col, to_row, to_col],
+            "promote_to": promote_to,
+            "captured": captured,
+            "status": int(status),
+            "changes": changes
         }
-        result = connectToMySQL(Game.db).query_db(query, data)
 
-        if len(result) < 1:
-            return False
-        else:
-            return True
+        queries = [(game_query, game_data), (Game.insert_move, move_data)]
 
+        # the opening explorer: the move is counted in the position index
+        queries.append(PositionIndex.queries(self, position_hash, move_encoding.encode_move_row(move_data),
+                                             int(status), game_data["ply"]))
 
+        # every snapshot_interval plies: a snapshot for position_at
+        if game_data["ply"] % Game.snapshot_interval == 0:
+            queries.append((Game.insert_snapshot, Game.snapshot_data(self.id, game_data["ply"], new_game_state)))
 
+        # take the move back: until move_made, this object stays the game as it is in the database
+        # (the transaction can still fail, e.g. with ConcurrentUpdate)
+        new_game_state.pop()
 
-    
+        return queries, event
+
+    # after the queries of prepare_move have been committed
+    def move_made(self, queries, event):
+        game_data = queries[0][1]
+
+        # tell the clients watching this game
+        game_events.publish(self.id, event)
 
-    
\ No newline at end of file
+        # keep this object in line with the database
+        self.status = game_data["status"]
+        self.tiles = game_data["tiles"]
+        self.ply = game_data["ply"]
+        self.castling = game_data["castling"]
+        self.last_piece = game_data["last_piece"]
+        self.last_from_to = game_data["last_from_to"]
+        self.invalidate()
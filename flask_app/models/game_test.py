@@ -0,0 +1,67 @@
+#******************************************************************************
+#
+# Tests for making a move in game.py, without a database:
+# the transaction of the move is replaced by a function of the test
+#
+# run the tests:
+#     python -m pytest flask_app/models/game_test.py
+#
+#******************************************************************************
+
+import pytest
+
+from flask_app.config.mysqlconnection import ConcurrentUpdate
+from flask_app.models import game
+
+
+class FakeConnection():
+
+    def __init__(self, error=None):
+        self.error = error
+        self.transactions = []
+
+    def query_db_transaction(self, queries, checked=()):
+        if self.error is not None:
+            raise self.error
+        self.transactions.append((queries, checked))
+
+
+def new_game():
+    return game.Game({
+        "id": 1, "user_id": 1, "opponent_id": 2, "white": 1, "status": 1,
+        "tiles": game.Game.opening_position, "ply": 0, "castling": 15,
+        "last_piece": None, "last_from_to": None, "created_at": None, "updated_at": None
+    })
+
+def use_connection(monkeypatch, connection):
+    monkeypatch.setattr(game, "connectToMySQL", lambda db: connection)
+
+
+def test_make_move(monkeypatch):
+    connection = FakeConnection()
+    use_connection(monkeypatch, connection)
+    this_game = new_game()
+    fen = this_game.game_state.to_fen()
+
+    this_game.make_move(1, 3, 3, 3)
+
+    queries, checked = connection.transactions[0]
+    assert checked == game.Game.move_checked
+    assert queries[0][1]["old_ply"] == 0 and queries[0][1]["ply"] == 1
+    assert this_game.ply == 1
+    assert this_game.game_state.to_fen() != fen
+    assert this_game.game_state.board[3][3] == '6'
+
+# a move that is not stored leaves the game as it was read, also its game state
+@pytest.mark.parametrize("error", [ConcurrentUpdate("no row changed"), RuntimeError("lost connection")])
+def test_move_not_stored(monkeypatch, error):
+    use_connection(monkeypatch, FakeConnection(error))
+    this_game = new_game()
+    fen = this_game.game_state.to_fen()
+
+    with pytest.raises(type(error)):
+        this_game.make_move(1, 3, 3, 3)
+
+    assert (this_game.ply, this_game.tiles) == (0, game.Game.opening_position)
+    assert this_game.game_state.to_fen() == fen
+    assert this_game.game_state.history == []
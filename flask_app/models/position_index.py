@@ -0,0 +1,162 @@
+# pymysql connection 
+from flask_app.config.mysqlconnection import connectToMySQL
+from flask_app.helpers import chess_rules, move_encoding, notation
+from flask_app.helpers.game_state import GameState
+
+from itertools import chain, groupby
+
+#
+# PositionIndex: the moves played from the positions of all games, with their results
+# (see migrations/03_position_index.sql), for the opening explorer
+# a position is identified by its Zobrist hash (GameState.hash),
+# so a position is found with one primary key lookup, whatever the moves that led to it
+#
+# the index is kept up to date by Game.make_move (see queries) and Game.import_pgn,
+# and built for all existing games by build
+#
+class PositionIndex():
+    db = "chess_schema"
+
+    # add the counts of rows of (position_hash, move, games, white_wins, black_wins, draws)
+    insert_rows  = "INSERT INTO position_index (position_hash, move, games, white_wins, black_wins, draws) VALUES "
+    row_values   = "(%s, %s, %s, %s, %s, %s)"
+    add_counts   = " ON DUPLICATE KEY UPDATE games = games + VALUES(games), "
+    add_counts  += "white_wins = white_wins + VALUES(white_wins), black_wins = black_wins + VALUES(black_wins), "
+    add_counts  += "draws = draws + VALUES(draws)"
+    # one row, for executemany (sent as multi-row INSERT statements)
+    upsert_row   = insert_rows + row_values + add_counts + ";"
+
+    # the result of a game as (white_wins, black_wins, draws), all 0 if there is no result
+    # check mate (status 6): the player who made the last move wins
+    # draw (status 4)
+    @staticmethod
+    def outcome(status, ply):
+        if status == 6:
+            return (1, 0, 0) if ply % 2 == 1 else (0, 1, 0)
+        if status == 4:
+            return (0, 0, 1)
+        return (0, 0, 0)
+
+    # the (position_hash, move) of every move of history (16-bit codes, see move_encoding.py)
+    @staticmethod
+    def positions(history):
+        game_state = GameState.opening()
+        positions = []
+        for code in history:
+            positions.append((game_state.hash, code))
+            game_state.push(move_encoding.decode_move(code))
+        return positions
+
+    # the rows of a game, one per (position_hash, move) of positions
+    # games: the times the move was played, from the move counted_from on (the others only get the outcome)
+    # the outcome is counted once per game, also when a position is reached again with the same move
+    @staticmethod
+    def game_rows(positions, outcome, counted_from=0):
+        played = {}
+        for ply, key in enumerate(positions):
+            played[key] = played.get(key, 0) + (1 if ply >= counted_from else 0)
+        return [key + (count,) + outcome for key, count in played.items()]
+
+    # add the rows of a game to counts: (position_hash, move) -> [games, white_wins, black_wins, draws]
+    @classmethod
+    def count_game(cls, counts, positions, outcome):
+        for position_hash, code, *game_counts in cls.game_rows(positions, outcome):
+            total = counts.setdefault((position_hash, code), [0, 0, 0, 0])
+            for index, count in enumerate(game_counts):
+                total[index] += count
+
+    # the rows of counts, for upsert_row
+    @staticmethod
+    def count_rows(counts):
+        return [key + tuple(total) for key, total in counts.items()]
+
+    # one (query, data) that adds rows to the index, for query_db_transaction
+    @classmethod
+    def upsert(cls, rows):
+        query = cls.insert_rows + ", ".join([cls.row_values] * len(rows)) + cls.add_counts + ";"
+        return query, [value for row in rows for value in row]
+
+    # the (query, data) of a move made in a game (see Game.prepare_move)
+    # game: the game before the move
+    # position_hash: the hash of the position before the move, code: the move
+    # status, ply: of the game after the move
+    # the move is counted; when the game ends, its result is added for all its moves
+    # (this reads the moves of the game once, at the end of the game)
+    @classmethod
+    def queries(cls, game, position_hash, code, status, ply):
+        outcome = cls.outcome(status, ply)
+        if not any(outcome):
+            return cls.upsert([(position_hash, code, 1, 0, 0, 0)])
+
+        history = game.load_history()
+        history.append(code)
+        return cls.upsert(cls.game_rows(cls.positions(history), outcome, len(history) - 1))
+
+    # the moves played in the position of game_state, most played first
+    # one lookup by primary key
+    # returns a list of dictionaries: move, promote_to, san, games, white_wins, black_wins, draws
+    @classmethod
+    def continuations(cls, game_state):
+        query = "SELECT move, games, white_wins, black_wins, draws FROM position_index "
+        query += "WHERE position_hash = %(position_hash)s "
+        query += "ORDER BY games DESC;"
+
+        result = connectToMySQL(cls.db).query_db(query, {"position_hash": game_state.hash})
+
+        # two positions could have the same hash: moves that are not legal here are left out
+        legal_moves = set(chess_rules.generate_legal_moves(game_state)) if result else set()
+
+        continuations = []
+        for row in result:
+            move = move_encoding.decode_move(row["move"])
+            if move not in legal_moves:
+                continue
+            continuations.append({
+                "move": list(move[:4]),
+                "promote_to": move[4] if len(move) == 5 else None,
+                "san": notation.to_san(game_state, move),
+                "games": row["games"],
+                "white_wins": row["white_wins"],
+                "black_wins": row["black_wins"],
+                "draws": row["draws"]
+            })
+
+        return continuations
+
+    # build the index from the moves of all games
+    # the games are read with one query on an unbuffered cursor,
+    # the counts of chunk_size games are added at a time
+    # moves made while the index is built may be counted twice
+    # returns the number of games indexed
+    @classmethod
+    def build(cls, chunk_size=1000):
+        connectToMySQL(cls.db).query_db("TRUNCATE TABLE position_index;")
+
+        query  = "SELECT games.id, games.status, games.ply, moves.piece, moves.from_row, moves.from_column, "
+        query += "moves.to_row, moves.to_column, moves.promote_to, moves.captured "
+        query += "FROM games JOIN moves ON moves.game_id = games.id "
+        query += "ORDER BY games.id, moves.id;"
+
+        rows = connectToMySQL(cls.db).query_db_iter(query)
+
+        # (position_hash, move) -> [games, white_wins, black_wins, draws]
+        counts = {}
+        games = 0
+        for game_id, game_rows in groupby(rows, key=lambda row: row["id"]):
+            first_row = next(game_rows)
+            history = move_encoding.encode_history(chain([first_row], game_rows))
+            outcome = cls.outcome(int(first_row["status"]), first_row["ply"])
+            cls.count_game(counts, cls.positions(history), outcome)
+
+            games += 1
+            if games % chunk_size == 0:
+                cls.add_counts_to_index(counts)
+                counts = {}
+
+        cls.add_counts_to_index(counts)
+        return games
+
+    @classmethod
+    def add_counts_to_index(cls, counts):
+        if counts:
+            connectToMySQL(cls.db).query_db_many(cls.upsert_row, cls.count_rows(counts))
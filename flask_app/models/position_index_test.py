@@ -0,0 +1,96 @@
+#******************************************************************************
+#
+# Tests for the counts of position_index in position_index.py, without a database
+#
+# run the tests:
+#     python -m pytest flask_app/models/position_index_test.py
+#
+#******************************************************************************
+
+from array import array
+
+import pytest
+
+from flask_app.helpers.pgn_import import parse_game
+from flask_app.models.position_index import PositionIndex
+
+# the moves 2. Qh5 and 2... Nc6 are played twice from the same positions
+REPEATED = "1. e4 e5 2. Qh5 Nc6 3. Qd1 Nb8 4. Qh5 Nc6 5. Bc4 Nf6 6. Qxf7#"
+UNFINISHED = "1. Nf3 Nf6 2. Ng1 Ng8 3. Nf3 Nf6"
+
+
+# the moves of a game as 16-bit codes, the hashes of its positions and its games.status
+def parsed_game(movetext):
+    parsed = parse_game({}, movetext, 16)
+    history = array('H', [code for position_hash, code in parsed["positions"]])
+    return history, parsed["positions"], parsed["game"]["status"]
+
+
+def test_outcome():
+    assert PositionIndex.outcome(6, 11) == (1, 0, 0)
+    assert PositionIndex.outcome(6, 12) == (0, 1, 0)
+    assert PositionIndex.outcome(4, 30) == (0, 0, 1)
+    # resigned and unfinished games have no result
+    assert PositionIndex.outcome(5, 30) == (0, 0, 0)
+    assert PositionIndex.outcome(2, 3) == (0, 0, 0)
+
+def test_positions():
+    history, positions, status = parsed_game(REPEATED)
+    assert PositionIndex.positions(history) == positions
+
+# a repeated position and move adds to games, the result is counted once
+def test_repeated_position():
+    history, positions, status = parsed_game(REPEATED)
+    rows = PositionIndex.game_rows(positions, PositionIndex.outcome(status, len(history)))
+
+    assert status == 6
+    assert len(rows) == len(positions) - 2
+    for repeated in [positions[2], positions[3]]:
+        assert [row[2:] for row in rows if row[:2] == repeated] == [(2, 1, 0, 0)]
+    assert all(row[3:] == (1, 0, 0) for row in rows)
+    assert sum(row[2] for row in rows) == len(history)
+
+def test_unfinished_game():
+    history, positions, status = parsed_game(UNFINISHED)
+    rows = PositionIndex.game_rows(positions, PositionIndex.outcome(status, len(history)))
+
+    assert status == 1
+    assert [row[2:] for row in rows] == [(2, 0, 0, 0), (2, 0, 0, 0), (1, 0, 0, 0), (1, 0, 0, 0)]
+
+# only the moves from counted_from on are counted as played
+def test_counted_from():
+    history, positions, status = parsed_game(UNFINISHED)
+    rows = PositionIndex.game_rows(positions, (0, 0, 1), len(history) - 1)
+    assert [row[2:] for row in rows] == [(0, 0, 0, 1), (1, 0, 0, 1), (0, 0, 0, 1), (0, 0, 0, 1)]
+
+
+class FakeGame():
+
+    def __init__(self, history):
+        self.history = history
+
+    def load_history(self):
+        return array('H', self.history)
+
+
+# the counts added by Game.make_move move by move (PositionIndex.queries)
+# are the counts of build (PositionIndex.count_game)
+@pytest.mark.parametrize("movetext", [REPEATED, UNFINISHED])
+def test_incremental_equals_build(movetext):
+    history, positions, status = parsed_game(movetext)
+
+    incremental = {}
+    for ply, (position_hash, code) in enumerate(positions):
+        # the status is that of the game after the move: only the last move can end it
+        move_status = status if ply == len(positions) - 1 else 1
+        query, data = PositionIndex.queries(FakeGame(history[:ply]), position_hash, code, move_status, ply + 1)
+        for index in range(0, len(data), 6):
+            key, counts = tuple(data[index:index + 2]), data[index + 2:index + 6]
+            total = incremental.setdefault(key, [0, 0, 0, 0])
+            for column, count in enumerate(counts):
+                total[column] += count
+
+    built = {}
+    PositionIndex.count_game(built, positions, PositionIndex.outcome(status, len(history)))
+
+    assert incremental == built
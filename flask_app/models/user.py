@@ -3,23 +3,66 @@ from flask_app.config.mysqlconnection import connectToMySQL
 from flask_app import app
 from flask import flash
 from flask_bcrypt import Bcrypt
+from concurrent.futures import ThreadPoolExecutor
 import re
 
 bcrypt = Bcrypt(app)
+
+# bcrypt is slow on purpose, and releases the GIL while it works
+# passwords are hashed and checked by a few dedicated threads,
+# so that many logins at the same time do not take all CPUs from other requests
+password_pool = ThreadPoolExecutor(max_workers=app.config["PASSWORD_WORKERS"], thread_name_prefix="password")
+
+def hash_password(password):
+    return password_pool.submit(bcrypt.generate_password_hash, password).result()
+
+def check_password(hashed_pwd, password):
+    return password_pool.submit(bcrypt.check_password_hash, hashed_pwd, password).result()
+
+# the cost a password hash was made with: "$2b$12$..." -> 12
+def hash_log_rounds(hashed_pwd):
+    if isinstance(hashed_pwd, bytes):
+        hashed_pwd = hashed_pwd.decode()
+    return int(hashed_pwd.split("$")[2])
+
 email_regex = re.compile(r'^[a-zA-Z0-9.+_-]+@[a-zA-Z0-9._-]+\.[a-zA-Z]+$')
 
 class User():
     # class variable: schema name for this app
     db = "chess_schema"
 
+    # fixed attributes, no __dict__ per object
+    __slots__ = ("id", "first_name", "last_name", "email", "hashed_pwd", "created_at", "updated_at")
+
+    # the columns selected when users are shown (no password hash)
+    public_columns = ("id", "first_name", "last_name")
+
+    # columns that were not selected are None
+    # only the login query selects hashed_pwd
     def __init__(self, data):
         self.id = data['id']
         self.first_name = data['first_name']
         self.last_name = data['last_name']
-        self.email = data['email']
-        self.hashed_pwd = data['hashed_pwd']
-        self.created_at = data['created_at']
-        self.updated_at = data['updated_at']
+        self.email = data.get('email')
+        self.hashed_pwd = data.get('hashed_pwd')
+        self.created_at = data.get('created_at')
+        self.updated_at = data.get('updated_at')
+
+    # construct a User from the columns prefix + public_columns of a row
+    # e.g. opponent_id, opponent_first_name, opponent_last_name
+    # without building a dictionary for the user first
+    @classmethod
+    def from_row(cls, row, prefix):
+        this_user = cls.__new__(cls)
+        this_user.id = row[prefix + "id"]
+        this_user.first_name = row[prefix + "first_name"]
+        this_user.last_name = row[prefix + "last_name"]
+        this_user.email = None
+        this_user.hashed_pwd = None
+        this_user.created_at = None
+        this_user.updated_at = None
+
+        return this_user
 
     @property
     def full_name(self):
@@ -30,7 +73,7 @@ class User():
     def create(cls, data):
         # hash the password using Bcrypt
         # add hashed_pwd to data dictionary before insert into db
-        data['hashed_pwd'] = bcrypt.generate_password_hash(data['password'])
+        data['hashed_pwd'] = hash_password(data['password'])
 
         query = "INSERT INTO users (first_name, last_name, email, hashed_pwd) VALUES (%(first_name)s, %(last_name)s, %(email)s, %(hashed_pwd)s);"
         new_id = connectToMySQL(cls.db).query_db(query, data)
@@ -47,7 +90,7 @@ class User():
     # get all users in the database
     @classmethod
     def get_all(cls):
-        query = "SELECT * FROM users"
+        query = "SELECT id, first_name, last_name FROM users"
 
         result = connectToMySQL(cls.db).query_db(query)
         if len(result) < 1:
@@ -63,7 +106,7 @@ class User():
     # look up user by id
     @classmethod
     def get_by_id(cls, data):
-        query = "SELECT * FROM users WHERE id = %(id)s;"
+        query = "SELECT id, first_name, last_name, email, created_at, updated_at FROM users WHERE id = %(id)s;"
 
         result = connectToMySQL(cls.db).query_db(query, data)
         if len(result) < 1:
@@ -74,9 +117,10 @@ class User():
         return cls( row )
 
     # look up a user by email
+    # the only query that selects the password hash, needed for login
     @classmethod 
     def get_by_email(cls, data):
-        query = "SELECT * FROM users WHERE email = %(email)s;"
+        query = "SELECT id, first_name, last_name, email, hashed_pwd, created_at, updated_at FROM users WHERE email = %(email)s;"
         rows = connectToMySQL(cls.db).query_db(query, data)
         if len(rows) < 1:
             return False
@@ -172,6 +216,7 @@ class User():
 
 
     # arguments: email, password (string)
+    # returns the user if the password is correct, False otherwise
     @staticmethod
     def check_email_and_password(data):
         # verify that email is registered in database
@@ -180,10 +225,24 @@ class User():
             return False
         
         # if so, use Bcrypt to check password against hashed pwd in database
-        if not bcrypt.check_password_hash(user.hashed_pwd, data['password']):
+        if not check_password(user.hashed_pwd, data['password']):
             return False
 
-        return True    
+        # the cost has changed since the password was hashed: hash it again
+        if hash_log_rounds(user.hashed_pwd) != app.config["BCRYPT_LOG_ROUNDS"]:
+            User.update_password({"id": user.id, "password": data['password']})
+
+        return user
+
+    # store a new hash of data["password"]
+    @classmethod
+    def update_password(cls, data):
+        data['hashed_pwd'] = hash_password(data['password'])
+
+        query = "UPDATE users SET hashed_pwd = %(hashed_pwd)s WHERE users.id = %(id)s;"
+        connectToMySQL(cls.db).query_db(query, data)
+
+        return
 
 
 # validation of user data provided upon registration or update    
@@ -3,6 +3,9 @@ var move_from = "";
 var move_to = "";
 var piece_captured = "";
 var current_player = "";
+// the legal moves in the current position: {from tile: [to tiles]}
+// null until loaded, see load_legal_moves
+var legal_moves = null;
 
 
 // player grabs piece they wish to move
@@ -19,14 +22,26 @@ function grab(e){
 
     console.log(moving_piece);
 
+    // if the legal moves are known, only the tiles the piece can move to accept a drop
+    var destinations = legal_moves ? (legal_moves[move_from] || []) : null;
+
     for (var i = 0 ; i < 8; i++){
         for (var j = 0; j < 8; j++){
             row_col = i.toString().concat(j.toString());
             e_tile = document.getElementById(row_col);
             tile_onclick = e_tile.getAttribute("onclick");
-            if (tile_onclick != "grab(this)"){
+            if (tile_onclick == "grab(this)"){
+                continue;
+            }
+            if (destinations === null){
                 e_tile.setAttribute("onclick", "drop(this)");
                 e_tile.classList.add("pointer")
+            } else if (destinations.includes(row_col)){
+                e_tile.setAttribute("onclick", "drop(this)");
+                e_tile.classList.add("pointer", "target")
+            } else {
+                e_tile.setAttribute("onclick", "");
+                e_tile.classList.remove("pointer", "target")
             }
         }
     }
@@ -48,7 +63,7 @@ function drop(e){
                 row_col = i.toString().concat(j.toString());
                 e_tile = document.getElementById(row_col);
                 e_tile.setAttribute("onclick", "");
-                e_tile.classList.remove("active", "pointer")
+                e_tile.classList.remove("active", "pointer", "target")
             }
         }
         document.getElementById(move_to).classList.add("active");
@@ -90,14 +105,177 @@ async function submit(){
     document.getElementById("submit_btn").style.display = "none";
     document.getElementById("undo_btn").style.display = "none";
 
-    // redirect: reload current page
-    location.href = `/games/${game_id}/play`;
+    // show the board after the move, or the board before the move if it was rejected
+    if (response.status == 201){
+        load_state(current_ply());
+    } else {
+        load_state(null);
+    }
 }
 
-// undo a move by reloading the page
+// undo a move by loading the board again
 function undo_move(){
-    var e_game_id = document.getElementById("game_id");
-    var game_id = e_game_id.innerHTML;
+    document.getElementById("submit_btn").style.display = "none";
+    document.getElementById("undo_btn").style.display = "none";
+
+    load_state(null);
+}
+
+
+// unicode characters of the pieces, same codes as games.tiles
+var piece_ucodes = {
+    "0": "", 
+    "1": "\u2654", "2": "\u2655", "3": "\u2657", "4": "\u2658", "5": "\u2656", "6": "\u2659",
+    "7": "\u265A", "8": "\u265B", "9": "\u265D", "A": "\u265E", "B": "\u265C", "C": "\u265F"
+};
+var white_pieces = "123456";
+var black_pieces = "789ABC";
+// column 0 is the h-file
+var column_names = "hgfedcba";
 
-    location.href = `/games/${game_id}/play`;
+var status_texts = {
+    2: ' - <span style="color:red">Check</span>',
+    3: ' - <b>Draw offered</b>',
+    4: ' - <b>Draw</b>',
+    5: ' - <b>Resigned</b>',
+    6: ' - <span style="color:red">Check mate</span>'
+};
+
+// the pieces on the board shown, as games.tiles
+var tiles = document.getElementById("tiles").innerHTML.trim();
+
+function current_ply(){
+    return parseInt(document.getElementById("ply").innerHTML);
+}
+
+// get the legal moves of the current position
+async function load_legal_moves(){
+    var game_id = document.getElementById("game_id").innerHTML;
+    legal_moves = null;
+
+    var response = await fetch(`/api/games/${game_id}/legal_moves`);
+    if (response.status == 200){
+        var result = await response.json();
+        if (result.ply == current_ply()){
+            legal_moves = result.moves;
+        }
+    }
 }
+
+// get the state of the game and show it
+// since: the ply shown now; null to always get the whole board
+async function load_state(since){
+    var game_id = document.getElementById("game_id").innerHTML;
+    var url = `/api/games/${game_id}/state`;
+    if (since !== null){
+        url = url.concat(`?since=${since}`);
+    }
+
+    var response = await fetch(url);
+    if (response.status != 200){
+        location.href = `/games/${game_id}/play`;
+        return;
+    }
+    show_state(await response.json());
+}
+
+// update the page with the state returned by /api/games/<game_id>/state
+// the whole board (tiles), or the tiles changed after ply since (changes)
+function show_state(state){
+    if (state.tiles){
+        tiles = state.tiles;
+    } else if (state.changes && state.since <= current_ply() && current_ply() < state.ply){
+        for (var change of state.changes){
+            var square = change[0] * 8 + change[1];
+            tiles = tiles.substring(0, square).concat(change[2], tiles.substring(square + 1));
+        }
+    } else {
+        // nothing changed, or the moves are shown already
+        return;
+    }
+
+    var my_color = document.getElementById("my_color").innerHTML;
+    var my_pieces = (my_color == "w") ? white_pieces : black_pieces;
+    var my_turn = state.status < 4 && state.next_move_color == my_color;
+
+    // the board
+    move_from = "";
+    move_to = "";
+    for (var i = 0 ; i < 8; i++){
+        for (var j = 0; j < 8; j++){
+            var piece = tiles[i * 8 + j];
+            var e_tile = document.getElementById(i.toString().concat(j.toString()));
+            e_tile.innerHTML = piece_ucodes[piece];
+            e_tile.classList.remove("active", "pointer", "target");
+            if (my_turn && my_pieces.includes(piece)){
+                e_tile.setAttribute("onclick", "grab(this)");
+                e_tile.classList.add("pointer");
+            } else {
+                e_tile.setAttribute("onclick", "");
+            }
+        }
+    }
+
+    // move number, last move and status
+    document.getElementById("ply").innerHTML = state.ply;
+    document.getElementById("move_number").innerHTML = Math.floor((state.ply + 1) / 2);
+    if (state.last_move){
+        var move = state.last_move.move;
+        document.getElementById("last_move_piece").innerHTML = piece_ucodes[state.last_move.piece];
+        document.getElementById("last_move").innerHTML = column_names[move[1]].concat(move[0] + 1, column_names[move[3]], move[2] + 1);
+    }
+    document.getElementById("status_text").innerHTML = status_texts[state.status] || "";
+
+    legal_moves = null;
+    if (my_turn){
+        load_legal_moves();
+    }
+
+    // whose turn it is
+    var e_dot = document.getElementById("my_dot");
+    if (e_dot){
+        e_dot.className = my_turn ? "greendot" : "reddot";
+    }
+    var e_turn = document.getElementById("turn_text");
+    if (state.status >= 4){
+        e_turn.innerHTML = "";
+    } else if (my_turn){
+        e_turn.innerHTML = "It is your turn";
+    } else {
+        e_turn.innerHTML = `It is ${document.getElementById("opponent_first_name").innerHTML}'s turn`;
+    }
+}
+
+// listen for moves in this game (Server-Sent Events)
+// the next move is shown with the tiles it changed;
+// when moves have been missed, the state after the ply shown is loaded
+function listen(){
+    var game_id = document.getElementById("game_id").innerHTML;
+    var events = new EventSource(`/api/games/${game_id}/events`);
+
+    // sent when the stream is (re)opened: moves may have been missed
+    events.addEventListener("game", function(event){
+        if (JSON.parse(event.data).ply != current_ply()){
+            load_state(current_ply());
+        }
+    });
+
+    events.addEventListener("move", function(event){
+        var move = JSON.parse(event.data);
+        if (move.ply == current_ply() + 1){
+            show_state({
+                ply: move.ply,
+                status: move.status,
+                since: current_ply(),
+                changes: move.changes,
+                next_move_color: (move.ply % 2 == 0) ? "w" : "b",
+                last_move: {piece: move.piece, move: move.move}
+            });
+        } else if (move.ply > current_ply()){
+            load_state(current_ply());
+        }
+    });
+}
+
+listen();
+load_legal_moves();
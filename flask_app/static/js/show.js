@@ -0,0 +1,69 @@
+// step through the moves of a completed game
+// positions are loaded from /api/games/<game_id>/position and kept in memory
+
+var game_id = document.getElementById("game_id").innerHTML;
+// the position shown, and the number of moves of the game
+var max_ply = parseInt(document.getElementById("ply").innerHTML);
+var ply = max_ply;
+// ply -> position, as returned by the server
+var positions = {};
+// the status shown after the last move (check mate, draw, ...)
+var final_status_text = document.getElementById("status_text").innerHTML;
+
+// unicode characters of the pieces, same codes as games.tiles
+var piece_ucodes = {
+    "0": "", 
+    "1": "♔", "2": "♕", "3": "♗", "4": "♘", "5": "♖", "6": "♙",
+    "7": "♚", "8": "♛", "9": "♝", "A": "♞", "B": "♜", "C": "♟"
+};
+// column 0 is the h-file
+var column_names = "hgfedcba";
+
+function step(delta){
+    go_to(ply + delta);
+}
+
+async function go_to(new_ply){
+    new_ply = Math.max(0, Math.min(new_ply, max_ply));
+    if (!(new_ply in positions)){
+        var response = await fetch(`/api/games/${game_id}/position?ply=${new_ply}`);
+        if (response.status != 200){
+            return;
+        }
+        positions[new_ply] = await response.json();
+    }
+    ply = new_ply;
+    show_position(positions[new_ply]);
+}
+
+function show_position(position){
+    for (var i = 0 ; i < 8; i++){
+        for (var j = 0; j < 8; j++){
+            var e_tile = document.getElementById(i.toString().concat(j.toString()));
+            e_tile.innerHTML = piece_ucodes[position.tiles[i * 8 + j]];
+            e_tile.classList.remove("active");
+        }
+    }
+
+    document.getElementById("move_number").innerHTML = Math.floor((position.ply + 1) / 2);
+    if (position.last_move){
+        var move = position.last_move.move;
+        document.getElementById("last_move_piece").innerHTML = piece_ucodes[position.last_move.piece];
+        document.getElementById("last_move").innerHTML = column_names[move[1]].concat(move[0] + 1, column_names[move[3]], move[2] + 1);
+        document.getElementById(`${move[0]}${move[1]}`).classList.add("active");
+        document.getElementById(`${move[2]}${move[3]}`).classList.add("active");
+    } else {
+        document.getElementById("last_move_piece").innerHTML = "";
+        document.getElementById("last_move").innerHTML = "";
+    }
+    document.getElementById("status_text").innerHTML = (position.ply == max_ply) ? final_status_text : "";
+}
+
+// arrow keys step through the game
+document.addEventListener("keydown", function(event){
+    if (event.key == "ArrowLeft"){
+        step(-1);
+    } else if (event.key == "ArrowRight"){
+        step(1);
+    }
+});
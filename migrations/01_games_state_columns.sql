@@ -0,0 +1,37 @@
+-- ****************************************************************************
+--
+-- games: store the state of the game next to the tiles,
+-- so that a position can be validated after a single primary key read
+--
+-- ply:          number of moves made, each player's move counts as 1
+--               (white has the next move if ply is even)
+-- castling:     castling rights as a 4 bit mask (see GameState.castling_rights)
+--               1: white king and rook 0 have not moved
+--               2: white king and rook 7 have not moved
+--               4: black king and rook 0 have not moved
+--               8: black king and rook 7 have not moved
+-- last_piece:   the piece of the last move (needed for en passant capture)
+-- last_from_to: the last move as 4 digits: from_row, from_column, to_row, to_column
+--
+-- ****************************************************************************
+
+ALTER TABLE games
+    ADD COLUMN ply INT NOT NULL DEFAULT 0 AFTER tiles,
+    ADD COLUMN castling TINYINT NOT NULL DEFAULT 15 AFTER ply,
+    ADD COLUMN last_piece CHAR(1) NULL AFTER castling,
+    ADD COLUMN last_from_to CHAR(4) NULL AFTER last_piece;
+
+-- fill the new columns for existing games from the moves table
+
+UPDATE games SET ply = (SELECT COUNT(*) FROM moves WHERE moves.game_id = games.id);
+
+UPDATE games SET castling =
+      IF(EXISTS (SELECT id FROM moves WHERE game_id = games.id AND from_row = 0 AND from_column IN (3, 0)), 0, 1)
+    + IF(EXISTS (SELECT id FROM moves WHERE game_id = games.id AND from_row = 0 AND from_column IN (3, 7)), 0, 2)
+    + IF(EXISTS (SELECT id FROM moves WHERE game_id = games.id AND from_row = 7 AND from_column IN (3, 0)), 0, 4)
+    + IF(EXISTS (SELECT id FROM moves WHERE game_id = games.id AND from_row = 7 AND from_column IN (3, 7)), 0, 8);
+
+UPDATE games
+    JOIN moves ON moves.id = (SELECT MAX(m.id) FROM moves m WHERE m.game_id = games.id)
+    SET games.last_piece = moves.piece,
+        games.last_from_to = CONCAT(moves.from_row, moves.from_column, moves.to_row, moves.to_column);
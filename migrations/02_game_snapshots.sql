@@ -0,0 +1,24 @@
+-- ****************************************************************************
+--
+-- game_snapshots: the state of a game every SNAPSHOT_INTERVAL plies
+-- (see Game.position_at), so that any earlier position of a game
+-- is found by replaying at most SNAPSHOT_INTERVAL - 1 moves
+--
+-- the columns have the same meaning as the columns of games
+-- snapshots are written by Game.make_move, and for older games
+-- the first time one of their positions is requested
+--
+-- ****************************************************************************
+
+CREATE TABLE IF NOT EXISTS game_snapshots (
+    game_id INT NOT NULL,
+    ply INT NOT NULL,
+    tiles CHAR(64) NOT NULL,
+    castling TINYINT NOT NULL,
+    last_piece CHAR(1) NULL,
+    last_from_to CHAR(4) NULL,
+    PRIMARY KEY (game_id, ply),
+    CONSTRAINT fk_game_snapshots_games
+        FOREIGN KEY (game_id) REFERENCES games (id)
+        ON DELETE CASCADE
+);
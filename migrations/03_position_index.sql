@@ -0,0 +1,27 @@
+-- ****************************************************************************
+--
+-- position_index: for every position reached in a game (its Zobrist hash,
+-- see zobrist.py) the moves that were played from it, with their results
+-- (see PositionIndex and the opening explorer, /api/explorer)
+--
+-- position_hash: GameState.hash before the move
+-- move:          the move as a 16-bit code (see move_encoding.py)
+-- games:         number of times the move was played in this position
+-- white_wins, black_wins, draws: the games in which the move was played in this position
+--                that ended with this result, each game counted once
+--                (games that are not finished, or were resigned, have no result)
+--
+-- rows are updated by Game.make_move and Game.import_pgn; for existing games the table is filled with
+--     FLASK_APP=server flask build-position-index
+--
+-- ****************************************************************************
+
+CREATE TABLE IF NOT EXISTS position_index (
+    position_hash BIGINT UNSIGNED NOT NULL,
+    move SMALLINT UNSIGNED NOT NULL,
+    games INT NOT NULL DEFAULT 0,
+    white_wins INT NOT NULL DEFAULT 0,
+    black_wins INT NOT NULL DEFAULT 0,
+    draws INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (position_hash, move)
+);
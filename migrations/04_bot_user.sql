@@ -0,0 +1,15 @@
+-- ****************************************************************************
+--
+-- the computer opponent (see models/bot.py) is a user like the others,
+-- so that it can be invited to a game
+-- its email is app.config["BOT_EMAIL"]
+--
+-- nobody can log in as the bot: the password hash is the hash of
+-- a random password that was not kept
+--
+-- ****************************************************************************
+
+INSERT INTO users (first_name, last_name, email, hashed_pwd)
+    SELECT 'Computer', 'Bot', 'bot@chess.local', '$2b$12$vp5n6TdCiahYcDU4Kc8kgeLjvpgd4FqbKYrgJRh/Pqe7LWM1MBKCm'
+    FROM DUAL
+    WHERE NOT EXISTS (SELECT id FROM users WHERE email = 'bot@chess.local');
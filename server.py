@@ -1,6 +1,6 @@
 from flask_app import app
 
-from flask_app.controllers import users_controller, games_controller
+from flask_app.controllers import users_controller, games_controller, admin_controller
 
 if __name__ == '__main__':
     app.run(debug=True, port=5001)    
@@ -0,0 +1,8 @@
+# serve the app with asyncio, see flask_app/asgi.py
+# needs: pip install -r requirements-asgi.txt
+# or run: uvicorn server_asgi:application --port 5001
+from flask_app.asgi import application
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(application, port=5001)